@@ -133,15 +133,21 @@ def admin_dashboard(request):
         messages.error(request, 'Access denied! Admin only.')
         return redirect('trains:home')
     
-    from trains.models import Train, Station, Route, TrainSchedule
-    from bookings.models import Payment
+    from trains.models import Train
+    from trains.search_cache import search_cache_stats
+    from bookings.stats import dashboard_stats
+    from bookings.export import EXPORT_FORMATS
     
+    stats = dashboard_stats()
     context = {
-        'total_trains': Train.objects.count(),
-        'total_stations': Station.objects.count(),
-        'total_routes': Route.objects.count(),
-        'total_bookings': Payment.objects.count(),
+        'total_trains': stats['counts']['trains'],
+        'total_stations': stats['counts']['stations'],
+        'total_routes': stats['counts']['routes'],
+        'confirmed_bookings': stats['counts']['confirmed_bookings'],
+        'stats': stats,
         'recent_trains': Train.objects.all()[:5],
+        'search_cache': search_cache_stats(),
+        'data_export_formats': list(EXPORT_FORMATS),
     }
     
     return render(request, 'accounts/admin_dashboard.html', context)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Payment
+from .models import Payment, DailySummary
 
 
 @admin.register(Payment)
@@ -21,4 +21,12 @@ class PaymentAdmin(admin.ModelAdmin):
         ('Payment Information', {
             'fields': ('payment_method', 'payment_status', 'transaction_id', 'payment_date')
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(DailySummary)
+class DailySummaryAdmin(admin.ModelAdmin):
+    list_display = ['journey_date', 'train', 'bookings', 'revenue']
+    list_filter = ['journey_date']
+    list_select_related = ['train']
+    date_hierarchy = 'journey_date'
@@ -0,0 +1,190 @@
+import csv
+import json
+from datetime import datetime, timedelta
+from itertools import islice
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from trains.models import Route, TrainSchedule
+from .manifest import Echo
+from .models import Payment, ExportWatermark
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Rows fetched per database round trip, and per Parquet row group
+EXPORT_CHUNK_SIZE = 2000
+
+# Bookings younger than this are left for the next export - booking_date is set
+# when the row is built, so a slow transaction can commit a booking older than
+# ones already exported; holding back recent rows keeps it from landing behind
+# the watermark
+EXPORT_LAG = timedelta(minutes=5)
+
+# Exportable tables - model and a stable order to stream it in
+EXPORT_TABLES = {
+    'bookings': (Payment, ['booking_date', 'pnr']),
+    'routes': (Route, ['train_id', 'sequence_order']),
+    'schedules': (TrainSchedule, ['train_id']),
+}
+
+
+def parse_watermark(text):
+    """'<booking_date ISO>|<pnr>' as (datetime, pnr) - None when malformed"""
+    if '|' not in (text or ''):
+        return None
+    booking_date_str, pnr = text.rsplit('|', 1)
+    try:
+        return datetime.fromisoformat(booking_date_str), pnr
+    except ValueError:
+        return None
+
+
+def format_watermark(watermark):
+    booking_date, pnr = watermark
+    return f'{booking_date.isoformat()}|{pnr}'
+
+
+def saved_watermark(name):
+    """Where the incremental export called name stopped last time - None before its first run"""
+    row = ExportWatermark.objects.filter(name=name).values_list('booking_date', 'pnr').first()
+    return tuple(row) if row else None
+
+
+def save_watermark(name, watermark):
+    booking_date, pnr = watermark
+    ExportWatermark.objects.update_or_create(name=name, defaults={'booking_date': booking_date, 'pnr': pnr})
+
+
+class TableExport:
+    """The rows of one table as tuples, streamed in a stable order
+
+    Rows come from values_list().iterator(chunk_size), so memory stays flat
+    however large the table. Bookings can start after a (booking_date, pnr)
+    watermark; watermark always holds the last booking streamed so far.
+    Bookings made in the last EXPORT_LAG are held back. Each booking is
+    exported once - later status changes (payment, cancellation) are not
+    picked up by an incremental export, only by a full one.
+    """
+
+    def __init__(self, table, since=None, chunk_size=EXPORT_CHUNK_SIZE):
+        self.model, self.order = EXPORT_TABLES[table]
+        self.fields = self.model._meta.concrete_fields
+        self.columns = [field.attname for field in self.fields]
+        self.since = since
+        self.watermark = since
+        self.chunk_size = chunk_size
+        self.count = 0
+        if since and self.model is not Payment:
+            raise ValueError(f'{table} has no booking_date to export incrementally')
+
+    def rows(self):
+        rows = self.model.objects.order_by(*self.order).values_list(*self.columns)
+        if self.model is Payment:
+            rows = rows.filter(booking_date__lte=timezone.now() - EXPORT_LAG)
+        if self.since:
+            booking_date, pnr = self.since
+            rows = rows.filter(Q(booking_date__gt=booking_date) | Q(booking_date=booking_date, pnr__gt=pnr))
+
+        tracks_watermark = self.model is Payment
+        if tracks_watermark:
+            date_index, pnr_index = self.columns.index('booking_date'), self.columns.index('pnr')
+        for row in rows.iterator(chunk_size=self.chunk_size):
+            self.count += 1
+            if tracks_watermark:
+                self.watermark = row[date_index], row[pnr_index]
+            yield row
+
+    def chunks(self):
+        rows = self.rows()
+        while chunk := list(islice(rows, self.chunk_size)):
+            yield chunk
+
+
+def stream_jsonl(export):
+    """One JSON object per line"""
+    for row in export.rows():
+        yield json.dumps(dict(zip(export.columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def stream_csv(export):
+    writer = csv.writer(Echo())
+    yield writer.writerow(export.columns)
+    for row in export.rows():
+        yield writer.writerow(row)
+
+
+def arrow_type(field):
+    """Arrow column type of a model field - a foreign key takes the type of what it points at"""
+    if field.is_relation:
+        field = field.target_field
+    kind = field.get_internal_type()
+    if kind == 'DecimalField':
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if kind == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC')
+    if kind == 'DateField':
+        return pa.date32()
+    if kind == 'TimeField':
+        return pa.time64('us')
+    if kind == 'BooleanField':
+        return pa.bool_()
+    if kind.endswith('IntegerField') or kind.endswith('AutoField'):
+        return pa.int64()
+    return pa.string()
+
+
+class _ByteSink:
+    """Write-only file for ParquetWriter - collects bytes until taken, counts the position"""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_parquet(export):
+    """Parquet file, one row group per chunk - yields each row group as it is written"""
+    schema = pa.schema([(field.attname, arrow_type(field)) for field in export.fields])
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    for chunk in export.chunks():
+        columns = zip(*chunk)
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+        ))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+# format -> (streaming generator, content type, file extension, binary)
+EXPORT_FORMATS = {
+    'jsonl': (stream_jsonl, 'application/x-ndjson', 'jsonl', False),
+    'csv': (stream_csv, 'text/csv', 'csv', False),
+}
+if pa is not None:
+    EXPORT_FORMATS['parquet'] = (stream_parquet, 'application/vnd.apache.parquet', 'parquet', True)
@@ -0,0 +1,87 @@
+import threading
+from django.db import connection, transaction
+from django.db.models import F
+from .models import IdSequence, Payment
+
+
+def luhn_digit(digits):
+    """Luhn check digit - catches any single wrong digit and most swaps"""
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        n = int(ch)
+        if i % 2 == 0:
+            n *= 2
+            if n > 9:
+                n -= 9
+        total += n
+    return str((10 - total % 10) % 10)
+
+
+def is_valid(identifier, prefix=''):
+    """Check the Luhn digit of a PNR or transaction ID"""
+    digits = identifier[len(prefix):]
+    return identifier.startswith(prefix) and digits.isdigit() and luhn_digit(digits[:-1]) == digits[-1]
+
+
+class IdAllocator:
+    """Sequential IDs handed out from blocks reserved in IdSequence
+
+    Each process reserves block_size numbers with one UPDATE and then hands them
+    out from memory, so IDs are unique across workers without retries and rise
+    roughly in insert order. IDs already taken by older rows in a new block are
+    skipped.
+
+    A block is only reserved outside any transaction: reserved inside one, a
+    rollback would hand the block to another process while this one kept it.
+    Asked for an ID inside a transaction with no block left, the allocator
+    reserves that one ID in the transaction instead - it rolls back together
+    with the row it was taken for.
+    """
+
+    def __init__(self, name, digits, field, prefix='', block_size=1000):
+        self.name = name
+        self.digits = digits
+        self.field = field
+        self.prefix = prefix
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._ids = []
+
+    def format(self, number):
+        body = str(number).zfill(self.digits)
+        return f'{self.prefix}{body}{luhn_digit(body)}'
+
+    def _reserve(self, count):
+        """Reserve the next count numbers - the free IDs among them, in handing-out order (last first)"""
+        IdSequence.objects.bulk_create([IdSequence(name=self.name)], ignore_conflicts=True)
+        with transaction.atomic():
+            IdSequence.objects.filter(name=self.name).update(next_value=F('next_value') + count)
+            end = IdSequence.objects.values_list('next_value', flat=True).get(name=self.name)
+        start = end - count
+
+        # Older IDs (e.g. random legacy PNRs) that fall inside this block - one range query
+        taken = set(Payment.objects.filter(**{
+            f'{self.field}__gte': self.format(start)[:-1] + '0',
+            f'{self.field}__lte': self.format(end - 1)[:-1] + '9',
+        }).values_list(self.field, flat=True))
+
+        ids = [self.format(number) for number in range(start, end)]
+        return [identifier for identifier in reversed(ids) if identifier not in taken]
+
+    def next_id(self):
+        with self._lock:
+            if not self._ids and connection.in_atomic_block:
+                ids = []
+                while not ids:
+                    ids = self._reserve(1)
+                return ids[0]
+            while not self._ids:
+                self._ids = self._reserve(self.block_size)
+            return self._ids.pop()
+
+
+# 9-digit sequence + check digit = 10-digit PNR
+pnr_allocator = IdAllocator('pnr', digits=9, field='pnr')
+
+# 'TXN' + 11-digit sequence + check digit
+transaction_id_allocator = IdAllocator('transaction_id', digits=11, field='transaction_id', prefix='TXN')
@@ -0,0 +1,360 @@
+import random
+from datetime import date, timedelta
+from time import sleep
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+from trains.models import Route, TrainClass
+from trains.search_cache import seats_changed, invalidate_seat_searches
+from .models import Payment, SeatSegment, SeatHold
+
+# A booking attempt that lost a race, or found the database busy, backs off and tries again
+RESERVE_ATTEMPTS = 6
+RESERVE_BACKOFF_SECONDS = 0.05
+CONFLICT = object()
+
+# What book_seat returns when every attempt lost a race - seats may still be free
+CONTENDED = object()
+
+
+def seat_capacity(train, seat_class=''):
+    """Number of seats sold for one class of a train
+
+    A train's seats live in exactly one set of legs: its classes, or - only
+    for a train without classes - one class-less pool of total_seats.
+    """
+    classes = train.seat_classes.all()
+    if not seat_class:
+        return 0 if classes else train.total_seats
+    return next((c.capacity for c in classes if c.seat_class == seat_class), 0)
+
+
+def pick_seat_class(train, journey_date, origin_seq, dest_seq):
+    """Class a booking made without one sells from - the cheapest class with a seat free on every leg
+
+    '' for a train without classes. When every class is full the cheapest is
+    returned, so the booking fails as sold out.
+    """
+    classes = sorted(train.seat_classes.all(), key=lambda c: (c.fare_multiplier, c.seat_class))
+    if not classes:
+        return ''
+    for train_class in classes:
+        if available_seats(train, journey_date, train_class.seat_class, origin_seq, dest_seq):
+            return train_class.seat_class
+    return classes[0].seat_class
+
+
+def to_mask(occupied):
+    return int.from_bytes(bytes(occupied), 'little')
+
+
+def to_bytes(mask, capacity):
+    return mask.to_bytes((capacity + 7) // 8, 'little')
+
+
+def _segments(train, journey_date, seat_class, origin_seq, dest_seq):
+    """Legs between origin and destination - a leg is keyed by the sequence_order it starts from"""
+    return SeatSegment.objects.filter(
+        train=train,
+        journey_date=journey_date,
+        seat_class=seat_class,
+        segment__gte=origin_seq,
+        segment__lt=dest_seq,
+    )
+
+
+def free_seat_mask(capacity, occupied_masks):
+    """Seats free on every leg - one OR per leg"""
+    taken = 0
+    for mask in occupied_masks:
+        taken |= mask
+    return ((1 << capacity) - 1) & ~taken
+
+
+def available_seats(train, journey_date, seat_class, origin_seq, dest_seq):
+    """Seats free for the whole origin -> destination sub-range"""
+    masks = (to_mask(occupied) for occupied in _segments(
+        train, journey_date, seat_class, origin_seq, dest_seq
+    ).values_list('occupied', flat=True))
+    return free_seat_mask(seat_capacity(train, seat_class), masks).bit_count()
+
+
+def add_available_seats(items, journey_date, seat_class=''):
+    """Set item['available_seats'] on many search results at once - one query, two without a class
+
+    items are dicts with 'train', 'origin_route', 'dest_route' and 'capacity' as
+    returned by trains.search. Without a seat_class a train's free seats are
+    summed over its classes, and item['seat_class'] and item['fare_multiplier']
+    become the class a booking sells from, picked as pick_seat_class does.
+    """
+    train_ids = {item['train'].id for item in items}
+    if seat_class:
+        pools = {train_id: [(seat_class, None, None)] for train_id in train_ids}
+    else:
+        pools = {}
+        for train_id, name, coaches, seats, multiplier in TrainClass.objects.filter(
+            train_id__in=train_ids
+        ).order_by('fare_multiplier', 'seat_class').values_list(
+            'train_id', 'seat_class', 'coach_count', 'seats_per_coach', 'fare_multiplier'
+        ):
+            pools.setdefault(train_id, []).append((name, coaches * seats, multiplier))
+
+    masks_by_pool = {}
+    rows = SeatSegment.objects.filter(train__in=train_ids, journey_date=journey_date)
+    if seat_class:
+        rows = rows.filter(seat_class=seat_class)
+    for train_id, pool, segment, occupied in rows.values_list('train_id', 'seat_class', 'segment', 'occupied'):
+        masks_by_pool.setdefault((train_id, pool), []).append((segment, to_mask(occupied)))
+
+    for item in items:
+        train = item['train']
+        origin_seq = item['origin_route'].sequence_order
+        dest_seq = item['dest_route'].sequence_order
+        item['available_seats'] = 0
+        item['seat_class'] = seat_class
+        # Cheapest class first - the first with a free seat, or the cheapest when all are full
+        picked = None
+        for pool, capacity, multiplier in pools.get(train.id) or [('', None, None)]:
+            masks = (
+                mask for segment, mask in masks_by_pool.get((train.id, pool), [])
+                if origin_seq <= segment < dest_seq
+            )
+            free = free_seat_mask(item['capacity'] if capacity is None else capacity, masks).bit_count()
+            item['available_seats'] += free
+            if multiplier is not None and (picked is None or free and not picked[2]):
+                picked = (pool, multiplier, free)
+        if picked:
+            item['seat_class'], item['fare_multiplier'] = picked[:2]
+    return items
+
+
+def book_seat(train, journey_date, seat_class, origin_seq, dest_seq, make_booking):
+    """Take the lowest seat free on every leg of the sub-range and book it - one transaction per attempt
+
+    make_booking(seat_number) runs in the transaction that took the seat, so the
+    seat and whatever it returns (e.g. the Payment) commit or roll back together.
+    Returns that, None when sold out, or CONTENDED when every attempt lost a
+    race or found the database locked. Call it outside any transaction: attempts
+    back off exponentially with jitter, and never sleep inside one.
+    """
+    legs = list(Route.objects.filter(
+        train=train,
+        sequence_order__gte=origin_seq,
+        sequence_order__lt=dest_seq,
+    ).values_list('sequence_order', flat=True))
+    if not legs:
+        return None
+
+    for attempt in range(RESERVE_ATTEMPTS):
+        if attempt and not connection.in_atomic_block:
+            sleep(random.uniform(0, RESERVE_BACKOFF_SECONDS * 2 ** attempt))
+        try:
+            with transaction.atomic():
+                # A write first, so SQLite takes the write lock up front and waits
+                # for it, rather than failing to upgrade a read lock half way through
+                SeatSegment.objects.bulk_create([
+                    SeatSegment(train=train, journey_date=journey_date, seat_class=seat_class, segment=leg)
+                    for leg in legs
+                ], ignore_conflicts=True)
+                seat_number = _try_reserve_seat(train, journey_date, seat_class, origin_seq, dest_seq)
+                if seat_number is None:
+                    return None
+                if seat_number is not CONFLICT:
+                    return make_booking(seat_number)
+        except OperationalError:
+            # Busy past the database timeout - the attempt rolled back, treated like a lost race
+            continue
+    return CONTENDED
+
+
+def reserve_seat(train, journey_date, seat_class, origin_seq, dest_seq):
+    """Take the lowest seat free on every leg of the sub-range - the seat number, None or CONTENDED"""
+    return book_seat(train, journey_date, seat_class, origin_seq, dest_seq, lambda seat_number: seat_number)
+
+
+@transaction.atomic
+def _try_reserve_seat(train, journey_date, seat_class, origin_seq, dest_seq):
+    """One reservation attempt - Returns a seat number, None when sold out, or CONFLICT"""
+    segments = list(_segments(train, journey_date, seat_class, origin_seq, dest_seq).select_for_update())
+
+    capacity = seat_capacity(train, seat_class)
+    free = free_seat_mask(capacity, (to_mask(segment.occupied) for segment in segments))
+    if not free:
+        return None
+
+    # Write each leg only if nobody changed it since we read it
+    seat_bit = free & -free
+    for segment in segments:
+        updated = SeatSegment.objects.filter(
+            pk=segment.pk,
+            occupied=bytes(segment.occupied),
+        ).update(occupied=to_bytes(to_mask(segment.occupied) | seat_bit, capacity))
+        if not updated:
+            transaction.set_rollback(True)
+            return CONFLICT
+
+    seats_left = free.bit_count()
+    seats_changed(train.id, journey_date, seats_left, seats_left - 1)
+    return seat_bit.bit_length()
+
+
+def _clear_seats(segment, seat_bits, capacity):
+    """Clear seat bits on one leg - compare-and-swap, re-reading the leg if it changed"""
+    while True:
+        updated = SeatSegment.objects.filter(
+            pk=segment.pk,
+            occupied=bytes(segment.occupied),
+        ).update(occupied=to_bytes(to_mask(segment.occupied) & ~seat_bits, capacity))
+        if updated:
+            return
+        segment.refresh_from_db(fields=['occupied'])
+
+
+@transaction.atomic
+def release_seat(train, journey_date, seat_class, origin_seq, dest_seq, seat_number):
+    """Give a seat back on every leg of the sub-range"""
+    capacity = seat_capacity(train, seat_class)
+    for segment in _segments(train, journey_date, seat_class, origin_seq, dest_seq):
+        _clear_seats(segment, 1 << (seat_number - 1), capacity)
+    invalidate_seat_searches(train.id, journey_date)
+
+
+# ==================== RE-SEQUENCED ROUTES ====================
+
+def _leg_spans(stops):
+    """(sequence_order, start km, end km) of each leg - stops are (sequence_order, km) in route order"""
+    return [(seq, km, next_km) for (seq, km), (_, next_km) in zip(stops, stops[1:])]
+
+
+def _overlaps(start, end, other_start, other_end):
+    """Two stretches of track share some distance - a zero-length leg counts where it sits"""
+    if start == end:
+        return other_start <= start <= other_end
+    return start < other_end and other_start < end
+
+
+def _covering_stops(stops, start_km, end_km):
+    """Sequence numbers of the stops just outside start_km..end_km"""
+    origin = max((seq for seq, km in stops if km <= start_km), default=stops[0][0])
+    destination = min((seq for seq, km in stops if km >= end_km), default=stops[-1][0])
+    return origin, destination
+
+
+@transaction.atomic
+def move_seat_legs(train, old_stops, new_stops):
+    """Carry sold and held seats over to a re-sequenced route - call in the transaction that rewrote it
+
+    Legs are keyed by sequence_order, so once stops are inserted, removed or
+    renumbered each new leg takes the seats of every old leg on the same
+    stretch of track (by distance from origin): a leg split by a new stop
+    keeps its seats on both halves, merged legs keep the seats of either.
+    Holds get the numbers of the new stops around their stretch. old_stops
+    and new_stops are (sequence_order, km) lists in route order; journeys
+    before today are left alone.
+    """
+    old_legs, new_legs = _leg_spans(old_stops), _leg_spans(new_stops)
+    old_km = dict(old_stops)
+
+    segments = SeatSegment.objects.select_for_update().filter(train=train, journey_date__gte=date.today())
+    groups = {}
+    for journey_date, seat_class, segment, occupied in segments.values_list(
+        'journey_date', 'seat_class', 'segment', 'occupied'
+    ):
+        groups.setdefault((journey_date, seat_class), {})[segment] = to_mask(occupied)
+
+    rows = []
+    for (journey_date, seat_class), masks in groups.items():
+        capacity = seat_capacity(train, seat_class)
+        for seq, start, end in new_legs:
+            taken = 0
+            for old_seq, old_start, old_end in old_legs:
+                if old_seq in masks and _overlaps(start, end, old_start, old_end):
+                    taken |= masks[old_seq]
+            rows.append(SeatSegment(
+                train=train, journey_date=journey_date, seat_class=seat_class, segment=seq,
+                occupied=to_bytes(taken, max(capacity, taken.bit_length())),
+            ))
+    if groups:
+        segments.delete()
+        SeatSegment.objects.bulk_create(rows)
+
+    holds = []
+    for hold in SeatHold.objects.select_for_update().filter(train=train):
+        if new_stops and hold.origin_sequence in old_km and hold.destination_sequence in old_km:
+            hold.origin_sequence, hold.destination_sequence = _covering_stops(
+                new_stops, old_km[hold.origin_sequence], old_km[hold.destination_sequence]
+            )
+            holds.append(hold)
+    SeatHold.objects.bulk_update(holds, ['origin_sequence', 'destination_sequence'])
+
+    for journey_date in {journey_date for journey_date, seat_class in groups}:
+        invalidate_seat_searches(train.id, journey_date)
+
+
+# ==================== SEAT HOLDS ====================
+
+def hold_seat(payment, origin_seq, dest_seq):
+    """Keep a reserved seat only until the payment window closes"""
+    return SeatHold.objects.create(
+        payment=payment,
+        train=payment.train,
+        journey_date=payment.journey_date,
+        seat_class=payment.seat_class,
+        origin_sequence=origin_seq,
+        destination_sequence=dest_seq,
+        seat_number=payment.seat_number,
+        expires_at=timezone.now() + timedelta(minutes=settings.SEAT_HOLD_MINUTES),
+    )
+
+
+@transaction.atomic
+def release_holds(holds):
+    """Release many holds at once - one pass over the legs of each (train, date, class)
+
+    The seats go back to inventory, the bookings are marked failed/cancelled and
+    the holds are deleted. Holds of bookings paid meanwhile are deleted with
+    their seats kept. Returns the number of holds released.
+    """
+    holds = list(holds.select_related('train'))
+    if not holds:
+        return 0
+
+    # Expire the unpaid bookings first - a booking paid in the meantime keeps its seat
+    pnrs = [hold.payment_id for hold in holds]
+    Payment.objects.filter(pnr__in=pnrs, payment_status='pending').update(
+        payment_status='failed',
+        booking_status='cancelled',
+    )
+    expired = set(Payment.objects.filter(pnr__in=pnrs, payment_status='failed').values_list('pnr', flat=True))
+    hold_ids = [hold.pk for hold in holds]
+    holds = [hold for hold in holds if hold.payment_id in expired]
+
+    groups = {}
+    for hold in holds:
+        groups.setdefault((hold.train_id, hold.journey_date, hold.seat_class), []).append(hold)
+
+    for (train_id, journey_date, seat_class), group in groups.items():
+        capacity = seat_capacity(group[0].train, seat_class)
+        segments = SeatSegment.objects.filter(
+            train_id=train_id,
+            journey_date=journey_date,
+            seat_class=seat_class,
+            segment__gte=min(hold.origin_sequence for hold in group),
+            segment__lt=max(hold.destination_sequence for hold in group),
+        )
+        for segment in segments:
+            seat_bits = 0
+            for hold in group:
+                if hold.origin_sequence <= segment.segment < hold.destination_sequence:
+                    seat_bits |= 1 << (hold.seat_number - 1)
+            if seat_bits:
+                _clear_seats(segment, seat_bits, capacity)
+        invalidate_seat_searches(train_id, journey_date)
+
+    SeatHold.objects.filter(pk__in=hold_ids).delete()
+    return len(holds)
+
+
+def release_expired_holds(now=None):
+    """Release every hold past its expiry - an indexed range scan on expires_at"""
+    return release_holds(SeatHold.objects.filter(expires_at__lte=now or timezone.now()))
@@ -0,0 +1,62 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from bookings.export import (
+    EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORT_TABLES, TableExport,
+    format_watermark, parse_watermark, save_watermark, saved_watermark,
+)
+
+
+class Command(BaseCommand):
+    help = 'Stream a table (bookings, routes, schedules) as JSON Lines, CSV or Parquet - bookings incrementally'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(EXPORT_TABLES))
+        parser.add_argument('--format', default='jsonl', choices=['jsonl', 'csv', 'parquet'])
+        parser.add_argument('--output', help='File to write - standard output when omitted')
+        parser.add_argument('--since', metavar='BOOKING_DATE|PNR',
+                            help='Only bookings after this watermark')
+        parser.add_argument('--incremental', metavar='NAME',
+                            help='Start after the watermark saved under NAME and save the new one when done - '
+                                 'new bookings only, status changes are not re-exported')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                            help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        if options['format'] not in EXPORT_FORMATS:
+            raise CommandError('Parquet export needs pyarrow - pip install pyarrow')
+        stream, _, _, binary = EXPORT_FORMATS[options['format']]
+        if binary and not options['output']:
+            raise CommandError(f'{options["format"]} export needs --output')
+
+        since = None
+        if options['since']:
+            since = parse_watermark(options['since'])
+            if since is None:
+                raise CommandError('--since must look like <booking_date ISO>|<pnr>')
+        elif options['incremental']:
+            since = saved_watermark(options['incremental'])
+
+        try:
+            export = TableExport(options['table'], since=since, chunk_size=options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        started = time.perf_counter()
+        if options['output']:
+            with (open(options['output'], 'wb') if binary else open(options['output'], 'w', newline='')) as f:
+                for chunk in stream(export):
+                    f.write(chunk)
+        else:
+            for chunk in stream(export):
+                sys.stdout.write(chunk)
+        seconds = time.perf_counter() - started
+
+        # Only a finished export moves the watermark on
+        if options['incremental'] and export.watermark and export.watermark != since:
+            save_watermark(options['incremental'], export.watermark)
+
+        summary = f'Exported {export.count} {options["table"]} rows in {seconds:.2f}s'
+        if export.watermark:
+            summary += f' - watermark {format_watermark(export.watermark)}'
+        self.stderr.write(summary)
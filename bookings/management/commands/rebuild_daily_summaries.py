@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from bookings.stats import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily booking summaries from all Payment rows'
+
+    def handle(self, *args, **options):
+        count = rebuild_summaries()
+        self.stdout.write(self.style.SUCCESS(f'Daily summaries rebuilt: {count} train days'))
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from bookings.inventory import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Release seats held by bookings whose payment window has expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep running, reaping every SECONDS seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds()
+            self.stdout.write(f'Released {released} expired seat holds')
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
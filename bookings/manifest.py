@@ -0,0 +1,101 @@
+import csv
+import json
+import shutil
+import zipfile
+from .models import Payment
+from .tickets import open_ticket
+
+# Bookings fetched from the database per round trip while streaming
+EXPORT_CHUNK_SIZE = 500
+
+MANIFEST_FIELDS = [
+    'pnr', 'passenger', 'phone_number', 'seat_class', 'seat_number',
+    'origin', 'destination', 'total_fare', 'booking_status', 'transaction_id',
+]
+
+
+def manifest_bookings(train, journey_date):
+    """Paid, uncancelled bookings of one train run - streamed, never loaded as a list"""
+    return (
+        Payment.objects.with_journey().select_related('user')
+        .filter(train=train, journey_date=journey_date, payment_status='success')
+        .exclude(booking_status='cancelled')
+        .order_by('seat_class', 'seat_number', 'pnr')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def manifest_row(booking):
+    user = booking.user
+    return {
+        'pnr': booking.pnr,
+        'passenger': user.full_name or user.username,
+        'phone_number': user.phone_number or '',
+        'seat_class': booking.seat_class,
+        'seat_number': booking.seat_number,
+        'origin': booking.origin_station.station_code,
+        'destination': booking.destination_station.station_code,
+        'total_fare': str(booking.total_fare),
+        'booking_status': booking.booking_status,
+        'transaction_id': booking.transaction_id or '',
+    }
+
+
+class Echo:
+    """File-like object whose write() hands the data straight back"""
+
+    def write(self, value):
+        return value
+
+
+def stream_manifest_csv(bookings):
+    """CSV manifest, one encoded line per yield"""
+    writer = csv.DictWriter(Echo(), fieldnames=MANIFEST_FIELDS)
+    yield writer.writeheader()
+    for booking in bookings:
+        yield writer.writerow(manifest_row(booking))
+
+
+def stream_manifest_json(bookings):
+    """JSON array of manifest rows, one row per yield"""
+    yield '['
+    separator = ''
+    for booking in bookings:
+        yield separator + json.dumps(manifest_row(booking))
+        separator = ','
+    yield ']'
+
+
+class _ZipBuffer:
+    """Unseekable sink for ZipFile - collects what was written until taken"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_tickets_zip(bookings):
+    """ZIP of every booking's PDF ticket - yields each entry as soon as it is written
+
+    Tickets come from the ticket cache, so only missing ones are rendered.
+    The archive is never held in memory as a whole.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for booking in bookings:
+            with open_ticket(booking) as ticket, archive.open(f'ticket-{booking.pnr}.pdf', 'w') as entry:
+                shutil.copyfileobj(ticket, entry)
+            yield buffer.take()
+    # Closing wrote the central directory
+    yield buffer.take()
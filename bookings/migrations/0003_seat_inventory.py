@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0002_payment_booking_status'),
+        ('trains', '0002_routepair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='seat_class',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='seat_number',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='SeatSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journey_date', models.DateField()),
+                ('seat_class', models.CharField(blank=True, default='', max_length=20)),
+                ('segment', models.IntegerField(help_text='sequence_order of the stop this leg starts from')),
+                ('occupied', models.BinaryField(default=b'')),
+                ('train', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_segments', to='trains.train')),
+            ],
+            options={
+                'verbose_name': 'Seat Segment',
+                'verbose_name_plural': 'Seat Segments',
+                'ordering': ['train', 'journey_date', 'seat_class', 'segment'],
+                'unique_together': {('train', 'journey_date', 'seat_class', 'segment')},
+            },
+        ),
+    ]
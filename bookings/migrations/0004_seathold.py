@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0003_seat_inventory'),
+        ('trains', '0002_routepair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journey_date', models.DateField()),
+                ('seat_class', models.CharField(blank=True, default='', max_length=20)),
+                ('origin_sequence', models.IntegerField()),
+                ('destination_sequence', models.IntegerField()),
+                ('seat_number', models.IntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='seat_hold', to='bookings.payment')),
+                ('train', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_holds', to='trains.train')),
+            ],
+            options={
+                'verbose_name': 'Seat Hold',
+                'verbose_name_plural': 'Seat Holds',
+                'ordering': ['expires_at'],
+            },
+        ),
+    ]
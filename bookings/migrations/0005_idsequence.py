@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0004_seathold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('name', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+            options={
+                'verbose_name': 'ID Sequence',
+                'verbose_name_plural': 'ID Sequences',
+            },
+        ),
+    ]
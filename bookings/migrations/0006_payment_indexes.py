@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0005_idsequence'),
+        ('trains', '0003_route_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', '-booking_date', '-pnr'], name='payment_user_booked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['train', 'journey_date'], name='payment_train_date_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_daily_summaries(apps, schema_editor):
+    """Summarise the bookings made so far"""
+    Payment = apps.get_model('bookings', 'Payment')
+    DailySummary = apps.get_model('bookings', 'DailySummary')
+    totals = (
+        Payment.objects.filter(payment_status='success').exclude(booking_status='cancelled').order_by()
+        .values('train_id', 'journey_date')
+        .annotate(bookings=Count('pnr'), revenue=Sum('total_fare'))
+    )
+    DailySummary.objects.bulk_create([DailySummary(**row) for row in totals], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_payment_indexes'),
+        ('trains', '0005_trainclass'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journey_date', models.DateField()),
+                ('bookings', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('train', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to='trains.train')),
+            ],
+            options={
+                'verbose_name': 'Daily Summary',
+                'verbose_name_plural': 'Daily Summaries',
+                'ordering': ['journey_date', 'train'],
+                'indexes': [models.Index(fields=['journey_date'], name='summary_date_idx')],
+                'unique_together': {('train', 'journey_date')},
+            },
+        ),
+        migrations.RunPython(fill_daily_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_daily_summary'),
+        ('trains', '0005_trainclass'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('booking_date', models.DateTimeField()),
+                ('pnr', models.CharField(max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Export Watermark',
+                'verbose_name_plural': 'Export Watermarks',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['booking_date', 'pnr'], name='payment_booked_idx'),
+        ),
+    ]
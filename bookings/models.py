@@ -1,13 +1,34 @@
+from decimal import Decimal
 from django.db import models
 from django.conf import settings
 from trains.models import Train, Station, TrainSchedule
-import random
-import string
+from trains.fares import tax_and_total
 
 
 def generate_pnr():
     """Generate unique 10-digit PNR"""
-    return ''.join(random.choices(string.digits, k=10))
+    from .ids import pnr_allocator
+    return pnr_allocator.next_id()
+
+
+class IdSequence(models.Model):
+    """Named counter that hands out blocks of IDs to worker processes"""
+    name = models.CharField(max_length=30, primary_key=True)
+    next_value = models.BigIntegerField(default=1)
+    
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+    
+    class Meta:
+        verbose_name = 'ID Sequence'
+        verbose_name_plural = 'ID Sequences'
+
+
+class PaymentQuerySet(models.QuerySet):
+    
+    def with_journey(self):
+        """Load everything a booking page renders in the same query"""
+        return self.select_related('train', 'origin_station', 'destination_station')
 
 
 class Payment(models.Model):
@@ -54,24 +75,110 @@ class Payment(models.Model):
     total_fare = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     booking_status = models.CharField(max_length=20, choices=BOOKING_STATUS_CHOICES, default='booked')
 
+    # Seat Details
+    seat_class = models.CharField(max_length=20, blank=True, default='')
+    seat_number = models.IntegerField(null=True, blank=True)
+
     # Payment Details
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES, blank=True, null=True)
     payment_status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     transaction_id = models.CharField(max_length=50, unique=True, blank=True, null=True)
     payment_date = models.DateTimeField(null=True, blank=True)
     
+    objects = PaymentQuerySet.as_manager()
+    
 
     
     def __str__(self):
         return f"PNR: {self.pnr} - {self.user.username} - {self.train.train_name}"
     
     def calculate_fare(self):
-        """Calculate total fare"""
-        self.tax = (self.base_fare + self.reservation_charge) * 0.05  # 5% tax
-        self.total_fare = self.base_fare + self.reservation_charge + self.tax
+        """Calculate tax and total fare"""
+        self.tax, self.total_fare = tax_and_total(Decimal(self.base_fare), Decimal(self.reservation_charge))
         self.save()
     
     class Meta:
         ordering = ['-booking_date']
+        indexes = [
+            models.Index(fields=['user', '-booking_date', '-pnr'], name='payment_user_booked_idx'),
+            models.Index(fields=['train', 'journey_date'], name='payment_train_date_idx'),
+            models.Index(fields=['booking_date', 'pnr'], name='payment_booked_idx'),
+        ]
         verbose_name = 'Payment/Booking'
-        verbose_name_plural = 'Payments/Bookings'
\ No newline at end of file
+        verbose_name_plural = 'Payments/Bookings'
+
+
+class SeatSegment(models.Model):
+    """Seat occupancy of one route leg on one journey date - Bit N of occupied = seat N+1 taken"""
+    
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='seat_segments')
+    journey_date = models.DateField()
+    seat_class = models.CharField(max_length=20, blank=True, default='')
+    segment = models.IntegerField(help_text="sequence_order of the stop this leg starts from")
+    occupied = models.BinaryField(default=b'')
+    
+    def __str__(self):
+        return f"{self.train.train_name} {self.journey_date} {self.seat_class or 'General'} (Leg: {self.segment})"
+    
+    class Meta:
+        ordering = ['train', 'journey_date', 'seat_class', 'segment']
+        unique_together = ['train', 'journey_date', 'seat_class', 'segment']
+        verbose_name = 'Seat Segment'
+        verbose_name_plural = 'Seat Segments'
+
+
+class SeatHold(models.Model):
+    """Seat held for a booking until payment - Released by the reaper once expires_at passes"""
+    
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='seat_hold')
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='seat_holds')
+    journey_date = models.DateField()
+    seat_class = models.CharField(max_length=20, blank=True, default='')
+    origin_sequence = models.IntegerField()
+    destination_sequence = models.IntegerField()
+    seat_number = models.IntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"Hold for PNR {self.payment_id} (Seat {self.seat_number}) until {self.expires_at}"
+    
+    class Meta:
+        ordering = ['expires_at']
+        verbose_name = 'Seat Hold'
+        verbose_name_plural = 'Seat Holds'
+
+
+class DailySummary(models.Model):
+    """Confirmed bookings and revenue of one train on one journey date - Kept current on Payment save"""
+    
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='daily_summaries')
+    journey_date = models.DateField()
+    bookings = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    def __str__(self):
+        return f"{self.train.train_name} on {self.journey_date}: {self.bookings} bookings"
+    
+    class Meta:
+        ordering = ['journey_date', 'train']
+        unique_together = ['train', 'journey_date']
+        indexes = [
+            models.Index(fields=['journey_date'], name='summary_date_idx'),
+        ]
+        verbose_name = 'Daily Summary'
+        verbose_name_plural = 'Daily Summaries'
+
+
+class ExportWatermark(models.Model):
+    """Last booking an incremental export has delivered - the next one starts after it"""
+    name = models.CharField(max_length=50, primary_key=True)
+    booking_date = models.DateTimeField()
+    pnr = models.CharField(max_length=10)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name}: {self.booking_date} / {self.pnr}"
+    
+    class Meta:
+        verbose_name = 'Export Watermark'
+        verbose_name_plural = 'Export Watermarks'
@@ -0,0 +1,65 @@
+"""Minimal PDF writer - one A4 page of text in the built-in Helvetica fonts
+
+Enough for tickets without a PDF library: PDF 1.4, no images, Latin-1 text.
+"""
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+
+FONTS = {
+    False: b'/F1',  # Helvetica
+    True: b'/F2',   # Helvetica-Bold
+}
+
+
+def _escape(text):
+    """Text as a PDF string literal - characters outside Latin-1 become '?'"""
+    raw = str(text).encode('latin-1', errors='replace')
+    return b'(' + raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _content_stream(lines):
+    """Drawing operators for lines of (text, size, bold) from the top of the page down
+
+    An empty text draws a horizontal rule.
+    """
+    ops = []
+    y = PAGE_HEIGHT - MARGIN
+    for text, size, bold in lines:
+        y -= size * 1.5
+        if text:
+            ops.append(b'BT %s %d Tf 1 0 0 1 %d %.1f Tm %s Tj ET' % (FONTS[bold], size, MARGIN, y, _escape(text)))
+        else:
+            ops.append(b'0.8 G %d %.1f m %d %.1f l S 0 G' % (MARGIN, y + size, PAGE_WIDTH - MARGIN, y + size))
+    return b'\n'.join(ops)
+
+
+def build_pdf(lines, title=''):
+    """A one-page PDF document as bytes"""
+    content = _content_stream(lines)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 5 0 R /F2 6 0 R >> >> >>' % (PAGE_WIDTH, PAGE_HEIGHT),
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        b'<< /Title %s /Producer (Bangladesh Railway) >>' % _escape(title),
+    ]
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+        len(objects) + 1, len(objects), xref
+    )
+    return bytes(out)
@@ -0,0 +1,66 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from .models import Payment, SeatHold
+from .stats import apply_booking_change, booking_contribution, recount_summary
+from .tickets import invalidate_ticket
+
+SUMMARY_FIELDS = {'train_id', 'journey_date', 'payment_status', 'booking_status', 'total_fare'}
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def booking_changed(sender, instance, **kwargs):
+    """A changed booking needs a freshly rendered ticket"""
+    invalidate_ticket(instance.pnr)
+
+
+@receiver(post_init, sender=Payment)
+def remember_booking(sender, instance, **kwargs):
+    """Note what a loaded booking counts for in the daily summary
+
+    Kept on the instance rather than re-read in pre_save: the payment view claims
+    a booking with update() before saving it, so the row already looks paid.
+    """
+    if SUMMARY_FIELDS.isdisjoint(instance.get_deferred_fields()):
+        instance._summary_contribution = booking_contribution(instance)
+
+
+@receiver(post_init, sender=Payment)
+def remember_payment_status(sender, instance, **kwargs):
+    """Note whether a loaded booking was already paid - the hold goes when it becomes paid"""
+    if 'payment_status' not in instance.get_deferred_fields():
+        instance._was_paid = instance.payment_status == 'success'
+
+
+@receiver(post_save, sender=Payment)
+def drop_paid_hold(sender, instance, **kwargs):
+    """A paid seat is no longer held - however the booking was marked paid
+
+    Like the summary, this trusts the status seen at load rather than the row:
+    the payment view claims a booking with update() before saving it.
+    """
+    if instance.payment_status == 'success' and not getattr(instance, '_was_paid', False):
+        SeatHold.objects.filter(payment_id=instance.pnr).delete()
+    instance._was_paid = instance.payment_status == 'success'
+
+
+@receiver(post_save, sender=Payment)
+def update_daily_summary(sender, instance, created, **kwargs):
+    """Move the booking's contribution in the daily summary - one or two row updates"""
+    after = booking_contribution(instance)
+    if created:
+        apply_booking_change(None, after)
+    elif hasattr(instance, '_summary_contribution'):
+        apply_booking_change(instance._summary_contribution, after)
+    else:
+        # Loaded without the fields - recount its train and date instead
+        recount_summary(instance.train_id, instance.journey_date)
+    instance._summary_contribution = after
+
+
+@receiver(post_delete, sender=Payment)
+def remove_from_daily_summary(sender, instance, **kwargs):
+    if hasattr(instance, '_summary_contribution'):
+        apply_booking_change(instance._summary_contribution, None)
+    else:
+        recount_summary(instance.train_id, instance.journey_date)
@@ -0,0 +1,149 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from trains.models import Train, TrainClass, Station, Route
+from .models import Payment, DailySummary
+
+# Dashboard window - journey dates this far back, and as far ahead as bookings open
+STATS_HISTORY_DAYS = 30
+STATS_AHEAD_DAYS = 10
+
+# Busiest trains listed on the dashboard
+STATS_TOP_TRAINS = 10
+
+CONFIRMED = Q(payment_status='success') & ~Q(booking_status='cancelled')
+
+
+def booking_contribution(booking):
+    """What a booking adds to the summary - (train_id, journey_date, revenue), None when not confirmed"""
+    if booking.payment_status != 'success' or booking.booking_status == 'cancelled':
+        return None
+    return booking.train_id, booking.journey_date, Decimal(str(booking.total_fare))
+
+
+def add_to_summary(train_id, journey_date, bookings, revenue):
+    """Add to one summary row - created on first use, concurrent writers add in SQL"""
+    row = DailySummary.objects.filter(train_id=train_id, journey_date=journey_date)
+    if row.update(bookings=F('bookings') + bookings, revenue=F('revenue') + revenue):
+        return
+    try:
+        with transaction.atomic():
+            DailySummary.objects.create(train_id=train_id, journey_date=journey_date,
+                                        bookings=bookings, revenue=revenue)
+    except IntegrityError:
+        # Another booking created the row first
+        row.update(bookings=F('bookings') + bookings, revenue=F('revenue') + revenue)
+
+
+def apply_booking_change(before, after):
+    """Move a booking's contribution in the summary - before/after from booking_contribution"""
+    if before == after:
+        return
+    if before:
+        train_id, journey_date, revenue = before
+        add_to_summary(train_id, journey_date, -1, -revenue)
+    if after:
+        train_id, journey_date, revenue = after
+        add_to_summary(train_id, journey_date, 1, revenue)
+
+
+def recount_summary(train_id, journey_date):
+    """Recompute one summary row from its bookings"""
+    totals = Payment.objects.filter(CONFIRMED, train_id=train_id, journey_date=journey_date).aggregate(
+        bookings=Count('pnr'), revenue=Sum('total_fare')
+    )
+    DailySummary.objects.update_or_create(
+        train_id=train_id, journey_date=journey_date,
+        defaults={'bookings': totals['bookings'], 'revenue': totals['revenue'] or 0},
+    )
+
+
+def rebuild_summaries():
+    """Recompute every summary row from the bookings - one grouped query. Returns rows written"""
+    totals = (
+        Payment.objects.filter(CONFIRMED).order_by()
+        .values('train_id', 'journey_date')
+        .annotate(bookings=Count('pnr'), revenue=Sum('total_fare'))
+    )
+    with transaction.atomic():
+        DailySummary.objects.all().delete()
+        rows = DailySummary.objects.bulk_create(
+            [DailySummary(**row) for row in totals.iterator(chunk_size=2000)], batch_size=2000
+        )
+    return len(rows)
+
+
+def headline_counts():
+    """Trains, stations, routes and confirmed bookings - one query of scalar subqueries"""
+    quote = connection.ops.quote_name
+    sql = 'SELECT {}, {}, {}, (SELECT COALESCE(SUM(bookings), 0) FROM {})'.format(
+        *[f'(SELECT COUNT(*) FROM {quote(model._meta.db_table)})' for model in (Train, Station, Route)],
+        quote(DailySummary._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        trains, stations, routes, confirmed_bookings = cursor.fetchone()
+    return {'trains': trains, 'stations': stations, 'routes': routes, 'confirmed_bookings': confirmed_bookings}
+
+
+def seats_per_run():
+    """Seats a train offers on one run, for a query on a model with train_id - its classes, else total_seats
+
+    The same capacity bookings sell from (see bookings.inventory.seat_capacity).
+    """
+    class_seats = TrainClass.objects.filter(train_id=OuterRef('train_id')).order_by().values('train_id').annotate(
+        seats=Sum(F('coach_count') * F('seats_per_coach'))
+    ).values('seats')
+    return Coalesce(Subquery(class_seats), F('train__total_seats'), output_field=IntegerField())
+
+
+def dashboard_stats(today=None):
+    """Everything the admin dashboard shows - two queries, neither reads Payment
+
+    Revenue by day and bookings by train are folded from the summary rows in the
+    window - confirmed bookings only. Load factor is seats sold per seat offered,
+    counted from the train's classes, on the runs that sold any.
+    """
+    today = today or timezone.localdate()
+    start = today - timedelta(days=STATS_HISTORY_DAYS)
+    end = today + timedelta(days=STATS_AHEAD_DAYS)
+
+    rows = DailySummary.objects.filter(journey_date__range=(start, end)).annotate(
+        seats=seats_per_run(),
+    ).values_list(
+        'journey_date', 'train_id', 'train__train_number', 'train__train_name', 'seats',
+        'bookings', 'revenue',
+    )
+
+    by_day = {start + timedelta(days=offset): {'bookings': 0, 'revenue': Decimal(0)}
+              for offset in range((end - start).days + 1)}
+    by_train = {}
+    for journey_date, train_id, number, name, seats, bookings, revenue in rows:
+        day = by_day[journey_date]
+        day['bookings'] += bookings
+        day['revenue'] += revenue
+
+        train = by_train.setdefault(train_id, {
+            'train_number': number, 'train_name': name,
+            'bookings': 0, 'revenue': Decimal(0), 'seats_offered': 0,
+        })
+        if bookings:
+            train['bookings'] += bookings
+            train['revenue'] += revenue
+            train['seats_offered'] += seats
+
+    for train in by_train.values():
+        offered = train['seats_offered']
+        train['load_factor'] = round(100 * train['bookings'] / offered, 1) if offered else 0
+
+    return {
+        'counts': headline_counts(),
+        'start': start,
+        'end': end,
+        'revenue': sum(day['revenue'] for day in by_day.values()),
+        'by_day': [{'date': day, **totals} for day, totals in by_day.items()],
+        'by_train': sorted(by_train.values(), key=lambda train: -train['bookings'])[:STATS_TOP_TRAINS],
+    }
@@ -1,3 +1,651 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from datetime import date, time, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction, OperationalError
+from django.contrib.messages import get_messages
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import User
+from core import settings as project_settings
+from trains.models import Train, Station, Route, TrainSchedule
+from trains.fares import get_fare_matrix
+from trains.search_token import make_search_token
+from trains.tests import QueryPlanMixin
+from . import tickets
+from .export import EXPORT_LAG, pa
+from .ids import IdAllocator, is_valid
+from .inventory import reserve_seat, available_seats, hold_seat, release_expired_holds
+from .inventory import add_available_seats, pick_seat_class, CONFLICT, CONTENDED, RESERVE_ATTEMPTS
+from .models import Payment, SeatHold, DailySummary
+from .stats import dashboard_stats, rebuild_summaries
+from .views import BOOKINGS_PER_PAGE
 
-# Create your tests here.
+
+def make_train(total_seats=100):
+    """Dhaka -> Tangail -> Rajshahi, 100 km apart"""
+    train = Train.objects.create(train_number='701', train_name='Silk City',
+                                 total_seats=total_seats, classes_available='')
+    for seq, code in enumerate(['DHK', 'TGL', 'RJH'], start=1):
+        station, _ = Station.objects.get_or_create(station_code=code, station_name=code, city=code)
+        Route.objects.create(train=train, station=station, sequence_order=seq,
+                             departure_time=time(6 + seq, 0), distance_from_origin=(seq - 1) * 100)
+    return train
+
+
+class SeatInventoryTests(TestCase):
+
+    def setUp(self):
+        self.train = make_train(total_seats=2)
+        self.journey_date = date.today() + timedelta(days=1)
+
+    def test_seat_is_shared_by_disjoint_legs(self):
+        self.assertEqual(reserve_seat(self.train, self.journey_date, '', 1, 2), 1)
+        self.assertEqual(reserve_seat(self.train, self.journey_date, '', 2, 3), 1)
+        self.assertEqual(available_seats(self.train, self.journey_date, '', 1, 3), 1)
+
+        self.assertEqual(reserve_seat(self.train, self.journey_date, '', 1, 3), 2)
+        self.assertIsNone(reserve_seat(self.train, self.journey_date, '', 1, 2))
+
+    def test_inventory_is_per_date(self):
+        reserve_seat(self.train, self.journey_date, '', 1, 3)
+        reserve_seat(self.train, self.journey_date, '', 1, 3)
+        self.assertEqual(available_seats(self.train, self.journey_date, '', 1, 3), 0)
+        self.assertEqual(available_seats(self.train, self.journey_date + timedelta(days=1), '', 1, 3), 2)
+
+
+    @mock.patch('bookings.inventory.RESERVE_BACKOFF_SECONDS', 0)
+    def test_lost_races_are_not_reported_as_sold_out(self):
+        with mock.patch('bookings.inventory._try_reserve_seat', side_effect=OperationalError('database is locked')):
+            self.assertIs(reserve_seat(self.train, self.journey_date, '', 1, 3), CONTENDED)
+        with mock.patch('bookings.inventory._try_reserve_seat', return_value=CONFLICT) as attempt:
+            self.assertIs(reserve_seat(self.train, self.journey_date, '', 1, 3), CONTENDED)
+        self.assertEqual(attempt.call_count, RESERVE_ATTEMPTS)
+        self.assertEqual(reserve_seat(self.train, self.journey_date, '', 1, 3), 1)
+
+    def test_train_with_classes_has_no_class_less_pool(self):
+        self.train.classes_available = 'AC,Non-AC'
+        self.train.save()
+        self.train.seat_classes.update(coach_count=1, seats_per_coach=1)
+        self.train.seat_classes.filter(seat_class='AC').update(fare_multiplier=Decimal('1.50'))
+
+        self.assertIsNone(reserve_seat(self.train, self.journey_date, '', 1, 3))
+        # A booking without a class sells the cheapest class first, then the next
+        self.assertEqual(pick_seat_class(self.train, self.journey_date, 1, 3), 'Non-AC')
+        reserve_seat(self.train, self.journey_date, 'Non-AC', 1, 3)
+        self.assertEqual(pick_seat_class(self.train, self.journey_date, 1, 3), 'AC')
+
+        item = {'train': self.train, 'origin_route': self.train.routes.get(sequence_order=1),
+                'dest_route': self.train.routes.get(sequence_order=3), 'capacity': self.train.total_seats}
+        add_available_seats([item], self.journey_date)
+        self.assertEqual(item['available_seats'], 1)
+        # Search quotes the class the booking would get
+        self.assertEqual((item['seat_class'], item['fare_multiplier']), ('AC', Decimal('1.50')))
+
+
+class SeatHoldTests(TestCase):
+
+    def setUp(self):
+        self.train = make_train(total_seats=1)
+        self.journey_date = date.today() + timedelta(days=1)
+        schedule = TrainSchedule.objects.create(train=self.train, departure_time=time(7, 0), arrival_time=time(9, 0))
+        seat_number = reserve_seat(self.train, self.journey_date, '', 1, 3)
+        self.booking = Payment.objects.create(
+            user=User.objects.create_user(username='rahim', password='secret'),
+            train=self.train,
+            train_schedule=schedule,
+            origin_station=Station.objects.get(station_code='DHK'),
+            destination_station=Station.objects.get(station_code='RJH'),
+            journey_date=self.journey_date,
+            seat_number=seat_number,
+        )
+        self.hold = hold_seat(self.booking, 1, 3)
+
+    def test_expired_hold_returns_seat(self):
+        self.assertEqual(release_expired_holds(), 0)
+        self.assertEqual(available_seats(self.train, self.journey_date, '', 1, 3), 0)
+
+        released = release_expired_holds(now=self.hold.expires_at + timedelta(seconds=1))
+        self.assertEqual(released, 1)
+        self.assertEqual(available_seats(self.train, self.journey_date, '', 1, 3), 1)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_status, 'failed')
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_paid_booking_keeps_its_seat(self):
+        Payment.objects.filter(pnr=self.booking.pnr).update(payment_status='success')
+
+        release_expired_holds(now=timezone.now() + timedelta(days=1))
+        self.assertEqual(available_seats(self.train, self.journey_date, '', 1, 3), 0)
+        # The reaper drops the stale hold instead of finding it on every run
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_marking_a_booking_paid_drops_its_hold(self):
+        # As the admin does it - no payment view involved
+        booking = Payment.objects.get(pnr=self.booking.pnr)
+        booking.payment_status = 'success'
+        booking.save()
+        self.assertFalse(SeatHold.objects.exists())
+
+        release_expired_holds(now=timezone.now() + timedelta(days=1))
+        self.assertEqual(available_seats(self.train, self.journey_date, '', 1, 3), 0)
+
+    def test_saving_an_unpaid_booking_keeps_its_hold(self):
+        self.booking.seat_number = 1
+        self.booking.save()
+        self.assertTrue(SeatHold.objects.exists())
+
+
+class IdAllocatorTests(TestCase):
+
+    def test_block_skips_ids_already_taken(self):
+        allocator = IdAllocator('test_pnr', digits=9, field='pnr', block_size=10)
+        train = make_train()
+        schedule = TrainSchedule.objects.create(train=train, departure_time=time(7, 0), arrival_time=time(9, 0))
+        legacy = allocator.format(3)
+        Payment.objects.create(
+            pnr=legacy,
+            user=User.objects.create_user(username='karim', password='secret'),
+            train=train,
+            train_schedule=schedule,
+            origin_station=Station.objects.get(station_code='DHK'),
+            destination_station=Station.objects.get(station_code='RJH'),
+            journey_date=date.today(),
+        )
+
+        ids = [allocator.next_id() for _ in range(12)]
+        self.assertNotIn(legacy, ids)
+        self.assertEqual(len(set(ids)), 12)
+
+
+class IdBlockTests(TransactionTestCase):
+    """Blocks are only reserved outside a transaction - TestCase would wrap every test in one"""
+
+    def test_pnrs_are_unique_rising_and_checked(self):
+        # Not the shared pnr_allocator - its block may come from a sequence another test flushed
+        allocator = IdAllocator('pnr', digits=9, field='pnr')
+        pnrs = [allocator.next_id() for _ in range(2500)]
+        self.assertEqual(len(set(pnrs)), len(pnrs))
+        self.assertEqual(pnrs, sorted(pnrs))
+        self.assertTrue(all(len(pnr) == 10 and is_valid(pnr) for pnr in pnrs))
+        self.assertFalse(is_valid(pnrs[0][:-1] + str((int(pnrs[0][-1]) + 1) % 10)))
+
+    def test_rolled_back_transaction_does_not_recycle_a_block(self):
+        first = IdAllocator('rollback_pnr', digits=9, field='pnr', block_size=10)
+        second = IdAllocator('rollback_pnr', digits=9, field='pnr', block_size=10)
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                first.next_id()
+                1 / 0
+
+        # As if each were a worker process of its own - the rolled-back block is free again
+        others = [second.next_id() for _ in range(10)]
+        ids = [first.next_id() for _ in range(10)]
+        self.assertEqual(set(ids) & set(others), set())
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+
+    def setUp(self):
+        self.train = make_train()
+        TrainSchedule.objects.create(train=self.train, departure_time=time(7, 0), arrival_time=time(9, 0))
+        self.user = User.objects.create_user(username='rahim', password='secret')
+        self.client.force_login(self.user)
+        get_fare_matrix()
+        self.booking_form = {
+            'train_id': self.train.id,
+            'origin_code': 'DHK',
+            'destination_code': 'RJH',
+            'journey_date': (date.today() + timedelta(days=1)).isoformat(),
+        }
+
+    def test_booking_flow_queries_use_indexes(self):
+        response, statements = self.capture(self.client.post, reverse('bookings:confirm_booking'), self.booking_form)
+        pnr = Payment.objects.get().pnr
+        self.assertRedirects(response, reverse('bookings:payment', args=[pnr]))
+
+        for method, url, data in [
+            (self.client.get, reverse('bookings:payment', args=[pnr]), {}),
+            (self.client.post, reverse('bookings:payment', args=[pnr]), {'payment_method': 'bkash'}),
+            (self.client.get, reverse('bookings:booking_detail', args=[pnr]), {}),
+        ]:
+            statements += self.capture(method, url, data)[1]
+        self.assertNoFullScans(statements)
+
+    def test_my_bookings_pages_use_indexes(self):
+        for _ in range(3):
+            self.client.post(reverse('bookings:confirm_booking'), self.booking_form)
+        url = reverse('bookings:my_bookings')
+
+        response, statements = self.capture(self.client.get, url)
+        newest = Payment.objects.order_by('-booking_date', '-pnr').first()
+        response, more = self.capture(self.client.get, url, {'after': f'{newest.booking_date.isoformat()}|{newest.pnr}'})
+        self.assertEqual(len(response.context['bookings']), 2)
+        self.assertNoFullScans(statements + more)
+
+    def test_hold_reaper_uses_indexes(self):
+        self.client.post(reverse('bookings:confirm_booking'), self.booking_form)
+        _, statements = self.capture(release_expired_holds, now=timezone.now() + timedelta(days=1))
+        self.assertNoFullScans(statements)
+
+
+class MyBookingsTests(TestCase):
+
+    def setUp(self):
+        train = make_train()
+        schedule = TrainSchedule.objects.create(train=train, departure_time=time(7, 0), arrival_time=time(9, 0))
+        self.user = User.objects.create_user(username='rahim', password='secret')
+        self.client.force_login(self.user)
+        for seat in range(1, BOOKINGS_PER_PAGE + 6):
+            Payment.objects.create(
+                user=self.user, train=train, train_schedule=schedule,
+                origin_station=Station.objects.get(station_code='DHK'),
+                destination_station=Station.objects.get(station_code='RJH'),
+                journey_date=date.today() + timedelta(days=1), seat_number=seat,
+            )
+        self.url = reverse('bookings:my_bookings')
+
+    def test_every_page_takes_the_same_queries(self):
+        # Session, user and one page of bookings with their train and stations
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context['bookings']), BOOKINGS_PER_PAGE)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'after': response.context['next_cursor']})
+        self.assertEqual(len(response.context['bookings']), 5)
+        self.assertIsNone(response.context['next_cursor'])
+
+        seen = Payment.objects.order_by('-booking_date', '-pnr').values_list('pnr', flat=True)
+        self.assertEqual([booking.pnr for booking in response.context['bookings']], list(seen[BOOKINGS_PER_PAGE:]))
+
+    def test_booking_detail_loads_the_booking_in_one_query(self):
+        pnr = Payment.objects.first().pnr
+        # Session, user and the booking with its train and stations
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('bookings:booking_detail', args=[pnr]))
+        self.assertContains(response, pnr)
+
+
+class SearchTokenTests(TestCase):
+
+    def setUp(self):
+        make_train()
+        TrainSchedule.objects.create(train=Train.objects.get(), departure_time=time(7, 0), arrival_time=time(9, 0))
+        self.client.force_login(User.objects.create_user(username='rahim', password='secret'))
+
+    def test_search_to_booking_writes_no_session(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('trains:search'), {
+                'origin': 'DHK',
+                'destination': 'TGL',
+                'journey_date': (date.today() + timedelta(days=1)).isoformat(),
+            })
+            token = response.context['search_token']
+            self.client.post(reverse('trains:deep_search'), {'search': token})
+            response = self.client.get(reverse('bookings:new_booking', args=[Train.objects.get().id]), {
+                'search': token,
+                'destination': 'RJH',
+            })
+
+        self.assertEqual(response.context['destination'].station_code, 'RJH')
+        self.assertEqual(response.context['total_fare'], Decimal('472.50'))
+        writes = [q['sql'] for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+
+    def test_tampered_token_is_rejected(self):
+        token = make_search_token('DHK', 'RJH', date.today().isoformat())
+        response = self.client.get(reverse('bookings:new_booking', args=[Train.objects.get().id]), {
+            'search': token[:-1] + ('A' if token[-1] != 'A' else 'B'),
+        })
+        self.assertRedirects(response, reverse('trains:home'))
+
+
+class TicketPdfTests(TestCase):
+
+    def test_cache_is_not_served_as_media(self):
+        # setUp points the cache elsewhere - check the project setting itself
+        self.assertFalse(project_settings.TICKET_CACHE_DIR.is_relative_to(project_settings.MEDIA_ROOT))
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        override = override_settings(TICKET_CACHE_DIR=Path(self.cache_dir.name))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        train = make_train()
+        user = User.objects.create_user(username='rahim', password='secret')
+        self.booking = Payment.objects.create(
+            user=user,
+            train=train,
+            train_schedule=TrainSchedule.objects.create(train=train, departure_time=time(7, 0), arrival_time=time(9, 0)),
+            origin_station=Station.objects.get(station_code='DHK'),
+            destination_station=Station.objects.get(station_code='RJH'),
+            journey_date=date.today() + timedelta(days=1),
+            seat_number=7,
+            payment_status='success',
+        )
+        self.client.force_login(user)
+
+    def download(self):
+        response = self.client.get(reverse('bookings:download_ticket', args=[self.booking.pnr]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        return b''.join(response.streaming_content)
+
+    def cached_files(self):
+        return sorted(path.name for path in Path(self.cache_dir.name).iterdir())
+
+    def test_ticket_is_a_valid_pdf(self):
+        pdf = self.download()
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertIn(f'(PNR: {self.booking.pnr})'.encode(), pdf)
+        xref = int(pdf.rsplit(b'startxref', 1)[1].split()[0])
+        self.assertTrue(pdf[xref:].startswith(b'xref'))
+
+    def test_ticket_is_rendered_once_per_booking_version(self):
+        self.download()
+        files = self.cached_files()
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith(self.booking.pnr))
+
+        # Session, user and the booking - nothing is re-rendered
+        with self.assertNumQueries(3):
+            self.download()
+        self.assertEqual(self.cached_files(), files)
+
+        self.booking.seat_number = 8
+        self.booking.save()
+        self.assertEqual(self.cached_files(), [])
+        self.assertIn(b'Seat: 8', self.download())
+        self.assertNotEqual(self.cached_files(), files)
+
+    def test_ticket_removed_before_it_is_opened_is_rendered_again(self):
+        real_ticket_path = tickets.ticket_path
+
+        def invalidated_by_another_request(booking):
+            path = real_ticket_path(booking)
+            if not removed:
+                removed.append(path)
+                tickets.invalidate_ticket(booking.pnr)
+            return path
+
+        removed = []
+        with mock.patch('bookings.tickets.ticket_path', side_effect=invalidated_by_another_request):
+            pdf = self.download()
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(self.cached_files(), [removed[0].name])
+
+    def test_new_ticket_is_in_place_before_the_old_one_goes(self):
+        old = tickets.ticket_path(self.booking)
+        self.booking.seat_number = 8
+        with mock.patch('bookings.tickets.invalidate_ticket', wraps=tickets.invalidate_ticket) as invalidate:
+            new = tickets.ticket_path(self.booking)
+        invalidate.assert_called_once_with(self.booking.pnr, keep=new)
+        self.assertFalse(old.exists())
+        self.assertEqual(self.cached_files(), [new.name])
+
+
+class TicketExportTests(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        override = override_settings(TICKET_CACHE_DIR=Path(self.cache_dir.name))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        train = make_train()
+        schedule = TrainSchedule.objects.create(train=train, departure_time=time(7, 0), arrival_time=time(9, 0))
+        self.journey_date = date.today() + timedelta(days=1)
+        passenger = User.objects.create_user(username='rahim', password='secret')
+        for seat, payment_status, booking_status in [(2, 'success', 'booked'), (1, 'success', 'booked'),
+                                                     (3, 'success', 'cancelled'), (4, 'pending', 'booked')]:
+            Payment.objects.create(
+                user=passenger, train=train, train_schedule=schedule,
+                origin_station=Station.objects.get(station_code='DHK'),
+                destination_station=Station.objects.get(station_code='RJH'),
+                journey_date=self.journey_date, seat_number=seat,
+                payment_status=payment_status, booking_status=booking_status,
+            )
+        self.client.force_login(User.objects.create_user(username='admin', password='secret', role='admin'))
+
+    def export(self, export_format):
+        response = self.client.get(reverse('bookings:admin_ticket_export'), {
+            'train_number': '701', 'journey_date': self.journey_date.isoformat(), 'format': export_format,
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn(f'manifest-701-{self.journey_date}.{export_format}', response['Content-Disposition'])
+        return b''.join(response.streaming_content)
+
+    def test_csv_manifest_lists_paid_bookings_by_seat(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv').decode())))
+        self.assertEqual([row['seat_number'] for row in rows], ['1', '2'])
+        self.assertEqual(rows[0]['passenger'], 'rahim')
+        self.assertEqual(rows[0]['destination'], 'RJH')
+
+    def test_json_manifest(self):
+        rows = json.loads(self.export('json'))
+        self.assertEqual([row['seat_number'] for row in rows], [1, 2])
+
+    def test_zip_holds_one_pdf_per_ticket(self):
+        archive = zipfile.ZipFile(io.BytesIO(self.export('zip')))
+        self.assertIsNone(archive.testzip())
+        names = archive.namelist()
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(archive.read(name).startswith(b'%PDF') for name in names))
+
+    def test_customers_cannot_export(self):
+        self.client.force_login(User.objects.get(username='rahim'))
+        response = self.client.get(reverse('bookings:admin_ticket_export'), {
+            'train_number': '701', 'journey_date': self.journey_date.isoformat(),
+        })
+        self.assertRedirects(response, reverse('trains:home'), fetch_redirect_response=False)
+
+
+class DailySummaryTests(TestCase):
+
+    def setUp(self):
+        self.train = make_train()
+        self.schedule = TrainSchedule.objects.create(train=self.train, departure_time=time(7, 0), arrival_time=time(9, 0))
+        self.user = User.objects.create_user(username='rahim', password='secret')
+        self.journey_date = date.today() + timedelta(days=1)
+
+    def book(self, **fields):
+        return Payment.objects.create(
+            user=self.user, train=self.train, train_schedule=self.schedule,
+            origin_station=Station.objects.get(station_code='DHK'),
+            destination_station=Station.objects.get(station_code='RJH'),
+            journey_date=self.journey_date, total_fare=Decimal('250.00'), **fields
+        )
+
+    def summary(self):
+        return list(DailySummary.objects.values_list('journey_date', 'bookings', 'revenue'))
+
+    def test_paying_counts_the_booking_once(self):
+        booking = self.book()
+        self.assertEqual(self.summary(), [])
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('bookings:payment', args=[booking.pnr]), {'payment_method': 'bkash'})
+        self.assertEqual(self.summary(), [(self.journey_date, 1, Decimal('250.00'))])
+
+        # Saving again changes nothing
+        booking = Payment.objects.get(pk=booking.pk)
+        booking.seat_number = 9
+        booking.save()
+        self.assertEqual(self.summary(), [(self.journey_date, 1, Decimal('250.00'))])
+
+    def test_cancelling_and_deleting_take_the_booking_out(self):
+        first = self.book(payment_status='success')
+        second = self.book(payment_status='success')
+
+        first.booking_status = 'cancelled'
+        first.save()
+        self.assertEqual(self.summary(), [(self.journey_date, 1, Decimal('250.00'))])
+
+        Payment.objects.get(pk=second.pk).delete()
+        self.assertEqual(self.summary(), [(self.journey_date, 0, Decimal('0.00'))])
+
+    def test_rebuild_matches_incremental_summary(self):
+        self.book(payment_status='success')
+        self.book(payment_status='success', booking_status='cancelled')
+        self.book()
+        incremental = self.summary()
+        self.assertEqual(rebuild_summaries(), 1)
+        self.assertEqual(self.summary(), incremental)
+
+    def test_dashboard_stats_in_two_queries(self):
+        for _ in range(5):
+            self.book(payment_status='success')
+
+        with self.assertNumQueries(2):
+            stats = dashboard_stats()
+
+        self.assertEqual(stats['counts'], {'trains': 1, 'stations': 3, 'routes': 3, 'confirmed_bookings': 5})
+        self.assertEqual(stats['revenue'], Decimal('1250.00'))
+        day = next(day for day in stats['by_day'] if day['date'] == self.journey_date)
+        self.assertEqual(day['bookings'], 5)
+        self.assertEqual(stats['by_train'][0]['load_factor'], 5.0)
+
+    def test_load_factor_counts_seats_of_the_classes(self):
+        for _ in range(5):
+            self.book(payment_status='success')
+        # total_seats stays at 100 - the classes offer 2 x 10 + 1 x 30 seats
+        self.train.classes_available = 'AC,Non-AC'
+        self.train.save()
+        self.train.seat_classes.filter(seat_class='AC').update(coach_count=2, seats_per_coach=10)
+        self.train.seat_classes.filter(seat_class='Non-AC').update(coach_count=1, seats_per_coach=30)
+
+        with self.assertNumQueries(2):
+            stats = dashboard_stats()
+        self.assertEqual(stats['by_train'][0]['load_factor'], 10.0)
+
+
+class DataExportTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = Path(directory.name) / 'export'
+
+        self.train = make_train()
+        self.schedule = TrainSchedule.objects.create(train=self.train, departure_time=time(7, 0), arrival_time=time(9, 0))
+        self.user = User.objects.create_user(username='rahim', password='secret', role='admin')
+        for _ in range(3):
+            self.book()
+
+    def book(self, settled=True):
+        booking = Payment.objects.create(
+            user=self.user, train=self.train, train_schedule=self.schedule,
+            origin_station=Station.objects.get(station_code='DHK'),
+            destination_station=Station.objects.get(station_code='RJH'),
+            journey_date=date.today() + timedelta(days=1), total_fare=Decimal('262.50'),
+        )
+        if settled:
+            # Old enough to be past the export lag
+            booking.booking_date = timezone.now() - EXPORT_LAG - timedelta(seconds=1)
+            Payment.objects.filter(pk=booking.pk).update(booking_date=booking.booking_date)
+        return booking
+
+    def export(self, *args):
+        call_command('export_data', *args, '--output', str(self.output), stderr=io.StringIO())
+        return self.output.read_text()
+
+    def test_incremental_export_starts_after_the_watermark(self):
+        rows = [json.loads(line) for line in self.export('bookings', '--incremental', 'analytics').splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['total_fare'], '262.50')
+        self.assertEqual([row['pnr'] for row in rows], list(
+            Payment.objects.order_by('booking_date', 'pnr').values_list('pnr', flat=True)
+        ))
+
+        self.assertEqual(self.export('bookings', '--incremental', 'analytics'), '')
+
+        booking = self.book()
+        rows = [json.loads(line) for line in self.export('bookings', '--incremental', 'analytics').splitlines()]
+        self.assertEqual([row['pnr'] for row in rows], [booking.pnr])
+
+    def test_recent_bookings_wait_for_the_next_export(self):
+        self.export('bookings', '--incremental', 'analytics')
+        recent = self.book(settled=False)
+        self.assertEqual(self.export('bookings', '--incremental', 'analytics'), '')
+
+        Payment.objects.filter(pk=recent.pk).update(booking_date=timezone.now() - EXPORT_LAG)
+        rows = [json.loads(line) for line in self.export('bookings', '--incremental', 'analytics').splitlines()]
+        self.assertEqual([row['pnr'] for row in rows], [recent.pnr])
+
+    def test_admin_endpoint_rejects_a_malformed_watermark(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bookings:admin_data_export'), {'table': 'bookings', 'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_bookings_export_incrementally(self):
+        with self.assertRaises(CommandError):
+            self.export('routes', '--since', f'{timezone.now().isoformat()}|0000000000')
+
+    def test_admin_endpoint_streams_csv(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bookings:admin_data_export'), {'table': 'routes', 'format': 'csv'})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['id', 'train_id', 'station_id'])
+        self.assertEqual([row[3] for row in rows[1:]], ['1', '2', '3'])
+
+    @skipUnless(pa, 'pyarrow is not installed')
+    def test_parquet_export(self):
+        import pyarrow.parquet as pq
+
+        call_command('export_data', 'bookings', '--format', 'parquet', '--chunk-size', '2',
+                     '--output', str(self.output), stderr=io.StringIO())
+        parquet = pq.ParquetFile(self.output)
+        self.assertEqual((parquet.metadata.num_rows, parquet.metadata.num_row_groups), (3, 2))
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+
+    def test_only_one_booking_gets_the_last_seat(self):
+        train = make_train(total_seats=1)
+        TrainSchedule.objects.create(train=train, departure_time=time(7, 0), arrival_time=time(9, 0))
+        journey_date = date.today() + timedelta(days=1)
+        booking_form = {'train_id': train.id, 'origin_code': 'DHK', 'destination_code': 'RJH',
+                        'journey_date': journey_date.isoformat()}
+        attempts = 200
+        passenger = User.objects.create_user(username='rahim', password='secret')
+        clients = [Client() for _ in range(attempts)]
+        for client in clients:
+            client.force_login(passenger)
+        results = []
+        start = threading.Barrier(attempts)
+
+        def book(client):
+            start.wait()
+            try:
+                response = client.post(reverse('bookings:confirm_booking'), booking_form)
+                results.append([str(message) for message in get_messages(response.wsgi_request)])
+            finally:
+                connection.close()
+
+        # The whole booking - seat, payment and hold - as the view runs it
+        threads = [threading.Thread(target=book, args=[client]) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), attempts)
+        booking = Payment.objects.get()
+        self.assertEqual(booking.seat_number, 1)
+        self.assertEqual(SeatHold.objects.get().payment, booking)
+        self.assertEqual(sorted(results).count(['No seats available!']), attempts - 1)
+        self.assertEqual(available_seats(train, journey_date, '', 1, 3), 0)
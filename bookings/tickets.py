@@ -0,0 +1,79 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from .pdf import build_pdf
+
+# Times a ticket is looked up again when its file vanished before it was opened
+TICKET_OPEN_ATTEMPTS = 3
+
+
+def ticket_lines(booking):
+    """What the ticket shows - (text, size, bold) lines, '' for a rule"""
+    user = booking.user
+    return [
+        ('Bangladesh Railway - E-Ticket', 20, True),
+        (f'PNR: {booking.pnr}', 16, True),
+        ('', 10, False),
+        (f'Train: {booking.train.train_name} ({booking.train.train_number})', 12, False),
+        (f'From: {booking.origin_station.station_name} ({booking.origin_station.station_code})', 12, False),
+        (f'To: {booking.destination_station.station_name} ({booking.destination_station.station_code})', 12, False),
+        (f'Journey Date: {booking.journey_date:%d %b %Y (%A)}', 12, False),
+        (f'Class: {booking.seat_class or "General"}    Seat: {booking.seat_number or "N/A"}', 12, False),
+        ('', 10, False),
+        (f'Passenger: {user.full_name or user.username}', 12, False),
+        (f'Booked: {booking.booking_date:%d %b %Y %H:%M}', 10, False),
+        ('', 10, False),
+        (f'Base Fare: BDT {booking.base_fare}', 12, False),
+        (f'Reservation Charge: BDT {booking.reservation_charge}', 12, False),
+        (f'Tax: BDT {booking.tax}', 12, False),
+        (f'Total Fare: BDT {booking.total_fare}', 14, True),
+        ('', 10, False),
+        (f'Payment: {booking.get_payment_status_display()} - Transaction ID: {booking.transaction_id or "N/A"}', 10, False),
+        (f'Status: {booking.get_booking_status_display()}', 10, False),
+        ('Carry a photo ID matching the passenger name while travelling.', 9, False),
+    ]
+
+
+def ticket_path(booking):
+    """Path of the booking's PDF ticket - rendered once per distinct content
+
+    Files are named <pnr>-<content hash>.pdf, so any change to what the ticket
+    shows gives a new file. Older files of the PNR are removed once it is in
+    place. Another request may still remove the file before it is opened - read
+    it through open_ticket.
+    """
+    lines = ticket_lines(booking)
+    digest = hashlib.sha256(repr(lines).encode()).hexdigest()[:16]
+    cache_dir = Path(settings.TICKET_CACHE_DIR)
+    path = cache_dir / f'{booking.pnr}-{digest}.pdf'
+    if path.exists():
+        return path
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Write beside the final name and rename - readers never see half a file
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(build_pdf(lines, title=f'E-Ticket {booking.pnr}'))
+    os.replace(tmp, path)
+    invalidate_ticket(booking.pnr, keep=path)
+    return path
+
+
+def open_ticket(booking):
+    """The booking's PDF ticket opened for reading - rendered again if it is removed under us"""
+    for attempt in range(TICKET_OPEN_ATTEMPTS):
+        try:
+            return open(ticket_path(booking), 'rb')
+        except FileNotFoundError:
+            if attempt == TICKET_OPEN_ATTEMPTS - 1:
+                raise
+
+
+def invalidate_ticket(pnr, keep=None):
+    """Drop every cached PDF of a PNR but keep"""
+    for path in Path(settings.TICKET_CACHE_DIR).glob(f'{pnr}-*.pdf'):
+        if path != keep:
+            path.unlink(missing_ok=True)
@@ -11,4 +11,6 @@ urlpatterns = [
     path('booking/<str:pnr>/', views.booking_detail, name='booking_detail'),
     path('cancel/<int:booking_id>/', views.cancel_booking, name='cancel_booking'),
     path('download-ticket/<str:pnr>/', views.download_ticket, name='download_ticket'),
+    path('manage/export/', views.admin_ticket_export, name='admin_ticket_export'),
+    path('manage/data-export/', views.admin_data_export, name='admin_data_export'),
 ]
\ No newline at end of file
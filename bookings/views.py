@@ -1,18 +1,36 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.db import transaction
-from .models import Payment
+from django.db.models import Q
+from django.utils import timezone
+from .models import Payment, SeatHold, generate_pnr
+from .ids import transaction_id_allocator
+from .tickets import open_ticket
+from .export import EXPORT_FORMATS as DATA_EXPORT_FORMATS, EXPORT_TABLES, TableExport, parse_watermark
+from .manifest import manifest_bookings, stream_manifest_csv, stream_manifest_json, stream_tickets_zip
+from .inventory import book_seat, available_seats, hold_seat, release_holds, pick_seat_class, CONTENDED
 from trains.models import Train, TrainSchedule, Station, Route
+from trains.fares import get_fare_matrix, TAX_RATE
+from trains.runs import bookable_run
+from trains.search_token import read_search_token
+from trains.views import admin_required
 from datetime import datetime, date
-import random
-import string
+
+BOOKINGS_PER_PAGE = 20
+
+# Bulk export formats - (streaming generator, content type, file extension)
+EXPORT_FORMATS = {
+    'csv': (stream_manifest_csv, 'text/csv', 'csv'),
+    'json': (stream_manifest_json, 'application/json', 'json'),
+    'zip': (stream_tickets_zip, 'application/zip', 'zip'),
+}
 
 
 def generate_transaction_id():
-    """Generate random transaction ID"""
-    return 'TXN' + ''.join(random.choices(string.digits, k=12))
+    """Generate unique transaction ID"""
+    return transaction_id_allocator.next_id()
 
 
 @login_required
@@ -20,22 +38,20 @@ def new_booking(request, train_id):
     """New Booking Form - Single Passenger (User's info)"""
     train = get_object_or_404(Train, id=train_id)
     
-    # Get search data from session
-    origin_code = request.session.get('search_origin')
-    destination_code = request.session.get('search_destination')
-    journey_date_str = request.session.get('journey_date')
+    # Get search data from the search token (deep search results pick their own destination)
+    search = read_search_token(request)
     
-    if not all([origin_code, destination_code, journey_date_str]):
+    if not search:
         messages.error(request, 'Invalid booking request!')
         return redirect('trains:home')
     
     try:
-        origin = Station.objects.get(station_code=origin_code)
-        destination = Station.objects.get(station_code=destination_code)
-        journey_date = datetime.strptime(journey_date_str, '%Y-%m-%d').date()
-        schedule = TrainSchedule.objects.get(train=train)
+        origin = Station.objects.get(station_code=search['origin'])
+        destination = Station.objects.get(station_code=request.GET.get('destination') or search['destination'])
+        journey_date = datetime.strptime(search['journey_date'], '%Y-%m-%d').date()
+        run = bookable_run(train, journey_date)
         
-        if not schedule.is_running_on_date(journey_date):
+        if run is None:
             messages.error(request, f'Train does not run on {journey_date.strftime("%A")}')
             return redirect('trains:home')
         
@@ -47,15 +63,25 @@ def new_booking(request, train_id):
             messages.error(request, 'Route information not available!')
             return redirect('trains:home')
         
-        # Calculate distance
-        distance = float(dest_route.distance_from_origin - origin_route.distance_from_origin)
+        # Check seat availability for this date and these legs
+        # Without a class the booking sells from the class the search quoted while it has seats,
+        # else from the one pick_seat_class picks - a real class, never a separate pool
+        seat_class = search['seat_type'] or request.GET.get('seat_class', '')
+        seats_left = available_seats(train, journey_date, seat_class,
+                                     origin_route.sequence_order, dest_route.sequence_order)
+        if not search['seat_type'] and seats_left < 1:
+            seat_class = pick_seat_class(
+                train, journey_date, origin_route.sequence_order, dest_route.sequence_order
+            )
+            seats_left = available_seats(train, journey_date, seat_class,
+                                         origin_route.sequence_order, dest_route.sequence_order)
+        if seats_left < 1:
+            messages.error(request, 'No seats available!')
+            return redirect('trains:home')
         
-        # Calculate fare
-        fare_per_km = 2
-        base_fare = distance * fare_per_km
-        reservation_charge = 50
-        tax = (base_fare + reservation_charge) * 0.05
-        total_fare = base_fare + reservation_charge + tax
+        # Fare for this train, station pair and class
+        distance = dest_route.distance_from_origin - origin_route.distance_from_origin
+        fare = get_fare_matrix().fare(train.id, origin.id, destination.id, seat_class, distance)
         
     except Exception as e:
         messages.error(request, f'Invalid booking data! {str(e)}')
@@ -63,15 +89,18 @@ def new_booking(request, train_id):
     
     context = {
         'train': train,
-        'schedule': schedule,
+        'run': run,
         'origin': origin,
         'destination': destination,
         'journey_date': journey_date,
-        'distance': distance,
-        'base_fare': base_fare,
-        'reservation_charge': reservation_charge,
-        'tax': tax,
-        'total_fare': total_fare,
+        'distance': fare.distance,
+        'base_fare': fare.base_fare,
+        'reservation_charge': fare.reservation_charge,
+        'tax': fare.tax,
+        'total_fare': fare.total_fare,
+        'tax_rate': TAX_RATE,
+        'seat_class': seat_class,
+        'available_seats': seats_left,
         'user': request.user,
     }
     
@@ -79,7 +108,6 @@ def new_booking(request, train_id):
 
 
 @login_required
-@transaction.atomic
 def confirm_booking(request):
     """Confirm Booking and Create Payment Record"""
     if request.method != 'POST':
@@ -102,52 +130,61 @@ def confirm_booking(request):
         destination = Station.objects.get(station_code=destination_code)
         journey_date = datetime.strptime(journey_date_str, '%Y-%m-%d').date()
         schedule = TrainSchedule.objects.get(train=train)
+        run = bookable_run(train, journey_date)
         
-        if not schedule.is_running_on_date(journey_date):
+        if run is None:
             messages.error(request, f'Train does not run on {journey_date.strftime("%A")}')
             return redirect('trains:home')
         
-        # Check seat availability
-        if train.available_seats < 1:
-            messages.error(request, 'No seats available!')
-            return redirect('trains:home')
-        
         # Get route details for fare calculation
         origin_route = Route.objects.filter(train=train, station=origin).first()
         dest_route = Route.objects.filter(train=train, station=destination).first()
         
-        # Calculate distance
-        distance = float(dest_route.distance_from_origin - origin_route.distance_from_origin)
-        
-        # Fare calculation: 2 BDT per KM
-        fare_per_km = 2
-        base_fare = distance * fare_per_km
-        reservation_charge = 50
+        # Fare for this train, station pair and class
+        seat_class = request.POST.get('seat_class', '') or pick_seat_class(
+            train, journey_date, origin_route.sequence_order, dest_route.sequence_order
+        )
+        distance = dest_route.distance_from_origin - origin_route.distance_from_origin
+        fare = get_fare_matrix().fare(train.id, origin.id, destination.id, seat_class, distance)
         
     except Exception as e:
         messages.error(request, f'Invalid booking information! {str(e)}')
         return redirect('trains:home')
     
-    # Create payment/booking record
-    payment = Payment.objects.create(
-        user=request.user,
-        train=train,
-        train_schedule=schedule,
-        origin_station=origin,
-        destination_station=destination,
-        journey_date=journey_date,
-        base_fare=base_fare,
-        reservation_charge=reservation_charge,
-        tax=0,
-        total_fare=0,
-        payment_status='pending'
-    )
+    # IDs are reserved outside the booking transaction
+    pnr = generate_pnr()
     
-    # Calculate fare
-    payment.calculate_fare()
+    def create_booking(seat_number):
+        """The booking for the seat just taken - runs in the same transaction"""
+        payment = Payment.objects.create(
+            pnr=pnr,
+            user=request.user,
+            train=train,
+            train_schedule=schedule,
+            origin_station=origin,
+            destination_station=destination,
+            journey_date=journey_date,
+            base_fare=fare.base_fare,
+            reservation_charge=fare.reservation_charge,
+            tax=fare.tax,
+            total_fare=fare.total_fare,
+            seat_class=seat_class,
+            seat_number=seat_number,
+            payment_status='pending'
+        )
+        # The seat is only kept until the payment window closes
+        hold_seat(payment, origin_route.sequence_order, dest_route.sequence_order)
+        return payment
     
-    # Reduce seat count
-    train.book_seat(1)
+    # Take a seat that is free on every leg from origin to destination
+    payment = book_seat(train, journey_date, seat_class,
+                        origin_route.sequence_order, dest_route.sequence_order, create_booking)
+    if payment is None:
+        messages.error(request, 'No seats available!')
+        return redirect('trains:home')
+    if payment is CONTENDED:
+        messages.error(request, 'Too many bookings for this train right now - please try again.')
+        return redirect('trains:home')
     
     messages.success(request, f'Booking created! PNR: {payment.pnr}')
     return redirect('bookings:payment', pnr=payment.pnr)
@@ -156,29 +193,51 @@ def confirm_booking(request):
 @login_required
 def payment(request, pnr):
     """Payment Page - Simulated Payment Gateway"""
-    booking = get_object_or_404(Payment, pnr=pnr, user=request.user)
+    booking = get_object_or_404(Payment.objects.with_journey(), pnr=pnr, user=request.user)
     
     if booking.payment_status == 'success':
         messages.info(request, 'This booking is already paid!')
         return redirect('bookings:booking_detail', pnr=booking.pnr)
     
+    if booking.payment_status == 'failed':
+        messages.error(request, 'This booking has expired. Please book again.')
+        return redirect('bookings:my_bookings')
+    
+    hold = SeatHold.objects.filter(payment=booking).first()
+    
     if request.method == 'POST':
         payment_method = request.POST.get('payment_method')
         
-        # Simulate payment processing
         transaction_id = generate_transaction_id()
         
-        booking.payment_method = payment_method
-        booking.transaction_id = transaction_id
-        booking.payment_status = 'success'
-        booking.payment_date = datetime.now()
-        booking.save()
+        with transaction.atomic():
+            if hold and hold.expires_at <= timezone.now():
+                release_holds(SeatHold.objects.filter(pk=hold.pk))
+                messages.error(request, 'Payment window expired and the seat was released. Please book again.')
+                return redirect('bookings:my_bookings')
+            
+            # Claim the booking - loses cleanly to the hold reaper
+            claimed = Payment.objects.filter(pnr=booking.pnr, payment_status='pending').update(
+                payment_status='success'
+            )
+            if not claimed:
+                messages.error(request, 'This booking has expired. Please book again.')
+                return redirect('bookings:my_bookings')
+            
+            # Simulate payment processing
+            booking.payment_method = payment_method
+            booking.transaction_id = transaction_id
+            booking.payment_status = 'success'
+            booking.payment_date = timezone.now()
+            # Saving the paid booking drops its hold
+            booking.save()
         
         messages.success(request, f'Payment successful! Transaction ID: {transaction_id}')
         return redirect('bookings:booking_detail', pnr=booking.pnr)
     
     context = {
         'booking': booking,
+        'hold': hold,
     }
     
     return render(request, 'bookings/payment.html', context)
@@ -186,11 +245,32 @@ def payment(request, pnr):
 
 @login_required
 def my_bookings(request):
-    """View All User Bookings"""
-    bookings = Payment.objects.filter(user=request.user).order_by('-booking_date')
+    """View User Bookings - Newest first, one keyset page at a time"""
+    bookings = Payment.objects.with_journey().filter(user=request.user).order_by('-booking_date', '-pnr')
+    
+    # Page after the last booking the user saw: ?after=<booking_date>|<pnr>
+    cursor = request.GET.get('after', '')
+    if '|' in cursor:
+        booking_date_str, last_pnr = cursor.rsplit('|', 1)
+        try:
+            last_date = datetime.fromisoformat(booking_date_str)
+        except ValueError:
+            last_date = None
+        if last_date:
+            bookings = bookings.filter(
+                Q(booking_date__lt=last_date) | Q(booking_date=last_date, pnr__lt=last_pnr)
+            )
+    
+    page = list(bookings[:BOOKINGS_PER_PAGE + 1])
+    next_cursor = None
+    if len(page) > BOOKINGS_PER_PAGE:
+        page = page[:BOOKINGS_PER_PAGE]
+        next_cursor = f'{page[-1].booking_date.isoformat()}|{page[-1].pnr}'
     
     context = {
-        'bookings': bookings,
+        'bookings': page,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
         'today': date.today(),
     }
     
@@ -200,7 +280,7 @@ def my_bookings(request):
 @login_required
 def booking_detail(request, pnr):
     """View Single Booking Detail"""
-    booking = get_object_or_404(Payment, pnr=pnr, user=request.user)
+    booking = get_object_or_404(Payment.objects.with_journey(), pnr=pnr, user=request.user)
     
     context = {
         'booking': booking,
@@ -220,15 +300,61 @@ def cancel_booking(request, booking_id):
 
 @login_required
 def download_ticket(request, pnr):
-    """Download Ticket as PDF"""
-    booking = get_object_or_404(Payment, pnr=pnr, user=request.user)
+    """Download Ticket as PDF - rendered once, then streamed from the ticket cache"""
+    booking = get_object_or_404(Payment.objects.with_journey().select_related('user'), pnr=pnr, user=request.user)
     
     if booking.payment_status != 'success':
         messages.error(request, 'Please complete payment first!')
         return redirect('bookings:payment', pnr=booking.pnr)
     
-    context = {
-        'booking': booking,
-    }
+    return FileResponse(
+        open_ticket(booking),
+        as_attachment=True,
+        filename=f'ticket-{booking.pnr}.pdf',
+        content_type='application/pdf',
+    )
+
+
+@admin_required
+def admin_ticket_export(request):
+    """Admin: Every ticket of one train and date - CSV/JSON manifest or ZIP of PDFs, streamed"""
+    train = get_object_or_404(Train, train_number=request.GET.get('train_number', '').strip())
+    export_format = request.GET.get('format', 'csv')
+    
+    try:
+        journey_date = datetime.strptime(request.GET.get('journey_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        messages.error(request, 'Invalid journey date!')
+        return redirect('accounts:admin_dashboard')
+    
+    if export_format not in EXPORT_FORMATS:
+        messages.error(request, 'Unknown export format!')
+        return redirect('accounts:admin_dashboard')
+    
+    stream, content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(stream(manifest_bookings(train, journey_date)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="manifest-{train.train_number}-{journey_date}.{extension}"'
+    return response
+
+
+@admin_required
+def admin_data_export(request):
+    """Admin: A whole table for analytics - JSON Lines, CSV or Parquet, streamed"""
+    table = request.GET.get('table', 'bookings')
+    export_format = request.GET.get('format', 'jsonl')
+    
+    if table not in EXPORT_TABLES or export_format not in DATA_EXPORT_FORMATS:
+        messages.error(request, 'Unknown table or export format!')
+        return redirect('accounts:admin_dashboard')
+    
+    # Bookings after a watermark: ?since=<booking_date>|<pnr>
+    since = None
+    if table == 'bookings' and request.GET.get('since'):
+        since = parse_watermark(request.GET['since'])
+        if since is None:
+            return HttpResponseBadRequest('since must look like <booking_date ISO>|<pnr>')
     
-    return render(request, 'bookings/ticket.html', context)
+    stream, content_type, extension, binary = DATA_EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(stream(TableExport(table, since=since)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{table}.{extension}"'
+    return response
@@ -68,6 +68,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Writers queue for the lock instead of failing at once
+            'timeout': 20,
+        },
+        # A file, not shared-cache memory - in memory, locked tables fail without waiting
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -124,4 +132,50 @@ AUTH_USER_MODEL = 'accounts.User'
 # Login URLs
 LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'trains:home'
-LOGOUT_REDIRECT_URL = 'trains:home'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'trains:home'
+
+# Minutes a seat stays held for an unpaid booking
+SEAT_HOLD_MINUTES = 15
+
+# Tickets can be booked this many days ahead - train runs are generated up to here
+BOOKING_HORIZON_DAYS = 10
+
+# Rendered PDF tickets, one file per PNR and content version - they hold passenger
+# details, so never under MEDIA_ROOT; download_ticket is the only way to them
+TICKET_CACHE_DIR = BASE_DIR / 'var' / 'tickets'
+
+# Search results live in their own cache - entries expire after TIMEOUT seconds
+# and the least recently used are evicted past MAX_ENTRIES. FileBasedCache works
+# too when results should be shared between worker processes on one host.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'search-results',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Version tokens that tell every worker process its route graph, timetable, fare
+    # matrix, station catalogue or cached searches are stale. In memory is enough
+    # for one process (runserver, tests); with several workers set VERSION_CACHE_URL
+    # so they share Redis. Each process memoizes tokens briefly (trains.versions).
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'version-tokens',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+if os.environ.get('VERSION_CACHE_URL'):
+    CACHES['versions'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['VERSION_CACHE_URL'],
+        'TIMEOUT': None,
+    }
+
+# Sessions only carry the login and flash messages - search state travels in a
+# signed token. 'django.contrib.sessions.backends.cache' or
+# 'django.contrib.sessions.backends.signed_cookies' keep them out of the database.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.db')
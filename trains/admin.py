@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Station, Train, Route, TrainSchedule
+from .models import Station, Train, TrainClass, Route, TrainSchedule, ScheduleException, TrainRun
 
 
 @admin.register(Station)
@@ -16,12 +16,18 @@ class RouteInline(admin.TabularInline):
     fields = ['station', 'sequence_order', 'distance_from_origin', 'departure_time', 'arrival_time']
 
 
+class TrainClassInline(admin.TabularInline):
+    model = TrainClass
+    extra = 0
+    fields = ['seat_class', 'coach_count', 'seats_per_coach', 'fare_multiplier']
+
+
 @admin.register(Train)
 class TrainAdmin(admin.ModelAdmin):
     list_display = ['train_number', 'train_name', 'total_seats', 'available_seats', 'off_day', 'classes_available']
     search_fields = ['train_number', 'train_name']
     list_filter = ['off_day']
-    inlines = [RouteInline]
+    inlines = [TrainClassInline, RouteInline]
 
 
 @admin.register(Route)
@@ -32,8 +38,25 @@ class RouteAdmin(admin.ModelAdmin):
     ordering = ['train', 'sequence_order']
 
 
+class ScheduleExceptionInline(admin.TabularInline):
+    model = ScheduleException
+    extra = 1
+    fields = ['start_date', 'end_date', 'is_running', 'reason']
+
+
 @admin.register(TrainSchedule)
 class TrainScheduleAdmin(admin.ModelAdmin):
     list_display = ['train', 'departure_time', 'arrival_time', 'off_days', 'status']
     list_filter = ['status']
-    search_fields = ['train__train_name']
\ No newline at end of file
+    search_fields = ['train__train_name']
+    inlines = [ScheduleExceptionInline]
+
+
+@admin.register(TrainRun)
+class TrainRunAdmin(admin.ModelAdmin):
+    list_display = ['train', 'journey_date', 'status', 'delay_minutes']
+    list_editable = ['status', 'delay_minutes']
+    list_filter = ['status', 'journey_date']
+    search_fields = ['train__train_number', 'train__train_name']
+    list_select_related = ['train']
+    date_hierarchy = 'journey_date'
@@ -0,0 +1,114 @@
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from typing import NamedTuple
+from .models import RoutePair, TrainClass
+from .versions import current_version, new_version
+
+FARE_MATRIX_VERSION_KEY = 'trains:fare_matrix_version'
+
+# Taka per KM, charged band by band - (band ends at KM, rate), None = no end
+DISTANCE_BANDS = [
+    (None, Decimal('2.00')),
+]
+
+# Per-class multipliers live on TrainClass - a search without a class pays this
+BASE_MULTIPLIER = Decimal('1.00')
+
+RESERVATION_CHARGE = Decimal('50.00')
+TAX_RATE = Decimal('0.05')
+
+CENT = Decimal('0.01')
+
+_fare_matrix = None
+_fare_matrix_version = None
+
+
+class Fare(NamedTuple):
+    distance: Decimal
+    base_fare: Decimal
+    reservation_charge: Decimal
+    tax: Decimal
+    total_fare: Decimal
+
+
+def to_money(amount):
+    return Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def distance_fare(distance, bands=None):
+    """Fare for the distance alone - each KM at the rate of the band it falls in"""
+    fare = Decimal(0)
+    start = Decimal(0)
+    for end, rate in bands or DISTANCE_BANDS:
+        if end is None or distance <= end:
+            return fare + (distance - start) * rate
+        fare += (end - start) * rate
+        start = Decimal(end)
+    return fare
+
+
+def tax_and_total(base_fare, reservation_charge):
+    """Tax on base fare + reservation charge, and the total - Returns (tax, total)"""
+    tax = to_money((base_fare + reservation_charge) * TAX_RATE)
+    return tax, base_fare + reservation_charge + tax
+
+
+@lru_cache(maxsize=4096)
+def compute_fare(distance, multiplier=BASE_MULTIPLIER):
+    """Full fare for one passenger - Decimal throughout, rounded to the paisa"""
+    distance = to_money(distance)
+    base_fare = to_money(distance_fare(distance) * multiplier)
+    tax, total_fare = tax_and_total(base_fare, RESERVATION_CHARGE)
+    return Fare(distance, base_fare, RESERVATION_CHARGE, tax, total_fare)
+
+
+class FareMatrix:
+    """Precomputed fares - (train, origin, destination, class) -> Fare"""
+
+    def __init__(self):
+        self.fares = {}
+
+    def load(self, pairs, multipliers):
+        """pairs: (train_id, origin_id, destination_id, distance) rows
+        multipliers: {train_id: [(seat_class, fare_multiplier)]}
+        """
+        for train_id, origin_id, destination_id, distance in pairs:
+            for seat_class, multiplier in [('', BASE_MULTIPLIER)] + multipliers.get(train_id, []):
+                self.fares[train_id, origin_id, destination_id, seat_class] = compute_fare(distance, multiplier)
+
+    def fare(self, train_id, origin_id, destination_id, seat_class='', distance=None, multiplier=BASE_MULTIPLIER):
+        """Look a fare up - computed from distance when the pair is not in the matrix"""
+        fare = self.fares.get((train_id, origin_id, destination_id, seat_class))
+        if fare is None and distance is not None:
+            fare = compute_fare(distance, multiplier)
+        return fare
+
+
+def build_fare_matrix():
+    """Build the matrix from the RoutePair index and TrainClass rows - two queries"""
+    multipliers = {}
+    for train_id, seat_class, multiplier in TrainClass.objects.values_list('train_id', 'seat_class', 'fare_multiplier'):
+        multipliers.setdefault(train_id, []).append((seat_class, multiplier))
+
+    pairs = RoutePair.objects.order_by().values_list(
+        'train_id', 'origin_station_id', 'destination_station_id', 'distance'
+    )
+    matrix = FareMatrix()
+    matrix.load(pairs.iterator(chunk_size=5000), multipliers)
+    return matrix
+
+
+def get_fare_matrix():
+    """Process-wide fare matrix, rebuilt after route distances or train classes change"""
+    global _fare_matrix, _fare_matrix_version
+
+    version = current_version(FARE_MATRIX_VERSION_KEY)
+    if _fare_matrix is None or _fare_matrix_version != version:
+        _fare_matrix = build_fare_matrix()
+        _fare_matrix_version = version
+    return _fare_matrix
+
+
+def invalidate_fare_matrix():
+    """Mark every process's fare matrix as stale"""
+    new_version(FARE_MATRIX_VERSION_KEY)
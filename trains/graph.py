@@ -0,0 +1,76 @@
+import heapq
+from .models import Route
+from .versions import current_version, new_version
+
+GRAPH_VERSION_KEY = 'trains:route_graph_version'
+
+_graph = None
+_graph_version = None
+
+
+class StationGraph:
+    """Station adjacency graph - An edge joins two consecutive stops of a train, weighted by KM"""
+
+    def __init__(self):
+        self.adjacency = {}
+
+    def add_edge(self, a, b, km):
+        if a == b:
+            return
+        # Keep the shortest track between two stations
+        if km < self.adjacency.setdefault(a, {}).get(b, float('inf')):
+            self.adjacency[a][b] = km
+            self.adjacency.setdefault(b, {})[a] = km
+
+    def nearby_stations(self, station_id, max_km):
+        """Dijkstra from station_id - Returns [(station_id, km), ...] within max_km, nearest first"""
+        best = {station_id: 0.0}
+        heap = [(0.0, station_id)]
+        found = []
+
+        while heap:
+            km, current = heapq.heappop(heap)
+            if km > best.get(current, float('inf')):
+                continue
+            if current != station_id:
+                found.append((current, km))
+
+            for neighbour, edge_km in self.adjacency.get(current, {}).items():
+                new_km = km + edge_km
+                if new_km <= max_km and new_km < best.get(neighbour, float('inf')):
+                    best[neighbour] = new_km
+                    heapq.heappush(heap, (new_km, neighbour))
+
+        return found
+
+
+def build_route_graph():
+    """Build the station graph from all Route rows - one query"""
+    graph = StationGraph()
+    rows = Route.objects.order_by('train_id', 'sequence_order').values_list(
+        'train_id', 'station_id', 'distance_from_origin'
+    )
+
+    previous = None
+    for train_id, station_id, distance in rows.iterator(chunk_size=5000):
+        if previous and previous[0] == train_id:
+            graph.add_edge(previous[1], station_id, abs(float(distance - previous[2])))
+        previous = (train_id, station_id, distance)
+
+    return graph
+
+
+def get_route_graph():
+    """Process-wide station graph, rebuilt after Route rows change"""
+    global _graph, _graph_version
+
+    version = current_version(GRAPH_VERSION_KEY)
+    if _graph is None or _graph_version != version:
+        _graph = build_route_graph()
+        _graph_version = version
+    return _graph
+
+
+def invalidate_route_graph():
+    """Mark every process's station graph as stale"""
+    new_version(GRAPH_VERSION_KEY)
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from trains.runs import generate_runs
+
+
+class Command(BaseCommand):
+    help = 'Create a run for every train date in the booking horizon - safe to run repeatedly, e.g. nightly'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.BOOKING_HORIZON_DAYS,
+                            help='Days ahead of today to cover (default settings.BOOKING_HORIZON_DAYS)')
+
+    def handle(self, *args, **options):
+        created, removed = generate_runs(days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Train runs: {created} created, {removed} removed or cancelled'))
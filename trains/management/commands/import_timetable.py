@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from trains.timetable_import import IMPORT_BATCH_SIZE, TIMETABLE_FILES, TimetableImporter
+
+# Row errors printed before the rest are only counted
+MAX_ERRORS_SHOWN = 20
+
+
+class Command(BaseCommand):
+    help = ('Import stations, trains, schedules and route stops from a directory of CSV files '
+            f'({", ".join(TIMETABLE_FILES)})')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory holding the timetable CSV files')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Rows written per transaction')
+
+    def handle(self, *args, **options):
+        importer = TimetableImporter(batch_size=options['batch_size'])
+        try:
+            report = importer.import_directory(options['directory'])
+        except FileNotFoundError as e:
+            raise CommandError(e)
+
+        for name, rows, seconds in report:
+            rate = rows / seconds if seconds else rows
+            self.stdout.write(f'{name}: {rows} rows in {seconds:.2f}s ({rate:,.0f} rows/s)')
+
+        for error in importer.errors[:MAX_ERRORS_SHOWN]:
+            self.stderr.write(error)
+        if len(importer.errors) > MAX_ERRORS_SHOWN:
+            self.stderr.write(f'... and {len(importer.errors) - MAX_ERRORS_SHOWN} more errors')
+
+        style = self.style.WARNING if importer.errors else self.style.SUCCESS
+        self.stdout.write(style(f'Timetable imported with {len(importer.errors)} errors'))
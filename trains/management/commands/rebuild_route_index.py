@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from trains.route_index import rebuild_all_route_indexes
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the origin -> destination route index from all Route rows'
+
+    def handle(self, *args, **options):
+        count = rebuild_all_route_indexes()
+        self.stdout.write(self.style.SUCCESS(f'Route index rebuilt: {count} station pairs'))
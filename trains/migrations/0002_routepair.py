@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_route_pairs(apps, schema_editor):
+    """Index the routes that already exist"""
+    Route = apps.get_model('trains', 'Route')
+    RoutePair = apps.get_model('trains', 'RoutePair')
+
+    routes_by_train = {}
+    for route in Route.objects.order_by('train_id', 'sequence_order'):
+        routes_by_train.setdefault(route.train_id, []).append(route)
+
+    pairs = []
+    for routes in routes_by_train.values():
+        for i, origin_route in enumerate(routes):
+            for dest_route in routes[i + 1:]:
+                pairs.append(RoutePair(
+                    train_id=origin_route.train_id,
+                    origin_station_id=origin_route.station_id,
+                    destination_station_id=dest_route.station_id,
+                    origin_route_id=origin_route.id,
+                    destination_route_id=dest_route.id,
+                    origin_sequence=origin_route.sequence_order,
+                    destination_sequence=dest_route.sequence_order,
+                    distance=dest_route.distance_from_origin - origin_route.distance_from_origin,
+                ))
+    RoutePair.objects.bulk_create(pairs, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trains', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoutePair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin_sequence', models.IntegerField()),
+                ('destination_sequence', models.IntegerField()),
+                ('distance', models.DecimalField(decimal_places=2, default=0, help_text='Distance in KM between the two stations', max_digits=6)),
+                ('destination_route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trains.route')),
+                ('destination_station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trains.station')),
+                ('origin_route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trains.route')),
+                ('origin_station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trains.station')),
+                ('train', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_pairs', to='trains.train')),
+            ],
+            options={
+                'verbose_name': 'Route Pair',
+                'verbose_name_plural': 'Route Pairs',
+                'ordering': ['train', 'origin_sequence'],
+                'indexes': [models.Index(fields=['origin_station', 'destination_station'], name='routepair_od_idx')],
+                'unique_together': {('origin_route', 'destination_route')},
+            },
+        ),
+        migrations.RunPython(populate_route_pairs, migrations.RunPython.noop),
+    ]
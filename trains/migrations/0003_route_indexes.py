@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trains', '0002_routepair'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='route',
+            index=models.Index(fields=['station', 'train', 'sequence_order'], name='route_station_train_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Copied from trains.models as it was when this migration was written - the
+# migration must keep producing the same masks whatever happens to the model
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+EVERY_DAY = 0b1111111
+
+
+def running_days_mask(off_days):
+    """Compile an off days string like "Friday, Sunday" into a weekday bitmask"""
+    mask = EVERY_DAY
+    for name in (off_days or '').split(','):
+        name = name.strip().capitalize()
+        if name in WEEKDAYS:
+            mask &= ~(1 << WEEKDAYS.index(name))
+    return mask
+
+
+def compile_running_days(apps, schema_editor):
+    """Compile the off days of existing schedules"""
+    TrainSchedule = apps.get_model('trains', 'TrainSchedule')
+
+    schedules = list(TrainSchedule.objects.all())
+    for schedule in schedules:
+        schedule.running_days = running_days_mask(schedule.off_days)
+    TrainSchedule.objects.bulk_update(schedules, ['running_days'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trains', '0003_route_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trainschedule',
+            name='running_days',
+            field=models.PositiveSmallIntegerField(default=127, editable=False, help_text='off_days compiled to a weekday bitmask'),
+        ),
+        migrations.RunPython(compile_running_days, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ScheduleException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('is_running', models.BooleanField(default=False, help_text='Runs every day of the range (e.g. Eid special) instead of not at all')),
+                ('reason', models.CharField(blank=True, max_length=100)),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='trains.trainschedule')),
+            ],
+            options={
+                'verbose_name': 'Schedule Exception',
+                'verbose_name_plural': 'Schedule Exceptions',
+                'ordering': ['start_date'],
+                'indexes': [models.Index(fields=['schedule', 'start_date', 'end_date'], name='exception_schedule_dates_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:52
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+# Copied from trains.models as it was when this migration was written - the
+# migration must not change with the model's helpers
+def parse_classes(classes_available):
+    """Class names in a classes_available string like "AC, Non-AC" - each once, in the order typed"""
+    return list(dict.fromkeys(name.strip() for name in (classes_available or '').split(',') if name.strip()))
+
+
+def create_train_classes(apps, schema_editor):
+    """One TrainClass per class in classes_available - coaches and seats split evenly"""
+    Train = apps.get_model('trains', 'Train')
+    TrainClass = apps.get_model('trains', 'TrainClass')
+
+    rows = []
+    for train in Train.objects.all():
+        names = parse_classes(train.classes_available)
+        coach_count = max(1, train.total_coaches // max(1, len(names)))
+        seats_per_coach = max(1, train.total_seats // max(1, len(names) * coach_count))
+        rows += [
+            TrainClass(train=train, seat_class=name, coach_count=coach_count, seats_per_coach=seats_per_coach)
+            for name in names
+        ]
+    TrainClass.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trains', '0004_schedule_running_days'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainClass',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seat_class', models.CharField(choices=[('AC', 'Air Conditioned'), ('Non-AC', 'Non Air Conditioned'), ('Sleeper', 'Sleeper')], max_length=20)),
+                ('coach_count', models.PositiveIntegerField(default=1)),
+                ('seats_per_coach', models.PositiveIntegerField(default=50)),
+                ('fare_multiplier', models.DecimalField(decimal_places=2, default=Decimal('1.00'), help_text='Multiplies the distance fare, e.g. 1.50 for AC', max_digits=4)),
+                ('train', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_classes', to='trains.train')),
+            ],
+            options={
+                'verbose_name': 'Train Class',
+                'verbose_name_plural': 'Train Classes',
+                'ordering': ['train', 'seat_class'],
+                'indexes': [models.Index(fields=['seat_class', 'train'], name='trainclass_class_train_idx')],
+                'unique_together': {('train', 'seat_class')},
+            },
+        ),
+        migrations.RunPython(create_train_classes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trains', '0005_trainclass'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='train',
+            index=models.Index(fields=['train_name'], name='train_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trainschedule',
+            index=models.Index(fields=['status', 'train'], name='schedule_status_train_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:22
+
+import django.db.models.deletion
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_runs(apps, schema_editor):
+    """Runs for the booking horizon from the schedules - later kept up by generate_train_runs"""
+    TrainSchedule = apps.get_model('trains', 'TrainSchedule')
+    TrainRun = apps.get_model('trains', 'TrainRun')
+
+    # Later dates get their runs from generate_train_runs, or lazily (trains.runs.ensure_runs)
+    horizon = getattr(settings, 'BOOKING_HORIZON_DAYS', 10)
+    dates = [date.today() + timedelta(days=n) for n in range(horizon + 1)]
+    runs = []
+    for schedule in TrainSchedule.objects.filter(status='active').prefetch_related('exceptions'):
+        for day in dates:
+            covering = [e.is_running for e in schedule.exceptions.all() if e.start_date <= day <= e.end_date]
+            if all(covering) if covering else schedule.running_days & (1 << day.weekday()):
+                runs.append(TrainRun(train_id=schedule.train_id, journey_date=day))
+    TrainRun.objects.bulk_create(runs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trains', '0006_admin_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journey_date', models.DateField()),
+                ('status', models.CharField(choices=[('running', 'Running'), ('cancelled', 'Cancelled'), ('delayed', 'Delayed')], default='running', max_length=20)),
+                ('delay_minutes', models.IntegerField(default=0, help_text='Delay in minutes')),
+                ('train', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='trains.train')),
+            ],
+            options={
+                'verbose_name': 'Train Run',
+                'verbose_name_plural': 'Train Runs',
+                'ordering': ['journey_date', 'train'],
+                'indexes': [models.Index(fields=['journey_date', 'train'], name='run_date_train_idx')],
+                'unique_together': {('train', 'journey_date')},
+            },
+        ),
+        migrations.RunPython(create_runs, migrations.RunPython.noop),
+    ]
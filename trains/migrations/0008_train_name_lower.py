@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+def lower_train_names(apps, schema_editor):
+    """Fill the lower-cased name of existing trains"""
+    Train = apps.get_model('trains', 'Train')
+
+    trains = list(Train.objects.only('id', 'train_name'))
+    for train in trains:
+        train.train_name_lower = train.train_name.lower()
+    Train.objects.bulk_update(trains, ['train_name_lower'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trains', '0007_train_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='train',
+            name='train_name_lower',
+            field=models.CharField(default='', editable=False, help_text='train_name lower-cased - name search seeks into its index', max_length=100),
+        ),
+        migrations.RunPython(lower_train_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='train',
+            index=models.Index(fields=['train_name_lower'], name='train_name_lower_idx'),
+        ),
+    ]
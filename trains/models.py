@@ -1,4 +1,6 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models.lookups import GreaterThan
 
 
 class Station(models.Model):
@@ -33,30 +35,76 @@ class Train(models.Model):
     classes_available = models.CharField(max_length=100, help_text="e.g., AC,Non-AC,Sleeper")
     off_day = models.CharField(max_length=50, blank=True, null=True, 
                                 help_text="Days when train doesn't run (e.g., Sunday)")
+    train_name_lower = models.CharField(max_length=100, editable=False, default='',
+                                        help_text="train_name lower-cased - name search seeks into its index")
     
     def __str__(self):
         return f"{self.train_name} ({self.train_number})"
     
-    def book_seat(self, count=1):
-        """Reduce available seats"""
-        if self.available_seats >= count:
-            self.available_seats -= count
-            self.save()
-            return True
-        return False
-    
-    def release_seat(self, count=1):
-        """Increase available seats"""
-        if self.available_seats + count <= self.total_seats:
-            self.available_seats += count
-            self.save()
+    def save(self, *args, **kwargs):
+        self.train_name_lower = self.train_name.lower()
+        super().save(*args, **kwargs)
     
     class Meta:
         ordering = ['train_name']
+        indexes = [
+            models.Index(fields=['train_name'], name='train_name_idx'),
+            models.Index(fields=['train_name_lower'], name='train_name_lower_idx'),
+        ]
         verbose_name = 'Train'
         verbose_name_plural = 'Trains'
 
 
+class TrainClass(models.Model):
+    """Seat class on a train - Coaches, seats per coach and fare multiplier"""
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='seat_classes')
+    seat_class = models.CharField(max_length=20, choices=Train.CLASS_CHOICES)
+    coach_count = models.PositiveIntegerField(default=1)
+    seats_per_coach = models.PositiveIntegerField(default=50)
+    fare_multiplier = models.DecimalField(max_digits=4, decimal_places=2, default=Decimal('1.00'),
+                                          help_text="Multiplies the distance fare, e.g. 1.50 for AC")
+    
+    def __str__(self):
+        return f"{self.train.train_name} - {self.seat_class}"
+    
+    @property
+    def capacity(self):
+        return self.coach_count * self.seats_per_coach
+    
+    class Meta:
+        ordering = ['train', 'seat_class']
+        unique_together = ['train', 'seat_class']
+        indexes = [
+            models.Index(fields=['seat_class', 'train'], name='trainclass_class_train_idx'),
+        ]
+        verbose_name = 'Train Class'
+        verbose_name_plural = 'Train Classes'
+
+
+def parse_classes(classes_available):
+    """Class names in a classes_available string like "AC, Non-AC" - each once, in the order typed"""
+    return list(dict.fromkeys(name.strip() for name in (classes_available or '').split(',') if name.strip()))
+
+
+def split_coaches(total_coaches, total_seats, class_count):
+    """Coaches and seats per coach each of class_count classes gets - an even split"""
+    coach_count = max(1, int(total_coaches) // max(1, class_count))
+    seats_per_coach = max(1, int(total_seats) // max(1, class_count * coach_count))
+    return coach_count, seats_per_coach
+
+
+def sync_seat_classes(train, class_names):
+    """Make the train's TrainClass rows match class_names - new classes split the coaches and seats evenly"""
+    class_names = list(dict.fromkeys(class_names))
+    train.seat_classes.exclude(seat_class__in=class_names).delete()
+    existing = set(train.seat_classes.values_list('seat_class', flat=True))
+    coach_count, seats_per_coach = split_coaches(train.total_coaches, train.total_seats, len(class_names))
+    TrainClass.objects.bulk_create([
+        TrainClass(train=train, seat_class=name, coach_count=coach_count, seats_per_coach=seats_per_coach)
+        for name in class_names if name not in existing
+    ])
+
+
 class Route(models.Model):
     """Train stops at stations - Each entry is one station in the route"""
     train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='routes')
@@ -74,10 +122,80 @@ class Route(models.Model):
     class Meta:
         ordering = ['train', 'sequence_order']
         unique_together = ['train', 'sequence_order']
+        indexes = [
+            models.Index(fields=['station', 'train', 'sequence_order'], name='route_station_train_idx'),
+        ]
         verbose_name = 'Route'
         verbose_name_plural = 'Routes'
 
 
+class RoutePair(models.Model):
+    """Origin -> Destination index - One row per ordered station pair on a train's route"""
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='route_pairs')
+    origin_station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='+')
+    destination_station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='+')
+    origin_route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='+')
+    destination_route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='+')
+    origin_sequence = models.IntegerField()
+    destination_sequence = models.IntegerField()
+    distance = models.DecimalField(max_digits=6, decimal_places=2, default=0,
+                                   help_text="Distance in KM between the two stations")
+    
+    def __str__(self):
+        return f"{self.train.train_name}: {self.origin_station.station_code} -> {self.destination_station.station_code}"
+    
+    class Meta:
+        ordering = ['train', 'origin_sequence']
+        unique_together = ['origin_route', 'destination_route']
+        indexes = [
+            models.Index(fields=['origin_station', 'destination_station'], name='routepair_od_idx'),
+        ]
+        verbose_name = 'Route Pair'
+        verbose_name_plural = 'Route Pairs'
+
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Bit N set = runs on WEEKDAYS[N] (date.weekday() order)
+EVERY_DAY = 0b1111111
+
+
+def running_days_mask(off_days):
+    """Compile an off days string like "Friday, Sunday" into a weekday bitmask"""
+    mask = EVERY_DAY
+    for name in (off_days or '').split(','):
+        name = name.strip().capitalize()
+        if name in WEEKDAYS:
+            mask &= ~(1 << WEEKDAYS.index(name))
+    return mask
+
+
+def running_on_q(date, path=''):
+    """Condition for "schedule runs on date" - path leads to the schedule, e.g. 'train__schedule__'
+
+    Active, not cancelled by an exception, and either the weekday bit is set or
+    an exception adds an extra run.
+    """
+    exceptions = ScheduleException.objects.filter(
+        schedule=models.OuterRef(f'{path}pk'),
+        start_date__lte=date,
+        end_date__gte=date,
+    )
+    runs_on_weekday = GreaterThan(models.F(f'{path}running_days').bitand(1 << date.weekday()), 0)
+    return models.Q(
+        ~models.Exists(exceptions.filter(is_running=False)),
+        runs_on_weekday | models.Exists(exceptions.filter(is_running=True)),
+        **{f'{path}status': 'active'},
+    )
+
+
+class TrainScheduleQuerySet(models.QuerySet):
+
+    def running_on(self, date):
+        """Active schedules running on date - weekday bit and exceptions tested in SQL"""
+        return self.filter(running_on_q(date))
+
+
 class TrainSchedule(models.Model):
     """Train Schedule - Times and Off Days"""
     
@@ -90,23 +208,85 @@ class TrainSchedule(models.Model):
     # Off days
     off_days = models.CharField(max_length=100, blank=True, null=True,
                                  help_text="Days when train doesn't run (e.g., Sunday,Monday)")
+    running_days = models.PositiveSmallIntegerField(default=EVERY_DAY, editable=False,
+                                                    help_text="off_days compiled to a weekday bitmask")
     
     # Status
     status = models.CharField(max_length=20, default='active', 
                               choices=[('active', 'Active'), ('suspended', 'Suspended')])
     
+    objects = TrainScheduleQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.train.train_name} Schedule"
     
+    def save(self, *args, **kwargs):
+        self.running_days = running_days_mask(self.off_days)
+        super().save(*args, **kwargs)
+    
     def is_running_on_date(self, date):
-        """Check if train runs on given date"""
-        if not self.off_days:
-            return True
-        
-        day_name = date.strftime('%A')  # Monday, Tuesday, etc.
-        off_day_list = [d.strip() for d in self.off_days.split(',')]
-        return day_name not in off_day_list
+        """Check if train runs on given date - an exception covering the date, else the weekday bit"""
+        covering = [
+            exception.is_running for exception in self.exceptions.all()
+            if exception.start_date <= date <= exception.end_date
+        ]
+        if covering:
+            # A cancellation beats an extra run on the same date
+            return all(covering)
+        return bool(self.running_days & (1 << date.weekday()))
     
     class Meta:
+        indexes = [
+            models.Index(fields=['status', 'train'], name='schedule_status_train_idx'),
+        ]
         verbose_name = 'Train Schedule'
-        verbose_name_plural = 'Train Schedules'
\ No newline at end of file
+        verbose_name_plural = 'Train Schedules'
+
+
+class ScheduleException(models.Model):
+    """Date range where a train departs differently from its weekdays - holidays, suspensions, specials"""
+    schedule = models.ForeignKey(TrainSchedule, on_delete=models.CASCADE, related_name='exceptions')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    is_running = models.BooleanField(default=False,
+                                     help_text="Runs every day of the range (e.g. Eid special) instead of not at all")
+    reason = models.CharField(max_length=100, blank=True)
+    
+    def __str__(self):
+        state = 'Runs' if self.is_running else 'Cancelled'
+        return f"{self.schedule.train.train_name}: {state} {self.start_date} - {self.end_date}"
+    
+    class Meta:
+        ordering = ['start_date']
+        indexes = [
+            models.Index(fields=['schedule', 'start_date', 'end_date'], name='exception_schedule_dates_idx'),
+        ]
+        verbose_name = 'Schedule Exception'
+        verbose_name_plural = 'Schedule Exceptions'
+
+
+class TrainRun(models.Model):
+    """One departure of a train on one date - generated ahead for the booking horizon"""
+
+    STATUS_CHOICES = (
+        ('running', 'Running'),
+        ('cancelled', 'Cancelled'),
+        ('delayed', 'Delayed'),
+    )
+
+    train = models.ForeignKey(Train, on_delete=models.CASCADE, related_name='runs')
+    journey_date = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    delay_minutes = models.IntegerField(default=0, help_text="Delay in minutes")
+
+    def __str__(self):
+        return f"{self.train.train_name} - {self.journey_date} ({self.status})"
+
+    class Meta:
+        ordering = ['journey_date', 'train']
+        unique_together = ['train', 'journey_date']
+        indexes = [
+            models.Index(fields=['journey_date', 'train'], name='run_date_train_idx'),
+        ]
+        verbose_name = 'Train Run'
+        verbose_name_plural = 'Train Runs'
@@ -0,0 +1,80 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Rows per admin list page
+ADMIN_PAGE_SIZE = 50
+
+# Lists count this many rows at most, then show "1000+" rather than COUNT(*) every row
+COUNT_CAP = 1000
+
+
+def count_estimate(queryset, cap=COUNT_CAP):
+    """Rows in queryset, counted no further than cap - (count, exact)"""
+    count = queryset.order_by()[:cap + 1].count()
+    return min(count, cap), count <= cap
+
+
+def prefix_q(field, prefix):
+    """Condition for "field starts with prefix", case-sensitive
+
+    Spelled as a range so the database can seek into field's index - SQLite
+    runs LIKE (what startswith and istartswith compile to) case-insensitively,
+    which a plain index cannot serve, so it reads every row.
+    """
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + chr(0x10FFFF)})
+
+
+def _after(fields, values):
+    """Rows past values in fields order - (a > x) or (a = x and b > y) ...
+
+    The leading a >= x is implied but spelled out, so the database can seek
+    into the index instead of testing every row.
+    """
+    condition = Q(**{f'{fields[-1]}__gt': values[-1]})
+    for field, value in zip(reversed(fields[:-1]), reversed(values[:-1])):
+        condition = Q(**{f'{field}__gt': value}) | (Q(**{field: value}) & condition)
+    return Q(**{f'{fields[0]}__gte': values[0]}) & condition
+
+
+def keyset_page(queryset, fields, cursor='', size=ADMIN_PAGE_SIZE):
+    """One page of queryset in fields order, starting after cursor - (rows, next cursor)
+
+    The last field must be unique. A cursor is the last row's values joined
+    by '|' - only the first field may contain '|' itself. A malformed cursor
+    starts from the top.
+    """
+    queryset = queryset.order_by(*fields)
+    values = cursor.rsplit('|', len(fields) - 1) if cursor else []
+    if len(values) == len(fields):
+        try:
+            queryset = queryset.filter(_after(fields, values))
+        except (ValueError, ValidationError):
+            pass
+
+    rows = list(queryset[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, '|'.join(str(getattr(rows[-1], field)) for field in fields)
+
+
+def list_page(request, queryset, fields):
+    """Template context for one admin list page - rows, count estimate and links that keep the filters"""
+    cursor = request.GET.get('after', '')
+    rows, next_cursor = keyset_page(queryset, fields, cursor, ADMIN_PAGE_SIZE)
+    count, exact = count_estimate(queryset, COUNT_CAP)
+
+    query = request.GET.copy()
+    query.pop('after', None)
+    first_query = query.urlencode()
+    if next_cursor:
+        query['after'] = next_cursor
+
+    return {
+        'page': rows,
+        'count': count,
+        'count_exact': exact,
+        'is_first_page': not cursor,
+        'first_query': first_query,
+        'next_query': query.urlencode() if next_cursor else None,
+    }
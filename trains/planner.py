@@ -0,0 +1,209 @@
+import heapq
+from array import array
+from datetime import datetime, time, timedelta
+from .models import Route
+from .runs import RUNS_VERSION_KEY, bookable_trains
+from .versions import current_version, new_version
+
+TIMETABLE_VERSION_KEY = 'trains:timetable_version'
+
+# Minutes needed to change trains at a station
+MIN_CONNECTION_MINUTES = 20
+
+# Up to two changes = up to three trains
+MAX_TRANSFERS = 2
+
+MINUTES_PER_DAY = 24 * 60
+INF = float('inf')
+
+_timetable = None
+_timetable_version = None
+
+
+def _minutes(value, day_offset):
+    return day_offset * MINUTES_PER_DAY + value.hour * 60 + value.minute
+
+
+class Timetable:
+    """Array-backed timetable - One elementary connection per pair of consecutive stops
+
+    Times are minutes from midnight of the day the train starts its run.
+    Connections are sorted by departure time, as the Connection Scan Algorithm needs.
+    """
+
+    def __init__(self):
+        self.station_ids = []
+        self.station_index = {}
+        self.train_ids = []
+
+        self.dep_stop = array('i')
+        self.arr_stop = array('i')
+        self.dep_time = array('i')
+        self.arr_time = array('i')
+        self.train = array('i')
+
+        # Scan order per journey date - only the booking window is ever asked for.
+        # It follows the bookable runs, so it is dropped when the runs change.
+        self._scan_cache = {}
+        self.runs_version = None
+
+    def _station(self, station_id):
+        if station_id not in self.station_index:
+            self.station_index[station_id] = len(self.station_ids)
+            self.station_ids.append(station_id)
+        return self.station_index[station_id]
+
+    def load(self, route_rows):
+        """route_rows: (train_id, station_id, arrival, departure, day_offset) sorted by train, sequence"""
+        connections = []
+        train_index = {}
+        previous = None
+
+        for train_id, station_id, arrival, departure, day_offset in route_rows:
+            stop = self._station(station_id)
+            arr = _minutes(arrival or departure, day_offset)
+            dep = _minutes(departure, day_offset)
+            if dep < arr:
+                dep += MINUTES_PER_DAY
+
+            if previous and previous[0] == train_id:
+                if train_id not in train_index:
+                    train_index[train_id] = len(self.train_ids)
+                    self.train_ids.append(train_id)
+                connections.append((previous[2], arr, previous[1], stop, train_index[train_id]))
+            previous = (train_id, stop, dep)
+
+        connections.sort()
+        for dep, arr, dep_stop, arr_stop, train in connections:
+            self.dep_time.append(dep)
+            self.arr_time.append(arr)
+            self.dep_stop.append(dep_stop)
+            self.arr_stop.append(arr_stop)
+            self.train.append(train)
+
+    def use_runs(self, version):
+        """Scan orders built from older runs are dropped"""
+        if version != self.runs_version:
+            self._scan_cache.clear()
+            self.runs_version = version
+
+    def _trip_connections(self, running_ids, shift):
+        """Connections of the trains in running_ids, shifted by whole days"""
+        running = [train_id in running_ids for train_id in self.train_ids]
+        offset = shift * MINUTES_PER_DAY
+        for c in range(len(self.dep_time)):
+            train = self.train[c]
+            if running[train] and self.dep_time[c] + offset >= 0:
+                yield self.dep_time[c] + offset, self.arr_time[c] + offset, c, train * 3 + shift + 1
+
+    def _scan_order(self, journey_date):
+        """Connections of the runs that can touch journey_date, merged by departure time
+
+        Yields (departure, arrival, connection index, trip id) with times relative
+        to midnight of journey_date. A trip is one train on one service day, and
+        only service days with a bookable TrainRun count - one query.
+        """
+        running = bookable_trains([journey_date + timedelta(days=shift) for shift in (-1, 0, 1)])
+        return heapq.merge(*[
+            self._trip_connections(running[journey_date + timedelta(days=shift)], shift)
+            for shift in (-1, 0, 1)
+        ])
+
+    def plan(self, origin_id, destination_id, journey_date,
+             max_transfers=MAX_TRANSFERS, min_connection=MIN_CONNECTION_MINUTES):
+        """Earliest-arrival journeys leaving origin on journey_date
+
+        Round-based CSA: round k allows k trains. Returns the best journey for each
+        number of trains that improves the arrival time, fewest changes first.
+        """
+        origin = self.station_index.get(origin_id)
+        target = self.station_index.get(destination_id)
+        if origin is None or target is None or origin == target:
+            return []
+
+        connections = self._scan_cache.get(journey_date)
+        if connections is None:
+            if len(self._scan_cache) >= 16:
+                self._scan_cache.clear()
+            connections = self._scan_cache[journey_date] = list(self._scan_order(journey_date))
+        stations = len(self.station_ids)
+        arrival = [[INF] * stations]
+        arrival[0][origin] = 0
+        parents = [{}]
+        journeys = []
+
+        for k in range(1, max_transfers + 2):
+            previous = arrival[k - 1]
+            current = previous[:]
+            parent = dict(parents[k - 1])
+            boarded = {}
+            change = min_connection if k > 1 else 0
+
+            for dep, arr, c, trip in connections:
+                if dep >= current[target]:
+                    break
+                if trip not in boarded:
+                    ready = previous[self.dep_stop[c]]
+                    if ready == INF or (ready + change > dep and self.dep_stop[c] != origin):
+                        continue
+                    boarded[trip] = (dep, self.dep_stop[c])
+                stop = self.arr_stop[c]
+                if arr < current[stop]:
+                    current[stop] = arr
+                    parent[stop] = (boarded[trip], trip, arr)
+
+            arrival.append(current)
+            parents.append(parent)
+            if current[target] < previous[target]:
+                journeys.append(self._legs(parents, k, target, origin))
+
+        return journeys
+
+    def _legs(self, parents, k, stop, origin):
+        legs = []
+        while stop != origin:
+            (dep, board_stop), trip, arr = parents[k][stop]
+            legs.append({
+                'train_id': self.train_ids[trip // 3],
+                'from_station_id': self.station_ids[board_stop],
+                'to_station_id': self.station_ids[stop],
+                'departure': dep,
+                'arrival': arr,
+            })
+            stop = board_stop
+            k -= 1
+        legs.reverse()
+        return legs
+
+
+def build_timetable():
+    """Build the timetable from all Route rows - one query; which days trains run comes from TrainRun"""
+    rows = Route.objects.order_by('train_id', 'sequence_order').values_list(
+        'train_id', 'station_id', 'arrival_time', 'departure_time', 'day_offset'
+    )
+
+    timetable = Timetable()
+    timetable.load(rows.iterator(chunk_size=5000))
+    return timetable
+
+
+def get_timetable():
+    """Process-wide timetable, rebuilt after Route rows change - scan orders also follow TrainRun changes"""
+    global _timetable, _timetable_version
+
+    version = current_version(TIMETABLE_VERSION_KEY)
+    if _timetable is None or _timetable_version != version:
+        _timetable = build_timetable()
+        _timetable_version = version
+    _timetable.use_runs(current_version(RUNS_VERSION_KEY))
+    return _timetable
+
+
+def invalidate_timetable():
+    """Mark every process's timetable as stale"""
+    new_version(TIMETABLE_VERSION_KEY)
+
+
+def minutes_to_datetime(journey_date, minutes):
+    """Turn minutes from midnight of journey_date into a datetime"""
+    return datetime.combine(journey_date, time()) + timedelta(minutes=minutes)
@@ -0,0 +1,148 @@
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from bookings.inventory import move_seat_legs
+from .models import Station, Route
+from .fares import invalidate_fare_matrix
+from .graph import invalidate_route_graph
+from .planner import invalidate_timetable
+from .route_index import rebuild_route_index
+from .search_cache import invalidate_train_searches
+from .signals import batched_route_changes
+from .timetable_import import RowError, parse_clock
+
+STOP_FIELDS = ['station', 'sequence_order', 'arrival_time', 'departure_time', 'distance_from_origin', 'day_offset']
+
+
+class RouteEditError(ValueError):
+    """A stop list that cannot become a route - errors lists every problem found"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def route_stops(train):
+    """The train's stops as plain dicts - what the editor page and API show"""
+    return [
+        {
+            'station_code': route.station.station_code,
+            'station_name': route.station.station_name,
+            'sequence_order': route.sequence_order,
+            'arrival_time': route.arrival_time.strftime('%H:%M') if route.arrival_time else '',
+            'departure_time': route.departure_time.strftime('%H:%M'),
+            'distance_from_origin': str(route.distance_from_origin),
+            'day_offset': route.day_offset,
+        }
+        for route in train.routes.select_related('station').order_by('sequence_order')
+    ]
+
+
+def parse_stops(rows):
+    """Unsaved Route objects from dicts of strings, in order - station codes resolved in one query
+
+    Distance must never fall, a stop needs a departure time (the last may give
+    only an arrival) and a route has at least two stops.
+    """
+    codes = [str(row.get('station_code') or '').strip() for row in rows]
+    station_ids = dict(Station.objects.filter(station_code__in=codes).values_list('station_code', 'id'))
+
+    stops, errors = [], []
+    for number, (code, row) in enumerate(zip(codes, rows), start=1):
+        try:
+            if code not in station_ids:
+                raise RowError(f'unknown station {code!r}' if code else 'missing station')
+            try:
+                distance = Decimal(str(row.get('distance_from_origin') or '0').strip())
+            except InvalidOperation:
+                raise RowError(f'bad distance {row.get("distance_from_origin")!r}')
+
+            arrival_text = str(row.get('arrival_time') or '').strip()
+            departure_text = str(row.get('departure_time') or '').strip() or arrival_text
+            if not departure_text:
+                raise RowError('missing departure time')
+            arrival = parse_clock(arrival_text)[0] if arrival_text else None
+            departure = parse_clock(departure_text)[0]
+            try:
+                day_offset = int(row.get('day_offset') or 0)
+            except (TypeError, ValueError):
+                raise RowError(f'bad day offset {row.get("day_offset")!r}')
+
+            if distance < 0 or (stops and distance < stops[-1].distance_from_origin):
+                raise RowError(f'distance {distance} is less than at the stop before')
+            if stops and station_ids[code] == stops[-1].station_id:
+                raise RowError(f'{code} repeats the stop before')
+        except RowError as e:
+            errors.append(f'Stop {number}: {e}')
+            continue
+
+        stops.append(Route(
+            station_id=station_ids[code],
+            sequence_order=len(stops) + 1,
+            arrival_time=arrival,
+            departure_time=departure,
+            distance_from_origin=distance,
+            day_offset=day_offset,
+        ))
+
+    if not errors and len(stops) < 2:
+        errors.append('A route needs at least two stops')
+    if errors:
+        raise RouteEditError(errors)
+    return stops
+
+
+def _stop_values(route):
+    return tuple(getattr(route, Route._meta.get_field(name).attname) for name in STOP_FIELDS)
+
+
+@transaction.atomic
+def apply_stops(train, stops):
+    """Make the train's route exactly the given stops - one diff, one transaction
+
+    A stop at a station the route already serves keeps its row, so only
+    inserted and removed stations create or delete rows. Rows whose sequence
+    moves go through negative numbers first, so (train, sequence_order) stays
+    unique at every step. Sold and held seats move to the renumbered legs in
+    the same transaction. The route index and caches are refreshed once.
+    Returns {'created': n, 'updated': n, 'deleted': n}.
+    """
+    existing = {}
+    old_values = {}
+    old_stops = []
+    for route in Route.objects.select_for_update().filter(train=train).order_by('sequence_order'):
+        existing.setdefault(route.station_id, []).append(route)
+        old_values[route.pk] = _stop_values(route)
+        old_stops.append((route.sequence_order, route.distance_from_origin))
+    old_station_ids = list(existing)
+
+    new, changed = [], []
+    for stop in stops:
+        stop.train_id = train.id
+        matches = existing.get(stop.station_id)
+        if matches:
+            stop.pk = matches.pop(0).pk
+            if _stop_values(stop) != old_values[stop.pk]:
+                changed.append(stop)
+        else:
+            new.append(stop)
+    stale = [route.pk for routes in existing.values() for route in routes]
+
+    sequence = STOP_FIELDS.index('sequence_order')
+    moving = [stop.pk for stop in changed if stop.sequence_order != old_values[stop.pk][sequence]]
+    with batched_route_changes():
+        Route.objects.filter(pk__in=stale).delete()
+        Route.objects.bulk_update(
+            [Route(pk=pk, sequence_order=-parked) for parked, pk in enumerate(moving, start=1)], ['sequence_order']
+        )
+        Route.objects.bulk_update(changed, STOP_FIELDS)
+        Route.objects.bulk_create(new)
+
+    if new or changed or stale:
+        # Seat legs are keyed by sequence_order - move sold and held seats with their stretch of track
+        move_seat_legs(train, old_stops, [(stop.sequence_order, stop.distance_from_origin) for stop in stops])
+        rebuild_route_index(train.id)
+        invalidate_route_graph()
+        invalidate_timetable()
+        invalidate_fare_matrix()
+        invalidate_train_searches(train.id, old_station_ids)
+    return {'created': len(new), 'updated': len(changed), 'deleted': len(stale)}
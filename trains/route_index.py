@@ -0,0 +1,73 @@
+from django.db import connection, transaction
+from .models import Route, RoutePair
+from .search import route_self_join
+
+
+def build_route_pairs(joined_routes):
+    """Turn rows of route_self_join() into RoutePair objects"""
+    return [
+        RoutePair(
+            train_id=route.train_id,
+            origin_station_id=route.station_id,
+            destination_station_id=route.dest_station_id,
+            origin_route_id=route.id,
+            destination_route_id=route.dest_route_id,
+            origin_sequence=route.sequence_order,
+            destination_sequence=route.dest_sequence,
+            distance=route.dest_distance - route.distance_from_origin,
+        )
+        for route in joined_routes
+    ]
+
+
+@transaction.atomic
+def rebuild_route_index(train_id):
+    """Rebuild the origin -> destination index for one train"""
+    RoutePair.objects.filter(train_id=train_id).delete()
+    pairs = build_route_pairs(route_self_join(train_id=train_id))
+    RoutePair.objects.bulk_create(pairs, batch_size=500)
+
+
+def _insert_route_pairs_sql(train_count):
+    """INSERT ... SELECT building the pairs of train_count trains inside the database"""
+    quote = connection.ops.quote_name
+    pair = RoutePair._meta
+    route = quote(Route._meta.db_table)
+    columns = ', '.join(quote(pair.get_field(name).column) for name in [
+        'train', 'origin_station', 'destination_station', 'origin_route', 'destination_route',
+        'origin_sequence', 'destination_sequence', 'distance',
+    ])
+    return (
+        f'INSERT INTO {quote(pair.db_table)} ({columns}) '
+        f'SELECT o.train_id, o.station_id, d.station_id, o.id, d.id, o.sequence_order, d.sequence_order, '
+        f'd.distance_from_origin - o.distance_from_origin '
+        f'FROM {route} o INNER JOIN {route} d ON d.train_id = o.train_id AND d.sequence_order > o.sequence_order '
+        f'WHERE o.train_id IN ({", ".join(["%s"] * train_count)})'
+    )
+
+
+@transaction.atomic
+def rebuild_route_indexes(train_ids, batch_size=500):
+    """Rebuild the index for many trains - for bulk imports
+
+    Pairs are built by an INSERT ... SELECT per batch of trains, so they never
+    pass through Python - the index of a national timetable is rebuilt in seconds.
+    """
+    train_ids = sorted(train_ids)
+    count = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(train_ids), batch_size):
+            batch = train_ids[start:start + batch_size]
+            RoutePair.objects.filter(train_id__in=batch).delete()
+            cursor.execute(_insert_route_pairs_sql(len(batch)), batch)
+            count += cursor.rowcount
+    return count
+
+
+@transaction.atomic
+def rebuild_all_route_indexes():
+    """Rebuild the whole origin -> destination index"""
+    RoutePair.objects.all().delete()
+    pairs = build_route_pairs(route_self_join().iterator(chunk_size=2000))
+    RoutePair.objects.bulk_create(pairs, batch_size=500)
+    return len(pairs)
@@ -0,0 +1,126 @@
+from datetime import date, timedelta
+from django.conf import settings
+from django.db.models import Q
+from .models import Route, TrainRun, TrainSchedule
+from .search_cache import invalidate_station_searches
+from .versions import new_version
+
+# Run statuses a ticket can be sold for
+BOOKABLE_STATUSES = ('running', 'delayed')
+
+RUN_BATCH_SIZE = 1000
+
+RUNS_VERSION_KEY = 'trains:runs_version'
+
+# Dates this process has seen runs for - ensure_runs checks each only once
+_ensured_dates = set()
+
+
+def horizon_dates(start=None, days=None):
+    """start (today by default) and each of the following days - settings.BOOKING_HORIZON_DAYS of them"""
+    start = start or date.today()
+    days = settings.BOOKING_HORIZON_DAYS if days is None else days
+    return [start + timedelta(days=n) for n in range(days + 1)]
+
+
+def ensure_runs(dates):
+    """Generate the runs of any of dates in the booking horizon that has none
+
+    Runs are made ahead by generate_train_runs (nightly) and by schedule
+    changes; a date that came into the horizon since the last run of the
+    command gets its runs here, the first time it is asked for. One indexed
+    query per date and process, none after.
+    """
+    horizon = horizon_dates()
+    dates = [day for day in set(dates) if horizon[0] <= day <= horizon[-1] and day not in _ensured_dates]
+    if not dates:
+        return
+    covered = set(TrainRun.objects.filter(journey_date__in=dates).values_list('journey_date', flat=True).distinct())
+    for day in sorted(set(dates) - covered):
+        generate_runs(start=day, days=0)
+    _ensured_dates.update(dates)
+
+
+def bookable_run(train, journey_date):
+    """The train's run on journey_date if tickets can be sold for it - one indexed lookup"""
+    ensure_runs([journey_date])
+    return TrainRun.objects.filter(
+        train=train, journey_date=journey_date, status__in=BOOKABLE_STATUSES
+    ).first()
+
+
+def bookable_trains(dates):
+    """Train ids with a bookable run on each of dates - one query on the (date, train) index"""
+    ensure_runs(dates)
+    trains = {day: set() for day in dates}
+    for train_id, journey_date in TrainRun.objects.filter(
+        journey_date__in=dates, status__in=BOOKABLE_STATUSES
+    ).values_list('train_id', 'journey_date'):
+        trains[journey_date].add(train_id)
+    return trains
+
+
+def invalidate_runs():
+    """Mark every process's per-date view of the runs (journey planner) as stale"""
+    new_version(RUNS_VERSION_KEY)
+
+
+def generate_runs(train_ids=None, start=None, days=None):
+    """Make the runs in the horizon match the schedules - safe to repeat
+
+    A date the schedule runs on (weekdays, exceptions, active status) gets a
+    run if it has none. A run the schedule no longer has is deleted while
+    untouched, and cancelled once an admin has delayed it. Cancellations and
+    delays set on a scheduled run are kept. train_ids limits the trains looked
+    at. Returns (created, removed).
+    """
+    dates = horizon_dates(start, days)
+    schedules = TrainSchedule.objects.all()
+    runs = TrainRun.objects.filter(journey_date__range=(dates[0], dates[-1]))
+    if train_ids is not None:
+        schedules = schedules.filter(train_id__in=train_ids)
+        runs = runs.filter(train_id__in=train_ids)
+
+    scheduled = set()
+    for day in dates:
+        scheduled.update((train_id, day) for train_id in schedules.running_on(day).values_list('train_id', flat=True))
+
+    existing = {}
+    for pk, train_id, journey_date, status, delay in runs.values_list(
+        'pk', 'train_id', 'journey_date', 'status', 'delay_minutes'
+    ).iterator():
+        existing[train_id, journey_date] = (pk, status, delay)
+
+    missing = sorted(scheduled - existing.keys())
+    # ignore_conflicts - a second generator running at the same time is not an error
+    TrainRun.objects.bulk_create(
+        [TrainRun(train_id=train_id, journey_date=day) for train_id, day in missing],
+        batch_size=RUN_BATCH_SIZE, ignore_conflicts=True,
+    )
+
+    dropped = {key: run for key, run in existing.items() if key not in scheduled}
+    untouched, touched = [], []
+    for pk, status, delay in dropped.values():
+        if status == 'running' and not delay:
+            untouched.append(pk)
+        elif status != 'cancelled':
+            touched.append(pk)
+    for start_at in range(0, len(untouched), RUN_BATCH_SIZE):
+        TrainRun.objects.filter(pk__in=untouched[start_at:start_at + RUN_BATCH_SIZE]).delete()
+    for start_at in range(0, len(touched), RUN_BATCH_SIZE):
+        TrainRun.objects.filter(pk__in=touched[start_at:start_at + RUN_BATCH_SIZE]).update(status='cancelled')
+
+    # Bulk writes skip the signals - searches from or to any station of these trains change
+    train_ids = sorted({train_id for train_id, day in missing} | {train_id for train_id, day in dropped})
+    if train_ids:
+        invalidate_runs()
+    for start_at in range(0, len(train_ids), RUN_BATCH_SIZE):
+        invalidate_station_searches(set(Route.objects.filter(
+            train_id__in=train_ids[start_at:start_at + RUN_BATCH_SIZE]
+        ).values_list('station_id', flat=True)))
+    return len(missing), len(untouched) + len(touched)
+
+
+def runs_on_q(journey_date, path=''):
+    """Condition for "has a bookable run on journey_date" - path leads to the train, e.g. 'train__'"""
+    return Q(**{f'{path}runs__journey_date': journey_date, f'{path}runs__status__in': BOOKABLE_STATUSES})
@@ -0,0 +1,68 @@
+from django.db.models import F
+from .fares import BASE_MULTIPLIER
+from .models import Route, RoutePair
+from .runs import ensure_runs, runs_on_q
+
+
+def route_self_join(**filters):
+    """Join each Route to every later Route of the same train - one query"""
+    return Route.objects.filter(
+        train__routes__sequence_order__gt=F('sequence_order'),
+        **filters
+    ).annotate(
+        dest_route_id=F('train__routes__id'),
+        dest_station_id=F('train__routes__station_id'),
+        dest_sequence=F('train__routes__sequence_order'),
+        dest_distance=F('train__routes__distance_from_origin'),
+    ).select_related('train').order_by()
+
+
+def _direct_pairs(origin, journey_date=None, seat_type='', **filters):
+    """RoutePair rows leaving origin, as result dicts - one query
+
+    With a journey_date only trains with a bookable run that day are returned,
+    joined on the run's (train, date) index. With a seat_type only trains that
+    sell that class, and the class's capacity and fare multiplier come from
+    the same join.
+    """
+    pairs = RoutePair.objects.filter(
+        origin_station=origin,
+        **filters
+    ).select_related('train', 'origin_route', 'destination_route')
+
+    if journey_date:
+        ensure_runs([journey_date])
+        pairs = pairs.filter(runs_on_q(journey_date, 'train__')).annotate(
+            delay_minutes=F('train__runs__delay_minutes'),
+        )
+    if seat_type:
+        pairs = pairs.filter(train__seat_classes__seat_class=seat_type).annotate(
+            class_capacity=F('train__seat_classes__coach_count') * F('train__seat_classes__seats_per_coach'),
+            fare_multiplier=F('train__seat_classes__fare_multiplier'),
+        )
+
+    return [
+        {
+            'train': pair.train,
+            'origin_route': pair.origin_route,
+            'dest_route': pair.destination_route,
+            'distance': pair.distance,
+            'capacity': getattr(pair, 'class_capacity', pair.train.total_seats),
+            'fare_multiplier': getattr(pair, 'fare_multiplier', BASE_MULTIPLIER),
+            'delay_minutes': getattr(pair, 'delay_minutes', 0),
+        }
+        for pair in pairs
+    ]
+
+
+def find_direct_trains(origin, destination, journey_date=None, seat_type=''):
+    """All (train, origin_route, dest_route) triples from origin to destination - one query"""
+    return _direct_pairs(origin, journey_date, seat_type, destination_station=destination)
+
+
+def find_direct_trains_to_any(origin, station_ids, journey_date=None, seat_type=''):
+    """Direct trains from origin to each of station_ids - one query, grouped by destination id"""
+    grouped = {station_id: [] for station_id in station_ids}
+    for item in _direct_pairs(origin, journey_date, seat_type, destination_station_id__in=station_ids):
+        grouped[item['dest_route'].station_id].append(item)
+    return grouped
@@ -0,0 +1,109 @@
+from bisect import bisect_left
+from django.core.cache import cache, caches
+from .models import Route
+from .versions import get_versions, set_versions
+
+# Cache alias holding search results - TTL and LRU size are set in settings.CACHES
+SEARCH_CACHE = 'search'
+
+HITS_KEY = 'trains:search_cache_hits'
+MISSES_KEY = 'trains:search_cache_misses'
+
+# Cached seat counts are refreshed when a booking moves them across one of these
+# - buckets are sold out, 1-10 left, more than 10 left
+SEAT_THRESHOLDS = (0, 10)
+
+# Station and seat tokens outlive every cached search by far, so an expired token
+# reading as INITIAL_VERSION again can never revive a stale entry. Keeps the
+# shared cache from growing a token per (train, date) forever.
+SEARCH_VERSION_TIMEOUT = 24 * 60 * 60
+INITIAL_VERSION = '0'
+
+
+def _station_key(station_id):
+    return f'trains:search_station:{station_id}'
+
+
+def _seats_key(train_id, journey_date):
+    return f'trains:search_seats:{train_id}:{journey_date.isoformat()}'
+
+
+def _versions(keys):
+    """Current version token of each key - at most one read of the shared version cache
+
+    A key never invalidated (or whose token expired) reads as INITIAL_VERSION
+    rather than getting a token written, so a search that misses adds no writes.
+    Tokens are shared, so a change made by one process drops the cached
+    searches of every process.
+    """
+    return get_versions(keys, INITIAL_VERSION)
+
+
+def _count(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr - the count restarts
+        cache.add(key, 1, None)
+
+
+def get_search_results(origin_id, destination_id, journey_date, seat_class, compute):
+    """Direct search results from the cache - compute() builds them on a miss
+
+    An entry is keyed by (origin, destination, date, class) plus the version of
+    both stations, so any change to a train serving either station misses. It
+    also records the seat version of each train it lists and is dropped when a
+    booking moves one across a threshold.
+    """
+    search_cache = caches[SEARCH_CACHE]
+    stations = _versions([_station_key(origin_id), _station_key(destination_id)])
+    key = 'trains:search:{}:{}:{}:{}:{}:{}'.format(
+        origin_id, destination_id, journey_date.isoformat(), seat_class,
+        stations[_station_key(origin_id)], stations[_station_key(destination_id)],
+    )
+
+    entry = search_cache.get(key)
+    if entry is not None and (not entry['seats'] or _versions(list(entry['seats'])) == entry['seats']):
+        _count(HITS_KEY)
+        return entry['results']
+
+    _count(MISSES_KEY)
+    results = compute()
+    seats = _versions([_seats_key(item['train'].id, journey_date) for item in results])
+    search_cache.set(key, {'results': results, 'seats': seats})
+    return results
+
+
+def invalidate_station_searches(station_ids):
+    """Drop cached searches to or from any of the stations"""
+    set_versions([_station_key(station_id) for station_id in station_ids], SEARCH_VERSION_TIMEOUT)
+
+
+def invalidate_train_searches(train_id, station_ids=()):
+    """Drop cached searches to or from any station the train stops at"""
+    station_ids = set(station_ids) | set(Route.objects.filter(train_id=train_id).values_list('station_id', flat=True))
+    invalidate_station_searches(station_ids)
+
+
+def invalidate_seat_searches(train_id, journey_date):
+    """Drop cached searches listing this train on this date"""
+    set_versions([_seats_key(train_id, journey_date)], SEARCH_VERSION_TIMEOUT)
+
+
+def seats_changed(train_id, journey_date, before, after):
+    """A booking changed a seat count - only a threshold crossing drops cached searches"""
+    if bisect_left(SEAT_THRESHOLDS, before) != bisect_left(SEAT_THRESHOLDS, after):
+        invalidate_seat_searches(train_id, journey_date)
+
+
+def search_cache_stats():
+    """Hit and miss counters of this process"""
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(100 * hits / lookups, 1) if lookups else 0,
+    }
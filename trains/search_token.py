@@ -0,0 +1,31 @@
+from django.core import signing
+
+SEARCH_TOKEN_SALT = 'trains.search'
+
+# A search link keeps working for a day
+SEARCH_TOKEN_MAX_AGE = 24 * 60 * 60
+
+
+def make_search_token(origin_code, destination_code, journey_date_str, seat_type=''):
+    """Signed, URL-safe search context - carried in links instead of the session"""
+    return signing.dumps([origin_code, destination_code, journey_date_str, seat_type], salt=SEARCH_TOKEN_SALT)
+
+
+def read_search_token(request):
+    """Search context from ?search= or a posted search field - Returns a dict or None"""
+    token = request.GET.get('search') or request.POST.get('search')
+    if not token:
+        return None
+    try:
+        origin_code, destination_code, journey_date_str, seat_type = signing.loads(
+            token, salt=SEARCH_TOKEN_SALT, max_age=SEARCH_TOKEN_MAX_AGE
+        )
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    return {
+        'token': token,
+        'origin': origin_code,
+        'destination': destination_code,
+        'journey_date': journey_date_str,
+        'seat_type': seat_type,
+    }
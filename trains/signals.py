@@ -0,0 +1,113 @@
+import threading
+from contextlib import contextmanager
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Station, Train, TrainClass, Route, TrainSchedule, ScheduleException, TrainRun
+from .models import parse_classes, sync_seat_classes
+from .fares import invalidate_fare_matrix
+from .graph import invalidate_route_graph
+from .planner import invalidate_timetable
+from .route_index import rebuild_route_index
+from .runs import generate_runs, invalidate_runs
+from .search_cache import invalidate_train_searches
+from .stations import invalidate_station_catalogue
+
+_route_batch = threading.local()
+
+
+def _batching():
+    return getattr(_route_batch, 'depth', 0) > 0
+
+
+@contextmanager
+def batched_route_changes():
+    """Skip the per-row Route receivers - the caller refreshes index and caches once when done
+
+    Batches nest: the receivers stay off until the outermost one ends.
+    """
+    _route_batch.depth = getattr(_route_batch, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _route_batch.depth -= 1
+
+
+@receiver(post_save, sender=Station)
+@receiver(post_delete, sender=Station)
+def station_changed(sender, instance, **kwargs):
+    """Home page suggestions come from the cached station catalogue"""
+    invalidate_station_catalogue()
+
+
+@receiver(pre_save, sender=Route)
+def route_moving(sender, instance, **kwargs):
+    """A stop moved to another station - searches involving the old one change too"""
+    if instance.pk and not _batching():
+        old_station_id = Route.objects.filter(pk=instance.pk).values_list('station_id', flat=True).first()
+        if old_station_id and old_station_id != instance.station_id:
+            invalidate_train_searches(instance.train_id, [old_station_id])
+
+
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+def route_changed(sender, instance, **kwargs):
+    """Keep the origin -> destination index in sync with Route rows"""
+    if _batching():
+        return
+    rebuild_route_index(instance.train_id)
+    invalidate_route_graph()
+    invalidate_timetable()
+    invalidate_fare_matrix()
+    invalidate_train_searches(instance.train_id, [instance.station_id])
+
+
+@receiver(post_save, sender=Train)
+def train_saved(sender, instance, raw=False, **kwargs):
+    """Classes typed into classes_available get TrainClass rows"""
+    if not raw:
+        sync_seat_classes(instance, parse_classes(instance.classes_available))
+
+
+@receiver(post_save, sender=Train)
+@receiver(post_delete, sender=Train)
+def train_changed(sender, instance, **kwargs):
+    """Seat classes decide which fares the matrix holds"""
+    invalidate_fare_matrix()
+    invalidate_train_searches(instance.id)
+
+
+@receiver(post_save, sender=TrainClass)
+@receiver(post_delete, sender=TrainClass)
+def train_class_changed(sender, instance, **kwargs):
+    """Keep classes_available in step with TrainClass rows - capacity and fares change too"""
+    names = TrainClass.objects.filter(train_id=instance.train_id).values_list('seat_class', flat=True)
+    Train.objects.filter(pk=instance.train_id).update(classes_available=','.join(names))
+    invalidate_fare_matrix()
+    invalidate_train_searches(instance.train_id)
+
+
+@receiver(post_save, sender=TrainSchedule)
+@receiver(post_delete, sender=TrainSchedule)
+def schedule_changed(sender, instance, raw=False, **kwargs):
+    """Running days decide the train's runs - search and the journey planner follow those"""
+    invalidate_train_searches(instance.train_id)
+    if not raw:
+        generate_runs([instance.train_id])
+
+
+@receiver(post_save, sender=ScheduleException)
+@receiver(post_delete, sender=ScheduleException)
+def schedule_exception_changed(sender, instance, **kwargs):
+    """Holidays and suspensions change which dates a train runs on"""
+    train_id = TrainSchedule.objects.filter(pk=instance.schedule_id).values_list('train_id', flat=True).first()
+    if train_id:
+        invalidate_train_searches(train_id)
+        generate_runs([train_id])
+
+
+@receiver(post_save, sender=TrainRun)
+@receiver(post_delete, sender=TrainRun)
+def run_changed(sender, instance, **kwargs):
+    """Search and the journey planner list only bookable runs, with their delay"""
+    invalidate_runs()
+    invalidate_train_searches(instance.train_id)
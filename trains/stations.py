@@ -0,0 +1,93 @@
+import difflib
+from bisect import bisect_left
+from .models import Station
+from .versions import current_version, new_version
+
+STATIONS_VERSION_KEY = 'trains:stations_version'
+
+# Suggestions returned per autocomplete request
+AUTOCOMPLETE_LIMIT = 10
+
+_catalogue = None
+_catalogue_version = None
+
+
+class StationCatalogue:
+    """Every station in memory - Sorted array of search terms for prefix lookups
+
+    Terms are the lower-cased code, full name, city and each word of the name,
+    so a prefix of any of them finds the station.
+    """
+
+    def __init__(self, stations):
+        self.stations = [
+            {'code': code, 'name': name, 'city': city}
+            for code, name, city in stations
+        ]
+        self.by_code = {station['code']: station for station in self.stations}
+
+        terms = set()
+        for index, station in enumerate(self.stations):
+            words = [station['code'], station['name'], station['city']] + station['name'].split()
+            for word in words:
+                if word:
+                    terms.add((word.lower(), index))
+        self.terms = sorted(terms)
+        self.words = sorted({term for term, index in self.terms})
+
+    def _prefix_matches(self, query):
+        start = bisect_left(self.terms, (query,))
+        for term, index in self.terms[start:]:
+            if not term.startswith(query):
+                break
+            yield term, index
+
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """Stations matching a prefix, best first - close spellings when no prefix matches"""
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        # Exact code, then name prefix, then any other term prefix - alphabetical within each
+        ranked = {}
+        for term, index in self._prefix_matches(query):
+            station = self.stations[index]
+            if station['code'].lower() == query:
+                rank = 0
+            elif station['name'].lower().startswith(query):
+                rank = 1
+            else:
+                rank = 2
+            ranked[index] = min(rank, ranked.get(index, rank))
+
+        if not ranked:
+            for word in difflib.get_close_matches(query, self.words, n=limit, cutoff=0.7):
+                for term, index in self._prefix_matches(word):
+                    if term == word:
+                        ranked.setdefault(index, 3)
+
+        best = sorted(ranked, key=lambda index: (ranked[index], index))[:limit]
+        return [self.stations[index] for index in best]
+
+
+def build_station_catalogue():
+    """Load every station, ordered by name - one query"""
+    return StationCatalogue(
+        Station.objects.order_by('station_name').values_list('station_code', 'station_name', 'city')
+    )
+
+
+def get_station_catalogue():
+    """Process-wide station catalogue, rebuilt after a Station changes"""
+    global _catalogue, _catalogue_version
+
+    version = current_version(STATIONS_VERSION_KEY)
+    if _catalogue is None or _catalogue_version != version:
+        _catalogue = build_station_catalogue()
+        _catalogue_version = version
+    return _catalogue
+
+
+def invalidate_station_catalogue():
+    """Mark every process's station catalogue as stale"""
+    new_version(STATIONS_VERSION_KEY)
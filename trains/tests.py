@@ -1,3 +1,929 @@
-from django.test import TestCase
+import json
+import re
+import tempfile
+from io import StringIO
+from time import monotonic
+from unittest import mock
+from pathlib import Path
+from datetime import date, time, timedelta
+from decimal import Decimal
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from accounts.models import User
+from .models import Train, TrainClass, Station, Route, RoutePair, TrainSchedule, ScheduleException, TrainRun
+from .models import parse_classes, running_days_mask, sync_seat_classes
+from .fares import compute_fare, distance_fare, get_fare_matrix
+from .graph import get_route_graph
+from .planner import get_timetable
+from .search import find_direct_trains, route_self_join
+from .search_cache import SEARCH_CACHE, search_cache_stats
+from .stations import get_station_catalogue
+from .route_index import rebuild_route_index
+from .signals import batched_route_changes
+from . import runs
+from .runs import bookable_run, generate_runs, horizon_dates
+from .timetable_import import TimetableImporter
+
+
+def make_train(number, stations, classes='AC,Non-AC', off_days=''):
+    """Create a train that stops at the given stations, 100 km apart, with a schedule"""
+    train = Train.objects.create(
+        train_number=number,
+        train_name=f'Train {number}',
+        classes_available=classes,
+    )
+    TrainSchedule.objects.create(train=train, departure_time=time(7, 0), arrival_time=time(6 + len(stations), 0),
+                                 off_days=off_days)
+    for seq, station in enumerate(stations, start=1):
+        Route.objects.create(
+            train=train,
+            station=station,
+            sequence_order=seq,
+            departure_time=time(6 + seq, 0),
+            distance_from_origin=(seq - 1) * 100,
+        )
+    return train
+
+
+class QueryPlanMixin:
+    """Run EXPLAIN QUERY PLAN (SQLite) on every query a view issued"""
+
+    # Session and auth lookups are Django's, not ours
+    IGNORED_TABLES = ('django_session', 'accounts_user')
+
+    def capture(self, method, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = method(*args, **kwargs)
+        return response, [query['sql'] for query in queries]
+
+    def assertNoFullScans(self, statements):
+        checked = 0
+        for sql in statements:
+            if not re.match(r'\s*(SELECT|UPDATE|DELETE)', sql) or any(t in sql for t in self.IGNORED_TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [step for step in plan if step.startswith('SCAN')]
+            self.assertEqual(scans, [], f'Full scan in:\n{sql}\nPlan: {plan}')
+            checked += 1
+        self.assertGreater(checked, 0)
+
+
+class SearchEngineTests(TestCase):
+
+    def setUp(self):
+        self.dhaka = Station.objects.create(station_code='DHK', station_name='Dhaka', city='Dhaka')
+        self.tangail = Station.objects.create(station_code='TGL', station_name='Tangail', city='Tangail')
+        self.rajshahi = Station.objects.create(station_code='RJH', station_name='Rajshahi', city='Rajshahi')
+
+    def test_route_index_follows_route_changes(self):
+        train = make_train('701', [self.dhaka, self.tangail, self.rajshahi])
+        self.assertEqual(RoutePair.objects.filter(train=train).count(), 3)
+        self.assertEqual(route_self_join(train=train).count(), 3)
+
+        Route.objects.get(train=train, station=self.rajshahi).delete()
+        self.assertEqual(RoutePair.objects.filter(train=train).count(), 1)
+
+    def test_find_direct_trains_respects_direction(self):
+        make_train('701', [self.dhaka, self.tangail, self.rajshahi])
+
+        results = find_direct_trains(self.dhaka, self.rajshahi)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['distance'], 200)
+        self.assertEqual(results[0]['origin_route'].station, self.dhaka)
+        self.assertEqual(results[0]['dest_route'].station, self.rajshahi)
+
+        self.assertEqual(find_direct_trains(self.rajshahi, self.dhaka), [])
+
+    def test_find_direct_trains_query_count_is_constant(self):
+        make_train('701', [self.dhaka, self.tangail, self.rajshahi])
+        with self.assertNumQueries(1):
+            find_direct_trains(self.dhaka, self.rajshahi)
+
+        for number in range(702, 720):
+            make_train(str(number), [self.dhaka, self.tangail, self.rajshahi])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(find_direct_trains(self.dhaka, self.rajshahi)), 19)
+
+    def test_search_view_query_count_is_constant(self):
+        data = {
+            'origin': 'DHK',
+            'destination': 'RJH',
+            'journey_date': (date.today() + timedelta(days=1)).isoformat(),
+        }
+        make_train('701', [self.dhaka, self.tangail, self.rajshahi])
+        with CaptureQueriesContext(connection) as few_trains:
+            self.client.post(reverse('trains:search'), data)
+
+        for number in range(702, 720):
+            make_train(str(number), [self.dhaka, self.tangail, self.rajshahi])
+        with CaptureQueriesContext(connection) as many_trains:
+            response = self.client.post(reverse('trains:search'), data)
+
+        self.assertEqual(len(response.context['trains']), 19)
+        self.assertEqual(len(few_trains), len(many_trains))
+
+    def test_search_shows_only_bookable_trains(self):
+        from bookings.inventory import reserve_seat
+
+        journey_date = date.today() + timedelta(days=1)
+        stops = [self.dhaka, self.tangail, self.rajshahi]
+        make_train('701', stops)
+        make_train('702', stops, off_days=journey_date.strftime('%A'))
+        make_train('703', stops).schedule.exceptions.create(start_date=journey_date, end_date=journey_date)
+        make_train('704', stops, classes='Non-AC')
+        sold_out = make_train('705', stops)
+        sold_out.seat_classes.filter(seat_class='AC').update(coach_count=1, seats_per_coach=1)
+        reserve_seat(sold_out, journey_date, 'AC', 1, 3)
+
+        response = self.client.post(reverse('trains:search'), {
+            'origin': 'DHK',
+            'destination': 'RJH',
+            'journey_date': journey_date.isoformat(),
+            'seat_type': 'AC',
+        })
+        self.assertEqual([item['train'].train_number for item in response.context['trains']], ['701'])
+
+    def test_nearby_stations_ranked_by_extra_km(self):
+        bogura = Station.objects.create(station_code='BGR', station_name='Bogura', city='Bogura')
+        make_train('701', [self.dhaka, self.tangail, self.rajshahi])
+        make_train('702', [self.tangail, bogura])
+
+        nearby = get_route_graph().nearby_stations(self.rajshahi.id, max_km=250)
+        self.assertEqual(nearby, [(self.tangail.id, 100.0), (self.dhaka.id, 200.0), (bogura.id, 200.0)])
+
+
+class JourneyPlannerTests(TestCase):
+
+    def setUp(self):
+        self.dhaka = Station.objects.create(station_code='DHK', station_name='Dhaka', city='Dhaka')
+        self.tangail = Station.objects.create(station_code='TGL', station_name='Tangail', city='Tangail')
+        self.rajshahi = Station.objects.create(station_code='RJH', station_name='Rajshahi', city='Rajshahi')
+        self.journey_date = date.today() + timedelta(days=1)
+
+        self.feeder = self.make_run('801', [(self.dhaka, None, time(7, 0)), (self.tangail, time(8, 0), time(8, 5))])
+
+    def make_run(self, number, stops, off_days=''):
+        train = Train.objects.create(train_number=number, train_name=f'Train {number}', classes_available='AC')
+        TrainSchedule.objects.create(train=train, departure_time=stops[0][2], arrival_time=stops[-1][1],
+                                     off_days=off_days)
+        for seq, (station, arrival, departure) in enumerate(stops, start=1):
+            Route.objects.create(train=train, station=station, sequence_order=seq,
+                                 arrival_time=arrival, departure_time=departure,
+                                 distance_from_origin=(seq - 1) * 100)
+        return train
+
+    def test_one_change_respects_minimum_connection_time(self):
+        self.make_run('802', [(self.tangail, None, time(8, 10)), (self.rajshahi, time(9, 0), time(9, 0))])
+        onward = self.make_run('803', [(self.tangail, None, time(8, 30)), (self.rajshahi, time(10, 0), time(10, 0))])
+
+        journeys = get_timetable().plan(self.dhaka.id, self.rajshahi.id, self.journey_date)
+        self.assertEqual(len(journeys), 1)
+        legs = journeys[0]
+        self.assertEqual([leg['train_id'] for leg in legs], [self.feeder.id, onward.id])
+        self.assertEqual(legs[-1]['arrival'], 10 * 60)
+
+    def test_overnight_connection_uses_day_offset(self):
+        onward = self.make_run('804', [(self.tangail, None, time(6, 0)), (self.rajshahi, time(7, 0), time(7, 0))])
+
+        legs = get_timetable().plan(self.dhaka.id, self.rajshahi.id, self.journey_date)[0]
+        self.assertEqual([leg['train_id'] for leg in legs], [self.feeder.id, onward.id])
+        self.assertEqual(legs[-1]['arrival'], 24 * 60 + 7 * 60)
+
+    def test_train_not_running_is_skipped(self):
+        self.make_run('805', [(self.tangail, None, time(9, 0)), (self.rajshahi, time(10, 0), time(10, 0))],
+                      off_days=self.journey_date.strftime('%A'))
+
+        legs = get_timetable().plan(self.dhaka.id, self.rajshahi.id, self.journey_date)[0]
+        self.assertEqual(legs[-1]['arrival'], 24 * 60 + 10 * 60)
+
+    def test_cancelled_run_is_skipped(self):
+        onward = self.make_run('806', [(self.tangail, None, time(9, 0)), (self.rajshahi, time(10, 0), time(10, 0))])
+        legs = get_timetable().plan(self.dhaka.id, self.rajshahi.id, self.journey_date)[0]
+        self.assertEqual(legs[-1]['arrival'], 10 * 60)
+
+        # Cancelled after the scan order for the date was cached
+        run = onward.runs.get(journey_date=self.journey_date)
+        run.status = 'cancelled'
+        run.save()
+        legs = get_timetable().plan(self.dhaka.id, self.rajshahi.id, self.journey_date)[0]
+        self.assertEqual([leg['train_id'] for leg in legs], [self.feeder.id, onward.id])
+        self.assertEqual(legs[-1]['arrival'], 24 * 60 + 10 * 60)
+
+
+class RunningDayTests(TestCase):
+
+    def setUp(self):
+        stations = [
+            Station.objects.create(station_code=code, station_name=code, city=code)
+            for code in ['DHK', 'RJH']
+        ]
+        self.schedules = {}
+        for number, off_days in [('701', 'Friday'), ('702', ' sunday ,Friday'), ('703', '')]:
+            self.schedules[number] = make_train(number, stations, off_days=off_days).schedule
+        # 2026-10-16 is a Friday, 2026-10-18 a Sunday
+        self.friday = date(2026, 10, 16)
+        self.sunday = date(2026, 10, 18)
+
+    def running(self, day):
+        return sorted(TrainSchedule.objects.running_on(day).values_list('train__train_number', flat=True))
+
+    def test_off_days_compile_to_mask(self):
+        self.assertEqual(running_days_mask('Friday'), 0b1101111)
+        self.assertEqual(self.schedules['702'].running_days, 0b0101111)
+        self.assertFalse(self.schedules['702'].is_running_on_date(self.sunday))
+        self.assertTrue(self.schedules['701'].is_running_on_date(self.sunday))
+
+    def test_running_on_matches_is_running_on_date(self):
+        ScheduleException.objects.create(schedule=self.schedules['703'], start_date=self.sunday,
+                                         end_date=self.sunday + timedelta(days=2), reason='Eid')
+        ScheduleException.objects.create(schedule=self.schedules['701'], start_date=self.friday,
+                                         end_date=self.friday, is_running=True, reason='Eid special')
+        TrainSchedule.objects.filter(pk=self.schedules['702'].pk).update(status='suspended')
+
+        self.assertEqual(self.running(self.friday), ['701', '703'])
+        self.assertEqual(self.running(self.sunday), ['701'])
+        for schedule in TrainSchedule.objects.prefetch_related('exceptions'):
+            for day in (self.friday, self.sunday):
+                self.assertEqual(
+                    schedule.train.train_number in self.running(day),
+                    schedule.status == 'active' and schedule.is_running_on_date(day),
+                )
+
+
+class TrainRunTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.stations = [
+            Station.objects.create(station_code=code, station_name=code, city=code)
+            for code in ['DHK', 'RJH']
+        ]
+        self.journey_date = date.today() + timedelta(days=1)
+        # Off the day after the journey date
+        self.off_day = self.journey_date + timedelta(days=1)
+        self.train = make_train('701', self.stations, off_days=self.off_day.strftime('%A'))
+
+    def run_dates(self):
+        return list(self.train.runs.values_list('journey_date', flat=True))
+
+    def search(self):
+        return find_direct_trains(self.stations[0], self.stations[1], self.journey_date)
+
+    def test_schedule_gets_a_run_per_running_day_in_the_horizon(self):
+        dates = horizon_dates()
+        self.assertEqual(len(dates), settings.BOOKING_HORIZON_DAYS + 1)
+        self.assertEqual(self.run_dates(), [day for day in dates if day.weekday() != self.off_day.weekday()])
+
+        # Repeating changes nothing
+        self.assertEqual(generate_runs(), (0, 0))
+        out = StringIO()
+        call_command('generate_train_runs', stdout=out)
+        self.assertIn('0 created, 0 removed', out.getvalue())
+
+    @override_settings(BOOKING_HORIZON_DAYS=3)
+    def test_horizon_comes_from_settings(self):
+        self.train.runs.all().delete()
+        generate_runs()
+        self.assertEqual(self.run_dates(), [day for day in horizon_dates() if day != self.off_day])
+        self.assertEqual(len(horizon_dates()), 4)
+
+    def test_a_date_without_runs_gets_them_when_asked_for(self):
+        # As if generate_train_runs had last run before journey_date came into the horizon
+        self.train.runs.filter(journey_date=self.journey_date).delete()
+        runs._ensured_dates.clear()
+
+        self.assertEqual([item['train'] for item in self.search()], [self.train])
+        self.assertEqual(bookable_run(self.train, self.journey_date).journey_date, self.journey_date)
+
+        # Past the horizon nothing is made up
+        later = date.today() + timedelta(days=settings.BOOKING_HORIZON_DAYS + 7)
+        self.assertIsNone(bookable_run(self.train, later))
+
+    def test_cancelled_and_delayed_runs_reach_search_and_booking(self):
+        run = self.train.runs.get(journey_date=self.journey_date)
+        self.assertEqual(self.search()[0]['delay_minutes'], 0)
+
+        run.status, run.delay_minutes = 'delayed', 25
+        run.save()
+        self.assertEqual(self.search()[0]['delay_minutes'], 25)
+        self.assertEqual(bookable_run(self.train, self.journey_date), run)
+
+        run.status = 'cancelled'
+        run.save()
+        self.assertEqual(self.search(), [])
+        self.assertIsNone(bookable_run(self.train, self.journey_date))
+
+        # A cancelled run stays cancelled however often the generator runs
+        generate_runs()
+        self.assertEqual(self.train.runs.get(journey_date=self.journey_date).status, 'cancelled')
+
+    def test_schedule_changes_follow_through_to_runs(self):
+        self.train.runs.filter(journey_date=self.journey_date + timedelta(days=2)).update(delay_minutes=10)
+        ScheduleException.objects.create(schedule=self.train.schedule, start_date=self.journey_date,
+                                         end_date=self.journey_date + timedelta(days=2), reason='Eid')
+        runs = dict(self.train.runs.values_list('journey_date', 'status'))
+        # Untouched runs go, a run an admin delayed is cancelled
+        self.assertNotIn(self.journey_date, runs)
+        self.assertEqual(runs[self.journey_date + timedelta(days=2)], 'cancelled')
+
+        ScheduleException.objects.create(schedule=self.train.schedule, start_date=self.off_day,
+                                         end_date=self.off_day, is_running=True, reason='Special')
+        # The Eid cancellation covers the special too
+        self.assertNotIn(self.off_day, self.run_dates())
+        self.train.schedule.exceptions.filter(reason='Eid').delete()
+        self.assertIn(self.journey_date, self.run_dates())
+        self.assertIn(self.off_day, self.run_dates())
+
+        self.train.schedule.status = 'suspended'
+        self.train.schedule.save()
+        self.assertEqual(list(self.train.runs.exclude(status='cancelled')), [])
+
+
+class TrainClassTests(TestCase):
+
+    def setUp(self):
+        self.stations = [
+            Station.objects.create(station_code=code, station_name=code, city=code)
+            for code in ['DHK', 'RJH']
+        ]
+        self.train = make_train('701', self.stations, classes=' Non-AC , AC ')
+
+    def test_classes_available_creates_class_rows(self):
+        self.assertEqual(
+            list(self.train.seat_classes.values_list('seat_class', 'coach_count', 'seats_per_coach')),
+            [('AC', 5, 10), ('Non-AC', 5, 10)],
+        )
+        self.train.classes_available = 'AC,Sleeper'
+        self.train.save()
+        self.assertEqual(list(self.train.seat_classes.values_list('seat_class', flat=True)), ['AC', 'Sleeper'])
+
+    def test_repeated_class_names_make_one_row(self):
+        self.assertEqual(parse_classes('AC, Sleeper,AC'), ['AC', 'Sleeper'])
+        self.train.classes_available = 'AC,AC'
+        self.train.save()
+        self.assertEqual(list(self.train.seat_classes.values_list('seat_class', flat=True)), ['AC'])
+        sync_seat_classes(self.train, ['Sleeper', 'Sleeper'])
+        self.assertEqual(list(self.train.seat_classes.values_list('seat_class', flat=True)), ['Sleeper'])
+
+    def test_class_rows_drive_capacity_and_fare(self):
+        from bookings.inventory import seat_capacity
+
+        ac = self.train.seat_classes.get(seat_class='AC')
+        ac.coach_count = 2
+        ac.fare_multiplier = Decimal('1.50')
+        ac.save()
+        self.train.seat_classes.get(seat_class='Non-AC').delete()
+        self.train.refresh_from_db()
+
+        self.assertEqual(self.train.classes_available, 'AC')
+        self.assertEqual(seat_capacity(self.train, 'AC'), 20)
+        self.assertEqual(seat_capacity(self.train, 'Non-AC'), 0)
+        fare = get_fare_matrix().fare(self.train.id, self.stations[0].id, self.stations[1].id, 'AC')
+        self.assertEqual(fare.base_fare, Decimal('300.00'))
+
+        results = find_direct_trains(self.stations[0], self.stations[1], seat_type='AC')
+        self.assertEqual((results[0]['capacity'], results[0]['fare_multiplier']), (20, Decimal('1.50')))
+        self.assertEqual(find_direct_trains(self.stations[0], self.stations[1], seat_type='Non-AC'), [])
+
+
+class FareEngineTests(TestCase):
+
+    def setUp(self):
+        self.stations = [
+            Station.objects.create(station_code=code, station_name=code, city=code)
+            for code in ['DHK', 'TGL', 'RJH']
+        ]
+        self.train = make_train('701', self.stations)
+
+    def test_fare_is_exact_decimal(self):
+        fare = compute_fare(Decimal('100.10'))
+        self.assertEqual(fare.base_fare, Decimal('200.20'))
+        self.assertEqual(fare.tax, Decimal('12.51'))
+        self.assertEqual(fare.total_fare, Decimal('262.71'))
+
+    def test_distance_bands_taper(self):
+        bands = [(100, Decimal('2.00')), (300, Decimal('1.50')), (None, Decimal('1.00'))]
+        self.assertEqual(distance_fare(Decimal(50), bands), Decimal('100.00'))
+        self.assertEqual(distance_fare(Decimal(200), bands), Decimal('350.00'))
+        self.assertEqual(distance_fare(Decimal(400), bands), Decimal('600.00'))
+
+    def test_matrix_follows_route_distance(self):
+        dhaka, tangail, rajshahi = self.stations
+        fare = get_fare_matrix().fare(self.train.id, dhaka.id, rajshahi.id, 'AC')
+        self.assertEqual(fare.total_fare, Decimal('472.50'))
+
+        Route.objects.filter(train=self.train, station=rajshahi).update(distance_from_origin=300)
+        Route.objects.get(train=self.train, station=rajshahi).save()
+        fare = get_fare_matrix().fare(self.train.id, dhaka.id, rajshahi.id, 'AC')
+        self.assertEqual(fare.total_fare, Decimal('682.50'))
+
+    def test_search_reads_fares_from_matrix(self):
+        dhaka, tangail, rajshahi = self.stations
+        response = self.client.post(reverse('trains:search'), {
+            'origin': 'DHK',
+            'destination': 'RJH',
+            'journey_date': (date.today() + timedelta(days=1)).isoformat(),
+        })
+        item = response.context['trains'][0]
+        self.assertEqual(item['seat_class'], 'AC')
+        self.assertEqual(item['total_fare'], get_fare_matrix().fare(self.train.id, dhaka.id, rajshahi.id, 'AC').total_fare)
+
+    def test_search_quotes_the_class_booking_charges(self):
+        from bookings.inventory import reserve_seat
+
+        dhaka, tangail, rajshahi = self.stations
+        journey_date = date.today() + timedelta(days=1)
+        self.train.seat_classes.filter(seat_class='AC').update(fare_multiplier=Decimal('1.50'))
+        self.train.seat_classes.filter(seat_class='Non-AC').update(coach_count=1, seats_per_coach=1)
+        reserve_seat(self.train, journey_date, 'Non-AC', 1, 3)
+
+        response = self.client.post(reverse('trains:search'), {
+            'origin': 'DHK', 'destination': 'RJH', 'journey_date': journey_date.isoformat(),
+        })
+        # Non-AC is cheaper but sold out - booking sells AC, so the search quotes AC
+        item = response.context['trains'][0]
+        ac_fare = get_fare_matrix().fare(self.train.id, dhaka.id, rajshahi.id, 'AC')
+        self.assertEqual((item['seat_class'], item['total_fare']), ('AC', ac_fare.total_fare))
+        self.assertContains(response, 'seat_class=AC')
+
+        self.client.force_login(User.objects.create_user(username='rahim', password='secret'))
+        response = self.client.get(reverse('bookings:new_booking', args=[self.train.id]), {
+            'search': response.context['search_token'], 'seat_class': item['seat_class'],
+        })
+        self.assertEqual((response.context['seat_class'], response.context['total_fare']), ('AC', item['total_fare']))
+
+
+class SearchCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches[SEARCH_CACHE].clear()
+        self.stations = [
+            Station.objects.create(station_code=code, station_name=code, city=code)
+            for code in ['DHK', 'TGL', 'RJH']
+        ]
+        self.train = make_train('701', self.stations)
+        self.journey_date = date.today() + timedelta(days=1)
+
+    def search(self):
+        return self.client.post(reverse('trains:search'), {
+            'origin': 'DHK',
+            'destination': 'RJH',
+            'journey_date': self.journey_date.isoformat(),
+        })
+
+    def assertCached(self, cached=True):
+        before = search_cache_stats()
+        with CaptureQueriesContext(connection) as queries:
+            self.search()
+        after = search_cache_stats()
+        self.assertEqual(after['hits'] - before['hits'], int(cached))
+        self.assertEqual(any('trains_routepair' in query['sql'] for query in queries), not cached)
+
+    def test_repeated_search_is_served_from_cache(self):
+        self.assertCached(False)
+        self.assertCached()
+
+    def test_route_change_drops_cached_searches(self):
+        self.search()
+        Route.objects.get(train=self.train, sequence_order=2).save()
+        self.assertCached(False)
+
+    def test_booking_drops_cached_searches_only_across_threshold(self):
+        from bookings.inventory import reserve_seat
+
+        self.train.seat_classes.filter(seat_class='AC').update(coach_count=1, seats_per_coach=12)
+        self.train.seat_classes.filter(seat_class='Non-AC').delete()
+        self.search()
+        reserve_seat(self.train, self.journey_date, 'AC', 1, 3)
+        self.assertCached()
+
+        reserve_seat(self.train, self.journey_date, 'AC', 1, 3)
+        self.assertCached(False)
+        self.assertEqual(self.search().context['trains'][0]['available_seats'], 10)
+
+    def test_released_seat_brings_back_a_sold_out_train(self):
+        from bookings.inventory import release_seat, reserve_seat
+
+        self.train.seat_classes.filter(seat_class='AC').update(coach_count=1, seats_per_coach=1)
+        self.train.seat_classes.filter(seat_class='Non-AC').delete()
+        seat_number = reserve_seat(self.train, self.journey_date, 'AC', 1, 3)
+        self.assertEqual(self.search().context['trains'], [])
+
+        release_seat(self.train, self.journey_date, 'AC', 1, 3, seat_number)
+        self.assertEqual([item['train'] for item in self.search().context['trains']], [self.train])
+
+    def test_other_processes_changes_show_within_the_memo_window(self):
+        from .graph import GRAPH_VERSION_KEY
+        from .versions import VERSION_CACHE, VERSION_MEMO_SECONDS, current_version
+
+        now = monotonic() + VERSION_MEMO_SECONDS
+        with mock.patch('trains.versions.monotonic', return_value=now):
+            token = current_version(GRAPH_VERSION_KEY)
+            # Another worker invalidates through the shared backend
+            caches[VERSION_CACHE].set(GRAPH_VERSION_KEY, 'elsewhere', None)
+            self.assertEqual(current_version(GRAPH_VERSION_KEY), token)
+        with mock.patch('trains.versions.monotonic', return_value=now + VERSION_MEMO_SECONDS):
+            self.assertEqual(current_version(GRAPH_VERSION_KEY), 'elsewhere')
+
+
+class TimetableImportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.write('stations.csv', [
+            'station_code,station_name,city',
+            'DHK,Dhaka,Dhaka',
+            'TGL,Tangail,Tangail',
+            'RJH,Rajshahi,Rajshahi',
+        ])
+        self.write('trains.csv', [
+            'train_number,train_name,total_seats,total_coaches,classes_available,off_day',
+            '701,Silk City,200,4,"AC,Non-AC",Sunday',
+            '702,Padma,100,2,Non-AC,',
+        ])
+        self.write('schedules.csv', [
+            'train_number,departure_time,arrival_time,off_days,status',
+            '701,07:00,23:30,Sunday,active',
+            '702,22:00,01:30,,active',
+        ])
+        self.write('stops.csv', [
+            'train_number,sequence_order,station_code,arrival_time,departure_time,distance_from_origin,day_offset',
+            '701,1,DHK,,07:00,0,',
+            '701,2,TGL,09:00,09:05,100,',
+            '701,3,RJH,11:00,,250,',
+            '702,1,RJH,,22:00,0,',
+            '702,2,DHK,25:30,,250,',
+        ])
+
+    def write(self, name, lines):
+        (self.directory / name).write_text('\n'.join(lines) + '\n')
+
+    def test_import_builds_a_searchable_timetable(self):
+        out = StringIO()
+        call_command('import_timetable', str(self.directory), stdout=out)
+        self.assertIn('stops.csv: 5 rows', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+        silk_city = Train.objects.get(train_number='701')
+        self.assertEqual(sorted(silk_city.seat_classes.values_list('seat_class', flat=True)), ['AC', 'Non-AC'])
+        self.assertEqual(silk_city.schedule.running_days, running_days_mask('Sunday'))
+        self.assertEqual(RoutePair.objects.filter(train=silk_city).count(), 3)
+
+        last_stop = Route.objects.get(train__train_number='702', sequence_order=2)
+        self.assertEqual((last_stop.departure_time, last_stop.day_offset), (time(1, 30), 1))
+
+        monday = date.today() + timedelta(days=7 - date.today().weekday())
+        results = find_direct_trains(Station.objects.get(station_code='DHK'),
+                                     Station.objects.get(station_code='RJH'), monday)
+        self.assertEqual([item['train'].train_number for item in results], ['701'])
+        self.assertEqual(results[0]['distance'], Decimal('250.00'))
+
+    def test_invalid_route_is_skipped_and_the_old_one_kept(self):
+        TimetableImporter().import_directory(self.directory)
+        route_ids = set(Route.objects.values_list('id', flat=True))
+
+        self.write('stops.csv', [
+            'train_number,sequence_order,station_code,arrival_time,departure_time,distance_from_origin,day_offset',
+            '701,1,DHK,,07:00,0,',
+            '701,2,RJH,11:00,11:05,250,',
+            '701,3,TGL,12:00,,100,',
+            '702,1,RJH,,22:00,0,',
+            '702,1,DHK,23:00,,250,',
+            '703,1,DHK,,07:00,0,',
+        ])
+        importer = TimetableImporter()
+        importer.import_directory(self.directory)
+
+        self.assertEqual(importer.errors, [
+            'stops.csv line 4: train 701 skipped - distance_from_origin 100 is less than at the stop before',
+            'stops.csv line 6: train 702 skipped - sequence_order 1 does not follow 1',
+            "stops.csv line 7: unknown train '703'",
+        ])
+        self.assertEqual(set(Route.objects.values_list('id', flat=True)), route_ids)
+        self.assertEqual(Route.objects.get(train__train_number='701', sequence_order=2).station.station_code, 'TGL')
+
+    def test_reimport_updates_rows_in_place(self):
+        TimetableImporter().import_directory(self.directory)
+        route_ids = set(Route.objects.values_list('id', flat=True))
+
+        # Unchanged files write nothing
+        importer = TimetableImporter()
+        importer.import_directory(self.directory)
+        self.assertEqual((importer.changed_trains, importer.changed_stations), (set(), False))
+
+        self.write('stops.csv', [
+            'train_number,sequence_order,station_code,arrival_time,departure_time,distance_from_origin,day_offset',
+            '701,1,DHK,,07:00,0,',
+            '701,2,RJH,11:00,,250,',
+        ])
+        TimetableImporter().import_directory(self.directory)
+
+        self.assertTrue(set(Route.objects.values_list('id', flat=True)) < route_ids)
+        self.assertEqual(
+            list(RoutePair.objects.filter(train__train_number='701').values_list(
+                'origin_station__station_code', 'destination_station__station_code', 'distance'
+            )),
+            [('DHK', 'RJH', Decimal('250.00'))],
+        )
+
+
+class RouteEditorTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.stations = {
+            code: Station.objects.create(station_code=code, station_name=code, city=code)
+            for code in ['DHK', 'TGL', 'SRJ', 'NTR', 'RJH']
+        }
+        self.train = make_train('701', [self.stations[code] for code in ['DHK', 'TGL', 'NTR', 'RJH']])
+        self.admin = User.objects.create_user(username='admin', password='secret', role='admin')
+        self.client.force_login(self.admin)
+        self.url = reverse('trains:admin_route_stops', args=[self.train.id])
+
+    def stop(self, code, distance, departure='08:00'):
+        return {'station_code': code, 'departure_time': departure, 'distance_from_origin': distance}
+
+    def route(self):
+        return list(self.train.routes.order_by('sequence_order').values_list('sequence_order', 'station__station_code'))
+
+    def test_stop_list_is_applied_as_one_diff(self):
+        kept = dict(self.train.routes.values_list('station__station_code', 'id'))
+
+        with mock.patch('trains.route_editor.rebuild_route_index', wraps=rebuild_route_index) as editor_rebuild, \
+                mock.patch('trains.signals.rebuild_route_index') as signal_rebuild:
+            response = self.client.post(self.url, json.dumps({'stops': [
+                self.stop('DHK', 0), self.stop('SRJ', 80), self.stop('TGL', 100), self.stop('RJH', 300),
+            ]}), content_type='application/json')
+
+        self.assertEqual(response.json(), {'created': 1, 'updated': 3, 'deleted': 1})
+        self.assertEqual(self.route(), [(1, 'DHK'), (2, 'SRJ'), (3, 'TGL'), (4, 'RJH')])
+        self.assertEqual(editor_rebuild.call_count, 1)
+        self.assertEqual(signal_rebuild.call_count, 0)
+
+        # Stations the route still serves keep their rows
+        now = dict(self.train.routes.values_list('station__station_code', 'id'))
+        self.assertEqual({code: now[code] for code in ['DHK', 'TGL', 'RJH']},
+                         {code: kept[code] for code in ['DHK', 'TGL', 'RJH']})
+        self.assertEqual(RoutePair.objects.get(origin_station=self.stations['SRJ'],
+                                               destination_station=self.stations['RJH']).distance, Decimal('220.00'))
+        self.assertFalse(RoutePair.objects.filter(origin_station=self.stations['NTR']).exists())
+
+    def test_sold_and_held_seats_move_with_their_stops(self):
+        from bookings.inventory import available_seats, hold_seat, release_holds, reserve_seat
+        from bookings.models import Payment, SeatHold
+
+        self.train.seat_classes.filter(seat_class='AC').update(coach_count=1, seats_per_coach=2)
+        journey_date = date.today() + timedelta(days=1)
+        # Seat 1 sold Dhaka -> Natore, seat 2 held Tangail -> Rajshahi
+        self.assertEqual(reserve_seat(self.train, journey_date, 'AC', 1, 3), 1)
+        self.assertEqual(reserve_seat(self.train, journey_date, 'AC', 2, 4), 2)
+        booking = Payment.objects.create(
+            user=self.admin, train=self.train, train_schedule=self.train.schedule,
+            origin_station=self.stations['TGL'], destination_station=self.stations['RJH'],
+            journey_date=journey_date, seat_class='AC', seat_number=2,
+        )
+        hold_seat(booking, 2, 4)
+
+        self.client.post(self.url, json.dumps({'stops': [
+            self.stop('DHK', 0), self.stop('SRJ', 50), self.stop('TGL', 100), self.stop('NTR', 200), self.stop('RJH', 300),
+        ]}), content_type='application/json')
+
+        def seats(origin_seq, dest_seq):
+            return available_seats(self.train, journey_date, 'AC', origin_seq, dest_seq)
+
+        # Dhaka 1, Sirajganj 2, Tangail 3, Natore 4, Rajshahi 5 - both halves of the split leg keep seat 1
+        self.assertEqual([seats(leg, leg + 1) for leg in range(1, 5)], [1, 1, 0, 1])
+        self.assertEqual(seats(1, 4), 0)
+        self.assertEqual(SeatHold.objects.values_list('origin_sequence', 'destination_sequence').get(), (3, 5))
+
+        release_holds(SeatHold.objects.all())
+        self.assertEqual([seats(leg, leg + 1) for leg in range(1, 5)], [1, 1, 1, 2])
+
+    def test_invalid_stop_list_changes_nothing(self):
+        before = self.route()
+        response = self.client.post(self.url, json.dumps({'stops': [
+            self.stop('DHK', 0), self.stop('XYZ', 50), self.stop('RJH', 300), self.stop('TGL', 200),
+        ]}), content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            "Stop 2: unknown station 'XYZ'",
+            'Stop 4: distance 200 is less than at the stop before',
+        ])
+        self.assertEqual(self.route(), before)
+
+    def test_malformed_body_is_rejected(self):
+        for body in ['not json', '[]', '{"routes": []}', '{"stops": "DHK"}', '{"stops": ["DHK", "RJH"]}']:
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['errors'], ['Body must be JSON like {"stops": [...]}'])
+
+    def test_database_errors_are_not_reported_as_bad_input(self):
+        stops = json.dumps({'stops': [self.stop('DHK', 0), self.stop('RJH', 300)]})
+        with mock.patch('trains.views.apply_stops', side_effect=IntegrityError('UNIQUE constraint failed')):
+            with self.assertRaises(IntegrityError):
+                self.client.post(self.url, stops, content_type='application/json')
+
+    def test_nested_batches_keep_receivers_off_until_the_outer_one_ends(self):
+        route = self.train.routes.get(station=self.stations['TGL'])
+        with mock.patch('trains.signals.rebuild_route_index') as signal_rebuild:
+            with batched_route_changes():
+                with batched_route_changes():
+                    route.save()
+                route.save()
+            self.assertEqual(signal_rebuild.call_count, 0)
+            route.save()
+            self.assertEqual(signal_rebuild.call_count, 1)
+
+    def test_delete_closes_the_gap(self):
+        route = self.train.routes.get(station=self.stations['TGL'])
+        self.client.get(reverse('trains:admin_route_delete', args=[route.id]))
+        self.assertEqual(self.route(), [(1, 'DHK'), (2, 'NTR'), (3, 'RJH')])
+
+    def test_editor_page_saves_posted_rows(self):
+        response = self.client.post(reverse('trains:admin_route_edit', args=[self.train.id]), {
+            'station_code': ['DHK', 'RJH'],
+            'arrival_time': ['', '12:00'],
+            'departure_time': ['07:00', ''],
+            'distance_from_origin': ['0', '300'],
+            'day_offset': ['0', '0'],
+        })
+        self.assertRedirects(response, reverse('trains:admin_route_edit', args=[self.train.id]))
+        self.assertEqual(self.route(), [(1, 'DHK'), (2, 'RJH')])
+        self.assertEqual(self.train.routes.get(sequence_order=2).departure_time, time(12, 0))
+
+
+@mock.patch('trains.paging.ADMIN_PAGE_SIZE', 4)
+@mock.patch('trains.paging.COUNT_CAP', 10)
+class AdminListTests(QueryPlanMixin, TestCase):
+
+    def setUp(self):
+        self.stations = [
+            Station.objects.create(station_code=code, station_name=code, city=code)
+            for code in ['DHK', 'TGL', 'SRJ']
+        ]
+        self.trains = [make_train(str(number), self.stations) for number in range(701, 707)]
+        self.trains[0].schedule.status = 'suspended'
+        self.trains[0].schedule.save()
+        self.client.force_login(User.objects.create_user(username='admin', password='secret', role='admin'))
+
+    def walk(self, name, **filters):
+        """Every row of an admin list, following the next links - and each page's queries"""
+        url = reverse(f'trains:{name}')
+        response, statements = self.capture(self.client.get, url, filters)
+        rows, pages = list(response.context['page']), [statements]
+        while response.context['next_query']:
+            response, statements = self.capture(self.client.get, f"{url}?{response.context['next_query']}")
+            rows += response.context['page']
+            pages.append(statements)
+        return response, rows, pages
+
+    def assertReadsInIndexOrder(self, statements):
+        """Pages seek into an index and stop at the limit - no unindexed scans, no sorting every row"""
+        for sql in statements:
+            if not sql.lstrip().startswith('SELECT') or any(t in sql for t in self.IGNORED_TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                unindexed = step.startswith('SCAN') and 'INDEX' not in step and step != 'SCAN subquery'
+                self.assertFalse(unindexed, f'Unindexed scan in:\n{sql}\nPlan: {plan}')
+                self.assertNotIn('TEMP B-TREE', step, f'Sort in:\n{sql}\nPlan: {plan}')
+
+    def test_routes_are_paged_without_gaps_or_repeats(self):
+        response, rows, pages = self.walk('admin_route_list')
+        self.assertEqual([(route.train_id, route.sequence_order) for route in rows],
+                         [(train.id, sequence) for train in self.trains for sequence in (1, 2, 3)])
+        # 18 stops counted no further than the cap
+        self.assertEqual((response.context['count'], response.context['count_exact']), (10, False))
+        for statements in pages:
+            self.assertReadsInIndexOrder(statements)
+
+    def test_route_filters_are_kept_across_pages(self):
+        response, rows, pages = self.walk('admin_route_list', station='srj')
+        self.assertEqual([route.train_id for route in rows], [train.id for train in self.trains])
+        self.assertTrue(all(route.station.station_code == 'SRJ' for route in rows))
+        self.assertEqual((response.context['count'], response.context['count_exact']), (6, True))
+        for statements in pages:
+            self.assertReadsInIndexOrder(statements)
+
+        rows = self.walk('admin_route_list', train='702', station='TGL')[1]
+        self.assertEqual([(route.train_id, route.sequence_order) for route in rows], [(self.trains[1].id, 2)])
+
+    def test_trains_and_schedules_filter_by_status(self):
+        rows = self.walk('admin_train_list')[1]
+        self.assertEqual(len(rows), 6)
+        rows = self.walk('admin_train_list', status='suspended')[1]
+        self.assertEqual(rows, [self.trains[0]])
+
+        rows = self.walk('admin_schedule_list', status='active')[1]
+        self.assertEqual([schedule.train_id for schedule in rows], [train.id for train in self.trains[1:]])
+        response, rows, pages = self.walk('admin_schedule_list', status='active', train='703')
+        self.assertEqual([schedule.train_id for schedule in rows], [self.trains[2].id])
+        self.assertReadsInIndexOrder(pages[0])
+
+    def test_train_name_search_seeks_into_the_name_index(self):
+        response, rows, pages = self.walk('admin_train_list', q='Train 70')
+        self.assertEqual(rows, self.trains)
+        self.assertEqual(self.walk('admin_train_list', q='703')[1], [self.trains[2]])
+        # Any case matches - the search runs on the lower-cased name
+        self.assertEqual(self.walk('admin_train_list', q='train 70')[1], self.trains)
+        self.assertEqual(self.walk('admin_train_list', q='TRAIN 703')[1], [self.trains[2]])
+        self.assertEqual(self.walk('admin_train_list', q='tRaIn 9')[1], [])
+
+        plans = []
+        for sql in pages[0]:
+            if 'trains_train' in sql and sql.lstrip().startswith('SELECT') and 'COUNT' not in sql:
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                    plans += [row[-1] for row in cursor.fetchall()]
+        self.assertIn('SEARCH trains_train USING INDEX train_name_lower_idx (train_name_lower>? AND train_name_lower<?)', plans)
+
+    def test_malformed_cursor_starts_from_the_top(self):
+        response = self.client.get(reverse('trains:admin_route_list'), {'after': 'x|y'})
+        self.assertEqual(response.context['page'][0].train_id, self.trains[0].id)
+
+
+class StationAutocompleteTests(TestCase):
+
+    def setUp(self):
+        for code, name, city in [
+            ('DHK', 'Dhaka Kamalapur', 'Dhaka'),
+            ('DHA', 'Dhaka Airport', 'Dhaka'),
+            ('CTG', 'Chattogram', 'Chattogram'),
+            ('TGL', 'Tangail', 'Tangail'),
+        ]:
+            Station.objects.create(station_code=code, station_name=name, city=city)
+
+    def codes(self, query):
+        return [station['code'] for station in get_station_catalogue().search(query)]
+
+    def test_prefix_matches_code_name_and_city(self):
+        self.assertEqual(self.codes('dhk'), ['DHK'])
+        self.assertEqual(self.codes('Dhaka'), ['DHA', 'DHK'])
+        self.assertEqual(self.codes('kamal'), ['DHK'])
+        self.assertEqual(self.codes(''), [])
+
+    def test_close_spelling_matches_when_no_prefix_does(self):
+        self.assertEqual(self.codes('chatogram'), ['CTG'])
+
+    def test_catalogue_follows_station_changes(self):
+        self.assertEqual(self.codes('syl'), [])
+        Station.objects.create(station_code='SYL', station_name='Sylhet', city='Sylhet')
+        self.assertEqual(self.codes('syl'), ['SYL'])
+
+    def test_endpoint_returns_json_without_queries(self):
+        get_station_catalogue()
+        # The catalogue and its version token stay in memory
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('trains:station_autocomplete'), {'q': 'tan'})
+        self.assertEqual(response.json(), {'stations': [{'code': 'TGL', 'name': 'Tangail', 'city': 'Tangail'}]})
+
+        response = self.client.get(reverse('trains:home'))
+        self.assertNotContains(response, 'Chattogram')
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+
+    def setUp(self):
+        stations = [
+            Station.objects.create(station_code=code, station_name=code, city=code)
+            for code in ['DHK', 'TGL', 'SRJ', 'NAT', 'RJH']
+        ]
+        for number in range(701, 706):
+            make_train(str(number), stations)
+
+        # Built once per process, not per request
+        get_route_graph()
+        get_timetable()
+        get_fare_matrix()
+
+        self.search = {
+            'origin': 'DHK',
+            'destination': 'NAT',
+            'journey_date': (date.today() + timedelta(days=1)).isoformat(),
+        }
+
+    def test_search_queries_use_indexes(self):
+        response, statements = self.capture(self.client.post, reverse('trains:search'), self.search)
+        self.assertEqual(len(response.context['trains']), 5)
+        self.assertNoFullScans(statements)
+
+    def test_deep_search_queries_use_indexes(self):
+        token = self.client.post(reverse('trains:search'), self.search).context['search_token']
+        response, statements = self.capture(self.client.post, reverse('trains:deep_search'), {'search': token})
+        self.assertTrue(response.context['alternatives'])
+        self.assertNoFullScans(statements)
 
-# Create your tests here.
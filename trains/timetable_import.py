@@ -0,0 +1,395 @@
+import csv
+import time
+from datetime import date, time as clock
+from decimal import Decimal, InvalidOperation
+from itertools import groupby, islice
+from pathlib import Path
+from django.db import transaction
+from bookings.inventory import move_seat_legs
+from bookings.models import SeatHold, SeatSegment
+from .models import Station, Train, TrainClass, Route, TrainSchedule
+from .models import parse_classes, running_days_mask, split_coaches
+from .fares import invalidate_fare_matrix
+from .graph import invalidate_route_graph
+from .planner import invalidate_timetable
+from .route_index import rebuild_route_indexes
+from .runs import generate_runs
+from .search_cache import invalidate_station_searches
+from .signals import batched_route_changes
+from .stations import invalidate_station_catalogue
+
+# Rows written per transaction
+IMPORT_BATCH_SIZE = 2000
+
+# Rows per bulk_update statement - its CASE WHEN grows with every row
+UPDATE_BATCH_SIZE = 250
+
+# Files read from a timetable directory, in this order - any may be missing
+TIMETABLE_FILES = ['stations.csv', 'trains.csv', 'schedules.csv', 'stops.csv']
+
+
+class RowError(ValueError):
+    """A CSV row that cannot be imported - line is set once known"""
+    line = None
+
+
+def parse_clock(value):
+    """'HH:MM[:SS]' as (time, days) - GTFS-style hours past 24 roll over to the next day"""
+    parts = value.strip().split(':')
+    try:
+        if len(parts) not in (2, 3):
+            raise ValueError
+        hours, minutes, seconds = [int(part) for part in parts] + [0] * (3 - len(parts))
+        return clock(hours % 24, minutes, seconds), hours // 24
+    except ValueError:
+        raise RowError(f'bad time {value!r}')
+
+
+def _int(row, column, default=None):
+    value = (row.get(column) or '').strip()
+    if not value and default is not None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f'bad {column} {value!r}')
+
+
+def _required(row, column):
+    value = (row.get(column) or '').strip()
+    if not value:
+        raise RowError(f'missing {column}')
+    return value
+
+
+def differing(model, objects, fields):
+    """The objects whose fields differ from their saved row - one query"""
+    attnames = [model._meta.get_field(name).attname for name in fields]
+    saved = {
+        pk: tuple(values)
+        for pk, *values in model.objects.filter(pk__in=[obj.pk for obj in objects]).values_list('pk', *attnames)
+    }
+    return [obj for obj in objects if tuple(getattr(obj, name) for name in attnames) != saved.get(obj.pk)]
+
+
+def read_rows(path):
+    """(line number, row dict) for each CSV row - streamed, the file is never loaded whole"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class TimetableImporter:
+    """Upserts stations, trains, schedules and route stops from CSV files
+
+    Rows are streamed and written in batches with bulk_create/bulk_update, one
+    transaction per batch. Bad rows are skipped and listed in errors; a train
+    with any bad stop keeps its old route. Route indexes and caches are refreshed
+    once at the end, since bulk writes send no model signals.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.errors = []
+        self.report = []
+        self.station_ids = dict(Station.objects.values_list('station_code', 'id'))
+        self.train_ids = dict(Train.objects.values_list('train_number', 'id'))
+        self.changed_trains = set()
+        self.rerouted_trains = set()
+        self.left_stations = set()
+        self.changed_stations = False
+
+    def error(self, name, line, message):
+        self.errors.append(f'{name} line {line}: {message}')
+
+    def import_directory(self, directory):
+        """Import every timetable file present in a directory - Returns the report"""
+        directory = Path(directory)
+        importers = {
+            'stations.csv': self.import_stations,
+            'trains.csv': self.import_trains,
+            'schedules.csv': self.import_schedules,
+            'stops.csv': self.import_stops,
+        }
+        for name in TIMETABLE_FILES:
+            if (directory / name).exists():
+                started = time.perf_counter()
+                rows = importers[name](directory / name)
+                self.report.append((name, rows, time.perf_counter() - started))
+
+        started = time.perf_counter()
+        pairs = self.refresh()
+        self.report.append(('route index', pairs, time.perf_counter() - started))
+        return self.report
+
+    def _upsert(self, model, key, objects, fields, ids):
+        """Create or update objects keyed by a unique field - ids maps key -> pk and is kept current"""
+        new = [obj for obj in objects if getattr(obj, key) not in ids]
+        changed = [obj for obj in objects if getattr(obj, key) in ids]
+        for obj in changed:
+            obj.pk = ids[getattr(obj, key)]
+        changed = differing(model, changed, fields) if changed else []
+        with transaction.atomic():
+            model.objects.bulk_create(new, batch_size=self.batch_size)
+            model.objects.bulk_update(changed, fields, batch_size=UPDATE_BATCH_SIZE)
+        if new:
+            ids.update(model.objects.filter(**{f'{key}__in': [getattr(obj, key) for obj in new]}).values_list(key, 'pk'))
+        return new, changed
+
+    def import_stations(self, path):
+        """stations.csv: station_code, station_name, city"""
+        count = 0
+        for batch in batched(read_rows(path), self.batch_size):
+            stations = {}
+            for line, row in batch:
+                try:
+                    code = _required(row, 'station_code')
+                    name = _required(row, 'station_name')
+                except RowError as e:
+                    self.error(path.name, line, e)
+                    continue
+                stations[code] = Station(station_code=code, station_name=name, city=(row.get('city') or name).strip())
+            new, changed = self._upsert(
+                Station, 'station_code', list(stations.values()), ['station_name', 'city'], self.station_ids
+            )
+            self.changed_stations = self.changed_stations or bool(new or changed)
+            count += len(batch)
+        return count
+
+    def import_trains(self, path):
+        """trains.csv: train_number, train_name, total_seats, total_coaches, classes_available, off_day"""
+        count = 0
+        for batch in batched(read_rows(path), self.batch_size):
+            trains = {}
+            for line, row in batch:
+                try:
+                    number = _required(row, 'train_number')
+                    total_seats = _int(row, 'total_seats', 100)
+                    name = _required(row, 'train_name')
+                    trains[number] = Train(
+                        train_number=number,
+                        train_name=name,
+                        train_name_lower=name.lower(),
+                        total_seats=total_seats,
+                        available_seats=total_seats,
+                        total_coaches=_int(row, 'total_coaches', 10),
+                        classes_available=_required(row, 'classes_available'),
+                        off_day=(row.get('off_day') or '').strip(),
+                    )
+                except RowError as e:
+                    self.error(path.name, line, e)
+            new, changed = self._upsert(
+                Train, 'train_number', list(trains.values()),
+                ['train_name', 'train_name_lower', 'total_seats', 'total_coaches', 'classes_available', 'off_day'],
+                self.train_ids,
+            )
+            self._sync_seat_classes(new + changed)
+            count += len(batch)
+        return count
+
+    def _sync_seat_classes(self, trains):
+        """sync_seat_classes for a batch of trains - one read, one delete, one insert"""
+        wanted = {self.train_ids[train.train_number]: train for train in trains}
+        existing = set()
+        stale = []
+        for pk, train_id, seat_class in TrainClass.objects.filter(train_id__in=wanted).values_list(
+            'id', 'train_id', 'seat_class'
+        ):
+            if seat_class in parse_classes(wanted[train_id].classes_available):
+                existing.add((train_id, seat_class))
+            else:
+                stale.append(pk)
+
+        new = []
+        for train_id, train in wanted.items():
+            names = parse_classes(train.classes_available)
+            coach_count, seats_per_coach = split_coaches(train.total_coaches, train.total_seats, len(names))
+            new += [
+                TrainClass(train_id=train_id, seat_class=name, coach_count=coach_count, seats_per_coach=seats_per_coach)
+                for name in names if (train_id, name) not in existing
+            ]
+        with transaction.atomic():
+            TrainClass.objects.filter(pk__in=stale).delete()
+            TrainClass.objects.bulk_create(new, batch_size=self.batch_size)
+        self.changed_trains.update(wanted)
+
+    def import_schedules(self, path):
+        """schedules.csv: train_number, departure_time, arrival_time, off_days, status"""
+        schedule_ids = dict(TrainSchedule.objects.values_list('train_id', 'id'))
+        count = 0
+        for batch in batched(read_rows(path), self.batch_size):
+            schedules = {}
+            for line, row in batch:
+                try:
+                    train_id = self.train_ids.get(_required(row, 'train_number'))
+                    if train_id is None:
+                        raise RowError(f'unknown train {row["train_number"]!r}')
+                    off_days = (row.get('off_days') or '').strip()
+                    schedules[train_id] = TrainSchedule(
+                        train_id=train_id,
+                        departure_time=parse_clock(_required(row, 'departure_time'))[0],
+                        arrival_time=parse_clock(_required(row, 'arrival_time'))[0],
+                        off_days=off_days,
+                        running_days=running_days_mask(off_days),
+                        status=(row.get('status') or 'active').strip(),
+                    )
+                    if schedules[train_id].status not in ('active', 'suspended'):
+                        del schedules[train_id]
+                        raise RowError(f'bad status {row["status"]!r}')
+                except RowError as e:
+                    self.error(path.name, line, e)
+            new, changed = self._upsert(
+                TrainSchedule, 'train_id', list(schedules.values()),
+                ['departure_time', 'arrival_time', 'off_days', 'running_days', 'status'], schedule_ids,
+            )
+            self.changed_trains.update(schedule.train_id for schedule in new + changed)
+            count += len(batch)
+        return count
+
+    def _train_stops(self, train_id, rows):
+        """Validated Route objects of one train - sequence must rise and distance never fall"""
+        stops = []
+        for line, row in rows:
+            try:
+                station_id = self.station_ids.get(_required(row, 'station_code'))
+                if station_id is None:
+                    raise RowError(f'unknown station {row["station_code"]!r}')
+                sequence = _int(row, 'sequence_order')
+                try:
+                    distance = Decimal((row.get('distance_from_origin') or '0').strip())
+                except InvalidOperation:
+                    raise RowError(f'bad distance_from_origin {row["distance_from_origin"]!r}')
+
+                # The last stop often has only an arrival time
+                arrival, arrival_days = None, 0
+                if (row.get('arrival_time') or '').strip():
+                    arrival, arrival_days = parse_clock(row['arrival_time'])
+                departure, departure_days = parse_clock((row.get('departure_time') or '').strip() or row['arrival_time'])
+                day_offset = _int(row, 'day_offset', max(arrival_days, departure_days))
+
+                if stops and sequence <= stops[-1].sequence_order:
+                    raise RowError(f'sequence_order {sequence} does not follow {stops[-1].sequence_order}')
+                if distance < 0 or (stops and distance < stops[-1].distance_from_origin):
+                    raise RowError(f'distance_from_origin {distance} is less than at the stop before')
+            except (RowError, KeyError) as e:
+                error = e if isinstance(e, RowError) else RowError('missing departure_time')
+                error.line = line
+                raise error
+
+            stops.append(Route(
+                train_id=train_id,
+                station_id=station_id,
+                sequence_order=sequence,
+                arrival_time=arrival,
+                departure_time=departure,
+                distance_from_origin=distance,
+                day_offset=day_offset,
+            ))
+        return stops
+
+    def import_stops(self, path):
+        """stops.csv: train_number, sequence_order, station_code, arrival_time, departure_time,
+        distance_from_origin, day_offset - a train's stops in order, on consecutive rows
+
+        Each train's stops replace its old route.
+        """
+        count = 0
+        seen = set()
+        batch = {}
+        for number, rows in groupby(read_rows(path), key=lambda item: (item[1].get('train_number') or '').strip()):
+            rows = list(rows)
+            count += len(rows)
+            line = rows[0][0]
+            train_id = self.train_ids.get(number)
+            if train_id is None:
+                self.error(path.name, line, f'unknown train {number!r}')
+                continue
+            if train_id in seen:
+                self.error(path.name, line, f'stops of train {number} are not on consecutive rows')
+                continue
+            seen.add(train_id)
+
+            try:
+                batch[train_id] = self._train_stops(train_id, rows)
+            except RowError as e:
+                self.error(path.name, e.line, f'train {number} skipped - {e}')
+                continue
+            if sum(len(stops) for stops in batch.values()) >= self.batch_size:
+                self._write_routes(batch)
+                batch = {}
+        if batch:
+            self._write_routes(batch)
+        return count
+
+    def _write_routes(self, routes_by_train):
+        """Replace the routes of a batch of trains - stops keep their row when the sequence is unchanged"""
+        existing = {}
+        old_stations = {}
+        old_stops = {}
+        for pk, train_id, sequence, station_id, km in Route.objects.filter(
+            train_id__in=routes_by_train
+        ).order_by('train_id', 'sequence_order').values_list(
+            'id', 'train_id', 'sequence_order', 'station_id', 'distance_from_origin'
+        ):
+            existing[train_id, sequence] = pk
+            old_stations.setdefault(train_id, set()).add(station_id)
+            old_stops.setdefault(train_id, []).append((sequence, km))
+        new, changed = [], []
+        for stops in routes_by_train.values():
+            for stop in stops:
+                stop.pk = existing.pop((stop.train_id, stop.sequence_order), None)
+                (changed if stop.pk else new).append(stop)
+
+        fields = ['station', 'arrival_time', 'departure_time', 'distance_from_origin', 'day_offset']
+        changed = differing(Route, changed, fields) if changed else []
+        if not (new or changed or existing):
+            return
+
+        rerouted = {stop.train_id for stop in new + changed} | {train_id for train_id, _ in existing}
+        with transaction.atomic(), batched_route_changes():
+            Route.objects.filter(pk__in=existing.values()).delete()
+            Route.objects.bulk_update(changed, fields, batch_size=UPDATE_BATCH_SIZE)
+            Route.objects.bulk_create(new, batch_size=self.batch_size)
+            # Seat legs are keyed by sequence_order - only trains with seats sold or held need moving
+            seated = set(SeatSegment.objects.filter(
+                train_id__in=rerouted, journey_date__gte=date.today()
+            ).values_list('train_id', flat=True)) | set(SeatHold.objects.filter(
+                train_id__in=rerouted
+            ).values_list('train_id', flat=True))
+            for train in Train.objects.filter(pk__in=seated):
+                move_seat_legs(train, old_stops.get(train.id, []), [
+                    (stop.sequence_order, stop.distance_from_origin) for stop in routes_by_train[train.id]
+                ])
+        self.rerouted_trains.update(rerouted)
+        self.changed_trains.update(rerouted)
+        for train_id in rerouted:
+            self.left_stations.update(old_stations.get(train_id, ()))
+
+    def refresh(self):
+        """What the model signals would have done - once for the whole import. Returns route pairs indexed"""
+        pairs = 0
+        if self.rerouted_trains:
+            pairs = rebuild_route_indexes(self.rerouted_trains)
+            invalidate_route_graph()
+        if self.changed_trains:
+            invalidate_timetable()
+            invalidate_fare_matrix()
+            # Stations a changed route no longer stops at, then every station the trains serve now
+            invalidate_station_searches(self.left_stations)
+            train_ids = sorted(self.changed_trains)
+            for start in range(0, len(train_ids), 500):
+                invalidate_station_searches(set(Route.objects.filter(
+                    train_id__in=train_ids[start:start + 500]
+                ).values_list('station_id', flat=True)))
+                # Bulk schedule writes skipped the signal that keeps runs in step
+                generate_runs(train_ids[start:start + 500])
+        if self.changed_stations:
+            invalidate_station_catalogue()
+        return pairs
@@ -5,8 +5,10 @@ app_name = 'trains'
 
 urlpatterns = [
     path('', views.home, name="home"),
+    path('stations/', views.station_autocomplete, name="station_autocomplete"),
     path('search/', views.search_trains, name="search"),
     path('deep-search/', views.deep_search, name="deep_search"),
+    path('connections/', views.journey_planner, name="journey_planner"),
     path('train/<int:train_id>/', views.train_detail, name="train_detail"),
     
     # Admin Management URLs
@@ -19,6 +21,8 @@ urlpatterns = [
     path('manage/routes/', views.admin_route_list, name='admin_route_list'),
     path('manage/routes/add/', views.admin_route_add, name='admin_route_add'),
     path('manage/routes/<int:route_id>/delete/', views.admin_route_delete, name='admin_route_delete'),
+    path('manage/trains/<int:train_id>/route/', views.admin_route_edit, name='admin_route_edit'),
+    path('manage/trains/<int:train_id>/stops/', views.admin_route_stops, name='admin_route_stops'),
     
     path('manage/schedules/', views.admin_schedule_list, name='admin_schedule_list'),
     path('manage/schedules/<int:schedule_id>/edit/', views.admin_schedule_edit, name='admin_schedule_edit'),
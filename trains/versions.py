@@ -0,0 +1,62 @@
+import uuid
+from time import monotonic
+from django.core.cache import caches
+
+# Cache alias holding version tokens - settings.CACHES points it at Redis when
+# several worker processes run, or invalidation stays in one process
+VERSION_CACHE = 'versions'
+
+# Each process re-reads a token at most this often - a change made by another
+# process shows up within it, one made by this process at once
+VERSION_MEMO_SECONDS = 1
+
+# Tokens remembered per process before the memo starts over
+VERSION_MEMO_SIZE = 10000
+
+# key -> (token or None, monotonic time it was read)
+_memo = {}
+
+
+def _remember(tokens, now):
+    if len(_memo) + len(tokens) > VERSION_MEMO_SIZE:
+        _memo.clear()
+    _memo.update((key, (token, now)) for key, token in tokens.items())
+
+
+def get_versions(keys, default=None):
+    """Token under each key, default where there is none - one cache read, none within the memo window"""
+    now = monotonic()
+    tokens, stale = {}, []
+    for key in keys:
+        memo = _memo.get(key)
+        if memo and now - memo[1] < VERSION_MEMO_SECONDS:
+            tokens[key] = memo[0]
+        else:
+            stale.append(key)
+    if stale:
+        found = caches[VERSION_CACHE].get_many(stale)
+        found = {key: found.get(key) for key in stale}
+        _remember(found, now)
+        tokens.update(found)
+    return {key: default if token is None else token for key, token in tokens.items()}
+
+
+def set_versions(keys, timeout=None):
+    """New tokens under keys - every process holding an old one sees it is stale"""
+    tokens = {key: uuid.uuid4().hex for key in keys}
+    caches[VERSION_CACHE].set_many(tokens, timeout)
+    _remember(tokens, monotonic())
+
+
+def current_version(key):
+    """Version token under key - a missing one (never set, or evicted) starts a new version"""
+    token = get_versions([key])[key]
+    if token is None:
+        token = caches[VERSION_CACHE].get_or_set(key, uuid.uuid4().hex, None)
+        _remember({key: token}, monotonic())
+    return token
+
+
+def new_version(key):
+    """Replace the token under key"""
+    set_versions([key])
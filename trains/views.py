@@ -1,32 +1,77 @@
 from django.shortcuts import render, get_object_or_404, redirect
+import json
+from django.db.models import Q
+from django.http import JsonResponse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from .models import Train, Station, Route, TrainSchedule
+from .fares import get_fare_matrix
+from .graph import get_route_graph
+from .paging import list_page, prefix_q
+from .route_editor import RouteEditError, apply_stops, parse_stops, route_stops
+from .planner import get_timetable, minutes_to_datetime, MIN_CONNECTION_MINUTES
+from .search import find_direct_trains, find_direct_trains_to_any
+from .search_cache import get_search_results
+from .search_token import make_search_token, read_search_token
+from .stations import get_station_catalogue
+from bookings.inventory import add_available_seats
 from datetime import datetime, date, timedelta
 
+# How far (in track KM) deep search looks around the destination
+DEEP_SEARCH_RADIUS_KM = 100
+
 
 def home(request):
-    """Home Page - Search Form"""
-    stations = Station.objects.all().order_by('station_name')
+    """Home Page - Search Form (stations are suggested by station_autocomplete)"""
     today = date.today()
-    max_date = today + timedelta(days=10)
+    max_date = today + timedelta(days=settings.BOOKING_HORIZON_DAYS)
     
     context = {
-        'stations': stations,
         'today': today,
         'max_date': max_date,
     }
     
     # Pre-fill for modify search
-    if request.GET.get('modify'):
-        context['origin'] = request.session.get('search_origin')
-        context['destination'] = request.session.get('search_destination')
-        context['journey_date'] = request.session.get('journey_date')
-        context['seat_type'] = request.session.get('seat_type')
+    search = read_search_token(request)
+    if search:
+        catalogue = get_station_catalogue()
+        context['origin'] = catalogue.by_code.get(search['origin'])
+        context['destination'] = catalogue.by_code.get(search['destination'])
+        context['journey_date'] = search['journey_date']
+        context['seat_type'] = search['seat_type']
     
     return render(request, 'trains/home.html', context)
 
 
+def station_autocomplete(request):
+    """Station Suggestions - JSON for the search form's typeahead"""
+    stations = get_station_catalogue().search(request.GET.get('q', ''))
+    return JsonResponse({'stations': stations})
+
+
+def direct_search_results(origin, destination, journey_date, seat_type=''):
+    """Bookable direct trains with fares and free seats - sold out trains too, with 0 seats
+
+    The search cache keeps an entry for every train listed here, so a seat
+    released on a sold out train drops the entry; the view hides sold out
+    trains after the cache.
+    """
+    # Running day, schedule status and seat class are filtered in the query
+    trains_found = find_direct_trains(origin, destination, journey_date, seat_type)
+    
+    # Seats free on this date for each train's origin -> destination legs - and the class a booking gets
+    add_available_seats(trains_found, journey_date, seat_type)
+    
+    fares = get_fare_matrix()
+    for item in trains_found:
+        # Fares are precomputed per train, station pair and class - quoted for the class booking charges
+        fare = fares.fare(item['train'].id, origin.id, destination.id, item['seat_class'],
+                          item['distance'], item['fare_multiplier'])
+        item.update(fare._asdict())
+    return trains_found
+
+
 def search_trains(request):
     """Search Trains - Normal Search"""
     if request.method == 'POST':
@@ -35,12 +80,8 @@ def search_trains(request):
         journey_date_str = request.POST.get('journey_date')
         seat_type = request.POST.get('seat_type', '')
         
-        # Store in session for deep search
-        request.session['search_origin'] = origin_code
-        request.session['search_destination'] = destination_code
-        request.session['journey_date'] = journey_date_str
-        request.session['seat_type'] = seat_type
-        request.session['deep_search_count'] = 0
+        # Deep search, connections and booking get the search from a signed token, not the session
+        search_token = make_search_token(origin_code, destination_code, journey_date_str, seat_type)
         
         try:
             origin = Station.objects.get(station_code=origin_code)
@@ -49,14 +90,14 @@ def search_trains(request):
             
             # Validate date range
             today = date.today()
-            max_date = today + timedelta(days=10)
+            max_date = today + timedelta(days=settings.BOOKING_HORIZON_DAYS)
             
             if journey_date < today:
                 messages.error(request, 'Journey date cannot be in the past!')
                 return redirect('trains:home')
             
             if journey_date > max_date:
-                messages.error(request, 'You can only book tickets up to 10 days in advance!')
+                messages.error(request, f'You can only book tickets up to {settings.BOOKING_HORIZON_DAYS} days in advance!')
                 return redirect('trains:home')
                 
         except Station.DoesNotExist:
@@ -66,42 +107,18 @@ def search_trains(request):
             messages.error(request, 'Invalid date format!')
             return redirect('trains:home')
         
-        # Find trains that have both stations in route
-        trains_found = []
-        all_trains = Train.objects.all()
-        
-        for train in all_trains:
-            origin_route = Route.objects.filter(train=train, station=origin).first()
-            dest_route = Route.objects.filter(train=train, station=destination).first()
-            
-            if origin_route and dest_route:
-                if origin_route.sequence_order < dest_route.sequence_order:
-                    # Filter by seat type if provided
-                    if seat_type and seat_type not in train.classes_available:
-                        continue
-                    
-                    # Calculate fare
-                    distance = float(dest_route.distance_from_origin - origin_route.distance_from_origin)
-                    base_fare = distance * 2
-                    reservation = 50
-                    tax = (base_fare + reservation) * 0.05
-                    total_fare = base_fare + reservation + tax
-
-                    
-                    trains_found.append({
-                        'train': train,
-                        'origin_route': origin_route,
-                        'dest_route': dest_route,
-                        'distance': distance,
-                        'base_fare': base_fare,
-                        'total_fare': round(total_fare, 2),
-                    })
+        # Same search, same date and class - served from the results cache, sold out trains left out
+        trains_found = [item for item in get_search_results(
+            origin.id, destination.id, journey_date, seat_type,
+            lambda: direct_search_results(origin, destination, journey_date, seat_type),
+        ) if item['available_seats']]
         
         context = {
             'trains': trains_found,
             'origin': origin,
             'destination': destination,
             'journey_date': journey_date,
+            'search_token': search_token,
             'show_deep_search': True,
             'search_type': 'normal'
         }
@@ -112,104 +129,129 @@ def search_trains(request):
 
 
 def deep_search(request):
-    """Deep Search - Find trains to nearby stations"""
-    origin_code = request.session.get('search_origin')
-    destination_code = request.session.get('search_destination')
-    journey_date_str = request.session.get('journey_date')
-    deep_count = request.session.get('deep_search_count', 0)
+    """Deep Search - Find trains to every nearby station, nearest first"""
+    search = read_search_token(request)
     
-    if not all([origin_code, destination_code, journey_date_str]):
+    if not search:
         messages.error(request, 'Please perform a search first!')
         return render(request, 'trains/home.html')
     
     try:
-        origin = Station.objects.get(station_code=origin_code)
-        destination = Station.objects.get(station_code=destination_code)
-        journey_date = datetime.strptime(journey_date_str, '%Y-%m-%d').date()
+        origin = Station.objects.get(station_code=search['origin'])
+        destination = Station.objects.get(station_code=search['destination'])
+        journey_date = datetime.strptime(search['journey_date'], '%Y-%m-%d').date()
     except:
         messages.error(request, 'Invalid search data!')
         return render(request, 'trains/home.html')
     
-    dest_routes = Route.objects.filter(station=destination)
+    # Walk the station graph outwards from the destination
+    nearby = [
+        (station_id, km)
+        for station_id, km in get_route_graph().nearby_stations(destination.id, DEEP_SEARCH_RADIUS_KM)
+        if station_id != origin.id
+    ]
     
-    if not dest_routes.exists():
-        messages.error(request, f'No route information available for {destination.station_name}')
+    if not nearby:
+        messages.error(request, f'No route information available near {destination.station_name}')
         return render(request, 'trains/home.html')
     
-    dest_route = dest_routes.first()
-    train_obj = dest_route.train
-    
-    if deep_count == 0:
-        new_sequence = dest_route.sequence_order + 1
-        request.session['deep_search_count'] = 1
-        search_direction = "next"
-    elif deep_count == 1:
-        new_sequence = dest_route.sequence_order - 1
-        request.session['deep_search_count'] = 2
-        search_direction = "previous"
-    else:
-        messages.info(request, 'Deep search limit reached. No more nearby stations available.')
-        return render(request, 'trains/search_results.html', {
-            'trains': [],
-            'origin': origin,
-            'destination': destination,
-            'show_deep_search': False
-        })
-    
-    try:
-        new_dest_route = Route.objects.get(
-            train=train_obj,
-            sequence_order=new_sequence
-        )
-        new_destination = new_dest_route.station
-    except Route.DoesNotExist:
-        messages.error(request, f'No {search_direction} station found in route.')
-        return render(request, 'trains/search_results.html', {
-            'trains': [],
-            'origin': origin,
-            'destination': destination,
-            'show_deep_search': False
-        })
+    station_ids = [station_id for station_id, km in nearby]
+    seat_type = search['seat_type']
+    trains_by_station = find_direct_trains_to_any(origin, station_ids, journey_date, seat_type)
+    stations = Station.objects.in_bulk(station_ids)
     
-    trains_found = []
-    all_trains = Train.objects.all()
+    add_available_seats(
+        [item for items in trains_by_station.values() for item in items], journey_date, seat_type
+    )
     
-    for train in all_trains:
-        origin_route = Route.objects.filter(train=train, station=origin).first()
-        dest_route_new = Route.objects.filter(train=train, station=new_destination).first()
+    alternatives = []
+    fares = get_fare_matrix()
+    for station_id, extra_km in nearby:
+        trains_found = []
+        for item in trains_by_station[station_id]:
+            if not item['available_seats']:
+                continue
+            fare = fares.fare(item['train'].id, origin.id, station_id, item['seat_class'],
+                              item['distance'], item['fare_multiplier'])
+            item.update(fare._asdict())
+            trains_found.append(item)
         
-        if origin_route and dest_route_new:
-            if origin_route.sequence_order < dest_route_new.sequence_order:
-                distance = float(dest_route_new.distance_from_origin - origin_route.distance_from_origin)
-                base_fare = distance * 2
-                reservation = 50
-                tax = (base_fare + reservation) * 0.05
-                total_fare = base_fare + reservation + tax
-                trains_found.append({
-                    'train': train,
-                    'origin_route': origin_route,
-                    'dest_route': dest_route_new,
-                    'distance': distance,
-                    'base_fare': base_fare,
-                    'total_fare': round(total_fare, 2),
-                })
+        if trains_found:
+            alternatives.append({
+                'station': stations[station_id],
+                'extra_km': extra_km,
+                'trains': trains_found,
+            })
+    
+    if not alternatives:
+        messages.info(request, f'No trains found to stations within {DEEP_SEARCH_RADIUS_KM} km of {destination.station_name}.')
     
     context = {
-          
-        'trains': trains_found,
+        'alternatives': alternatives,
         'origin': origin,
-        'destination': new_destination,
-        'original_destination': destination,
+        'destination': destination,
         'journey_date': journey_date,
-        'show_deep_search': deep_count < 2,
+        'search_token': search['token'],
+        'show_deep_search': False,
         'search_type': 'deep',
-        'deep_count': deep_count
+        'radius_km': DEEP_SEARCH_RADIUS_KM,
     }
-
     
     return render(request, 'trains/search_results.html', context)
 
 
+def journey_planner(request):
+    """Connecting Journeys - Itineraries with up to two changes"""
+    search = read_search_token(request)
+    
+    if not search:
+        messages.error(request, 'Please perform a search first!')
+        return redirect('trains:home')
+    
+    try:
+        origin = Station.objects.get(station_code=search['origin'])
+        destination = Station.objects.get(station_code=search['destination'])
+        journey_date = datetime.strptime(search['journey_date'], '%Y-%m-%d').date()
+    except (Station.DoesNotExist, ValueError):
+        messages.error(request, 'Invalid search data!')
+        return redirect('trains:home')
+    
+    journeys = get_timetable().plan(origin.id, destination.id, journey_date)
+    
+    # Resolve trains and stations for every leg in two queries
+    train_ids = {leg['train_id'] for journey in journeys for leg in journey}
+    station_ids = {leg[key] for journey in journeys for leg in journey for key in ('from_station_id', 'to_station_id')}
+    trains = Train.objects.in_bulk(train_ids)
+    stations = Station.objects.in_bulk(station_ids)
+    
+    itineraries = []
+    for journey in journeys:
+        legs = [{
+            'train': trains[leg['train_id']],
+            'from_station': stations[leg['from_station_id']],
+            'to_station': stations[leg['to_station_id']],
+            'departure': minutes_to_datetime(journey_date, leg['departure']),
+            'arrival': minutes_to_datetime(journey_date, leg['arrival']),
+        } for leg in journey]
+        itineraries.append({
+            'legs': legs,
+            'changes': len(legs) - 1,
+            'departure': legs[0]['departure'],
+            'arrival': legs[-1]['arrival'],
+        })
+    
+    context = {
+        'itineraries': itineraries,
+        'origin': origin,
+        'destination': destination,
+        'journey_date': journey_date,
+        'search_token': search['token'],
+        'min_connection': MIN_CONNECTION_MINUTES,
+    }
+    
+    return render(request, 'trains/journey_results.html', context)
+
+
 def train_detail(request, train_id):
     """Train Details"""
     train = get_object_or_404(Train, id=train_id)
@@ -238,9 +280,18 @@ def admin_required(view_func):
 
 @admin_required
 def admin_train_list(request):
-    """Admin: List all trains"""
-    trains = Train.objects.all()
-    return render(request, 'trains/admin/train_list.html', {'trains': trains})
+    """Admin: List trains - one keyset page, filtered by number or name start (?q=, any case) and schedule status"""
+    trains = Train.objects.select_related('schedule')
+    q = request.GET.get('q', '').strip()
+    if q:
+        trains = trains.filter(Q(train_number=q) | prefix_q('train_name_lower', q.lower()))
+    status = request.GET.get('status', '')
+    if status:
+        trains = trains.filter(schedule__status=status)
+
+    context = list_page(request, trains, ['train_name', 'id'])
+    context.update({'q': q, 'status': status})
+    return render(request, 'trains/admin/train_list.html', context)
 
 
 @admin_required
@@ -294,9 +345,18 @@ def admin_train_delete(request, train_id):
 
 @admin_required
 def admin_route_list(request):
-    """Admin: List all routes"""
-    routes = Route.objects.all().select_related('train', 'station')
-    return render(request, 'trains/admin/route_list.html', {'routes': routes})
+    """Admin: List routes - one keyset page, filtered by train number and station code"""
+    routes = Route.objects.select_related('train', 'station')
+    train = request.GET.get('train', '').strip()
+    if train:
+        routes = routes.filter(train__train_number=train)
+    station = request.GET.get('station', '').strip().upper()
+    if station:
+        routes = routes.filter(station__station_code=station)
+
+    context = list_page(request, routes, ['train_id', 'sequence_order'])
+    context.update({'train': train, 'station': station})
+    return render(request, 'trains/admin/route_list.html', context)
 
 
 @admin_required
@@ -324,18 +384,84 @@ def admin_route_add(request):
 
 @admin_required
 def admin_route_delete(request, route_id):
-    """Admin: Delete route"""
+    """Admin: Delete route - the stops after it move up, so sequence numbers stay 1..n"""
     route = get_object_or_404(Route, id=route_id)
-    route.delete()
+    remaining = [stop for stop in route_stops(route.train) if stop['sequence_order'] != route.sequence_order]
+    try:
+        apply_stops(route.train, parse_stops(remaining))
+    except RouteEditError:
+        # Fewer than two stops left - nothing to re-sequence
+        route.delete()
     messages.success(request, 'Route deleted successfully!')
     return redirect('trains:admin_route_list')
 
 
+def _posted_stops(request):
+    """Stop rows of the route editor form - parallel lists, one entry per row"""
+    columns = ['station_code', 'arrival_time', 'departure_time', 'distance_from_origin', 'day_offset']
+    values = [request.POST.getlist(column) for column in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+@admin_required
+def admin_route_edit(request, train_id):
+    """Admin: Edit a train's whole stop list - saved as one diff"""
+    train = get_object_or_404(Train, id=train_id)
+    stops = route_stops(train)
+    
+    if request.method == 'POST':
+        stops = _posted_stops(request)
+        try:
+            result = apply_stops(train, parse_stops(stops))
+        except RouteEditError as e:
+            for error in e.errors:
+                messages.error(request, error)
+        else:
+            messages.success(
+                request,
+                f'Route of {train.train_name} saved: {result["created"]} added, '
+                f'{result["updated"]} changed, {result["deleted"]} removed.'
+            )
+            return redirect('trains:admin_route_edit', train_id=train.id)
+    
+    return render(request, 'trains/admin/route_edit.html', {'train': train, 'stops': stops})
+
+
+@admin_required
+def admin_route_stops(request, train_id):
+    """Admin API: GET a train's stops as JSON, POST {"stops": [...]} to replace them as one diff"""
+    train = get_object_or_404(Train, id=train_id)
+    
+    if request.method == 'POST':
+        try:
+            stops = json.loads(request.body)['stops']
+        except (ValueError, KeyError, TypeError):
+            stops = None
+        if not isinstance(stops, list) or not all(isinstance(stop, dict) for stop in stops):
+            return JsonResponse({'errors': ['Body must be JSON like {"stops": [...]}']}, status=400)
+        try:
+            result = apply_stops(train, parse_stops(stops))
+        except RouteEditError as e:
+            return JsonResponse({'errors': e.errors}, status=400)
+        return JsonResponse(result)
+    
+    return JsonResponse({'train': train.train_number, 'stops': route_stops(train)})
+
+
 @admin_required
 def admin_schedule_list(request):
-    """Admin: List all schedules"""
-    schedules = TrainSchedule.objects.all().select_related('train')
-    return render(request, 'trains/admin/schedule_list.html', {'schedules': schedules})
+    """Admin: List schedules - one keyset page, filtered by train number and status"""
+    schedules = TrainSchedule.objects.select_related('train')
+    train = request.GET.get('train', '').strip()
+    if train:
+        schedules = schedules.filter(train__train_number=train)
+    status = request.GET.get('status', '')
+    if status:
+        schedules = schedules.filter(status=status)
+
+    context = list_page(request, schedules, ['train_id'])
+    context.update({'train': train, 'status': status})
+    return render(request, 'trains/admin/schedule_list.html', context)
 
 
 @admin_required